@@ -1,4 +1,22 @@
-from .ca import *
 from .info_measures import *
-from .calculations import *
-from .plots import *
\ No newline at end of file
+##The other modules load the structures, networkx and matplotlib: they are imported when one of their names is first used
+
+_LAZY_MODULES = ("ca", "calculations", "tracking", "plots")
+
+def _public_names(module) -> list:
+    return list(getattr(module, "__all__", [name for name in vars(module) if not name.startswith("_")]))
+
+def __getattr__(name: str):
+    import importlib #Lazy import, only on the first use of a name of the other modules
+    if name == "__all__":
+        #from higherorder.analysis import *: the names of all modules
+        modules = [info_measures] + [importlib.import_module(f".{module_name}", __name__) for module_name in _LAZY_MODULES]
+        return list(dict.fromkeys(n for module in modules for n in _public_names(module)))
+    for module_name in _LAZY_MODULES:
+        module = importlib.import_module(f".{module_name}", __name__)
+        if name in globals(): #a submodule
+            return globals()[name]
+        if not name.startswith("_") and name in vars(module):
+            globals()[name] = vars(module)[name]
+            return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
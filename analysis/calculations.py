@@ -1,3 +1,6 @@
+import numpy as np
+from typing import Dict, List
+from higherorder.dynamics.impacts import ImpactLog
 #2 blobs distance stats
 # ...
 
@@ -83,77 +86,220 @@ def group_impact_strength(impacts: dict, group: set,
         return ratio, I, O, S_expected
     return ratio
 
-def find_self_controlling_group(impacts: dict, nodes: set,
-                                min_group_size = 4):
+def group_membership(groups: List[set], entity_list: List):
     """
-    Greedy algorithm to find a strongly self-controlling group.
+    The (groups x entities) 0/1 scipy.sparse membership matrix of groups given as sets of entities,
+        with entities in the order of entity_list (e.g. ImpactLog.entity_list); other entities are left out.
+    """
+    from scipy import sparse #Lazy import, scipy is only needed for the batch group metrics
+    entity_index = {entity: i for i, entity in enumerate(entity_list)}
+    rows, columns = [], []
+    for row, group in enumerate(groups):
+        ids = [entity_index[entity] for entity in group if entity in entity_index]
+        rows += [row] * len(ids)
+        columns += ids
+    return sparse.csr_matrix((np.ones(len(rows)), (rows, columns)), shape=(len(groups), len(entity_list)))
+
+def group_metrics(impacts, groups, timestep_names: List[str] = None, total_nodes: int = None) -> Dict:
+    """
+    impact_group_ratio and group_impact_strength of many groups at many timesteps at once, with sparse
+        matrix products instead of walking the impacts per group and timestep.
 
     Args:
-        impacts: dict of (src, tgt) -> any
+        impacts: ImpactLog (e.g. model.impact) or dict of timestep -> impacts dict
+        groups: (groups x entities) membership matrix (numpy or scipy.sparse, entities in the order of
+            the ImpactLog entity_list), or a list of sets of entities (e.g. of tracked components)
+        timestep_names: timesteps to compute (default: all, in key order)
+        total_nodes: as in group_impact_strength (default: the entities involved in the impacts of each timestep)
+
+    Returns:
+        dict of (groups x timesteps) arrays: "ratio", "between", "total" (impact_group_ratio),
+            "strength", "I", "O", "S_expected" (group_impact_strength), and "timesteps": the timestep names
+    """
+    from scipy import sparse #Lazy import, scipy is only needed for the batch group metrics
+    log = ImpactLog.from_dict(impacts)
+    timestep_names = list(log) if timestep_names is None else list(timestep_names)
+    if isinstance(groups, (list, tuple)):
+        sizes = np.array([len(group) for group in groups], dtype=np.int64)
+        membership = group_membership(groups, log.entity_list).tocsc()
+    else:
+        membership = sparse.csc_matrix(groups, dtype=float)
+        membership.data = (membership.data != 0).astype(float)
+        membership.eliminate_zeros()
+        sizes = np.asarray(membership.sum(axis=1)).ravel().astype(np.int64)
+
+    steps = [log.step_arrays(key_name) for key_name in timestep_names]
+    lengths = [len(sources) for sources, _, _ in steps]
+    sources = np.concatenate([sources for sources, _, _ in steps] + [np.zeros(0, dtype=np.int64)])
+    targets = np.concatenate([targets for _, targets, _ in steps] + [np.zeros(0, dtype=np.int64)])
+    step_ids = np.repeat(np.arange(len(steps)), lengths)
+    num_entities = max(membership.shape[1], len(log.entity_list))
+    if membership.shape[1] < num_entities:
+        membership = sparse.hstack([membership, sparse.csc_matrix((membership.shape[0], num_entities - membership.shape[1]))]).tocsc()
+
+    #(impacts x timesteps) indicator, and which groups the source and the target of every impact are in
+    timesteps = sparse.csr_matrix((np.ones(len(step_ids)), (np.arange(len(step_ids)), step_ids)),
+                                  shape=(len(step_ids), len(steps)))
+    source_in, target_in = membership[:, sources], membership[:, targets]
+    between = np.rint((source_in.multiply(target_in) @ timesteps).toarray()).astype(np.int64)
+    total = np.rint((source_in @ timesteps + target_in @ timesteps).toarray()).astype(np.int64) - between
+
+    if total_nodes is None:
+        #Distinct entities involved in the impacts of each timestep
+        involved = np.unique(np.concatenate([step_ids, step_ids]) * num_entities + np.concatenate([sources, targets]))
+        n = np.bincount(involved // max(num_entities, 1), minlength=len(steps))
+    else:
+        n = np.full(len(steps), total_nodes)
+    k, n = sizes[:, None], n[None, :]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(total > 0, between / total, 0.0)
+        I, O = 2 * between, total - between
+        S = np.where(I + O > 0, I / (I + O), 0.0)
+        S_expected = np.where((n <= 1) | (k <= 1) | (n == k), 1.0, (k - 1) / (n - 1))
+        strength = np.where(S_expected > 0, S / S_expected, 0.0)
+    return {"ratio": ratio, "between": between, "total": total,
+            "strength": strength, "I": I, "O": O, "S_expected": S_expected,
+            "timesteps": timestep_names}
+
+class ImpactMultigraph:
+    """
+    Index of impacts (src, tgt) as an undirected multigraph over integer node ids, for searching groups:
+        every impact is kept (repeated impacts, e.g. from flatten_impacts_all_time, count as often
+        as they occur), and the other ends of the impacts of node i are
+        neighbours[indptr[i]:indptr[i+1]] (self impacts excluded).
+
+    - node_list, node_index: the nodes (the given nodes first, then other nodes of the impacts)
+    - degrees: number of impacts of every node (a self impact counts once), self_impacts: of them to itself
+    """
+    def __init__(self, impacts, nodes=None):
+        pairs = list(impacts.keys() if isinstance(impacts, dict) else impacts)
+        node_index = {}
+        for node in (nodes or []):
+            node_index.setdefault(node, len(node_index))
+        for src, tgt in pairs:
+            node_index.setdefault(src, len(node_index))
+            node_index.setdefault(tgt, len(node_index))
+        self.node_index = node_index
+        self.node_list = list(node_index)
+        n = len(node_index)
+        self.sources = np.fromiter((node_index[src] for src, _ in pairs), dtype=np.int64, count=len(pairs))
+        self.targets = np.fromiter((node_index[tgt] for _, tgt in pairs), dtype=np.int64, count=len(pairs))
+        loop = self.sources == self.targets
+        self.self_impacts = np.bincount(self.sources[loop], minlength=n)
+        self.degrees = (np.bincount(self.sources, minlength=n) + np.bincount(self.targets, minlength=n)
+                        - self.self_impacts)
+        ends = np.concatenate([self.sources[~loop], self.targets[~loop]])
+        others = np.concatenate([self.targets[~loop], self.sources[~loop]])
+        order = np.argsort(ends, kind="stable")
+        self.neighbours = others[order]
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(ends, minlength=n))])
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.node_list)
+
+    def first_appearance_order(self) -> np.ndarray:
+        """Node ids of the impacts in order of their first appearance (src before tgt)."""
+        ends = np.stack([self.sources, self.targets], axis=1).ravel()
+        _, first = np.unique(ends, return_index=True)
+        return ends[np.sort(first)]
+
+def _group_ratio(I, O, k, n):
+    """S / S_expected of groups of k nodes out of n, with I and O as in group_impact_strength (0 if undefined)."""
+    I, O, k = np.asarray(I, dtype=float), np.asarray(O, dtype=float), np.asarray(k, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        S = np.where(I + O > 0, I / (I + O), 0.0)
+        S_expected = np.where((k > 1) & (n > k), (k - 1) / max(n - 1, 1), 0.0)
+        return np.where(S_expected > 0, S / S_expected, 0.0)
+
+def find_self_controlling_groups(impacts, nodes: set, seeds: list = None,
+                                 min_group_size = 4, return_ratios = False):
+    """
+    Greedy search of strongly self-controlling groups, grown from several seed nodes at once.
+
+    Every seed starts a group, which repeatedly adds the candidate node that gives the highest
+        S / S_expected (see group_impact_strength), while that improves it or the group is smaller than
+        min_group_size. The impacts are indexed once (ImpactMultigraph) and for every group the number
+        of impacts between each node and the group is kept, updated in O(degree) when a node is added,
+        so a step scores all candidates at once instead of rescanning the impacts per candidate.
+
+    Args:
+        impacts: dict of (src, tgt) -> any, or a list of (src, tgt) (e.g. flatten_impacts_all_time)
         nodes: full set of nodes to select from
+        seeds: nodes to start from (default: the node with the most impacts)
+        return_ratios: also return the S / S_expected of every group
 
     Returns:
-        group: set of nodes with strong internal impact
+        list of groups (sets of nodes), one per seed, optionally with their ratios
     """
-    # Compute total nodes
+    graph = ImpactMultigraph(impacts, nodes)
     n = len(nodes)
+    num_nodes = graph.num_nodes
+    candidate = np.zeros(num_nodes, dtype=bool)
+    candidate[:len(set(nodes))] = True
+    if seeds is None:
+        if not len(graph.sources):
+            return ([], []) if return_ratios else []
+        #Most impacts, first appearing in the impacts on ties (as dict insertion order)
+        order = graph.first_appearance_order()
+        seeds = [graph.node_list[order[np.argmax(graph.degrees[order] + graph.self_impacts[order])]]]
+    seed_ids = np.array([graph.node_index[seed] for seed in seeds], dtype=np.int64)
 
-    # Step 1: Find node with max impact (appearances)
-    impact_counts = {}
-    for src, tgt in impacts:
-        impact_counts[src] = impact_counts.get(src, 0) + 1
-        impact_counts[tgt] = impact_counts.get(tgt, 0) + 1
+    m = len(seed_ids)
+    rows = np.arange(m)
+    in_group = np.zeros((m, num_nodes), dtype=bool)
+    links = np.zeros((m, num_nodes), dtype=np.int64) #impacts between a node and the group
+    I = np.zeros(m, dtype=np.int64)
+    O = np.zeros(m, dtype=np.int64)
+    k = np.zeros(m, dtype=np.int64)
+    ratios = np.zeros(m)
 
-    current_group = {max(impact_counts, key=impact_counts.get)}
-    candidate_nodes = nodes - current_group
+    def add(rows, added):
+        #Impacts of the added nodes to the group become inner, their other impacts outer
+        I[rows] += 2 * (links[rows, added] + graph.self_impacts[added])
+        O[rows] += graph.degrees[added] - graph.self_impacts[added] - 2 * links[rows, added]
+        k[rows] += 1
+        in_group[rows, added] = True
+        starts, ends = graph.indptr[added], graph.indptr[added + 1]
+        lengths = ends - starts
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(int(lengths.sum()))
+        np.add.at(links, (np.repeat(rows, lengths), graph.neighbours[positions]), 1)
 
-    # Step 2: Greedy addition
-    improved = True
-    I = O = 0
-    for src, tgt in impacts:
-        if src in current_group and tgt in current_group:
-            I += 2
-        elif src in current_group or tgt in current_group:
-            O += 1
+    add(rows, seed_ids)
+    ratios[:] = _group_ratio(I, O, k, n)
+    active = rows
+    while len(active):
+        available = candidate & ~in_group[active]
+        scores = _group_ratio(I[active, None] + 2 * (links[active] + graph.self_impacts),
+                              O[active, None] + graph.degrees - graph.self_impacts - 2 * links[active],
+                              k[active, None] + 1, n)
+        scores = np.where(available, scores, -np.inf)
+        best = np.argmax(scores, axis=1)
+        best_scores = scores[np.arange(len(active)), best]
+        grow = available.any(axis=1) & ((best_scores > ratios[active]) | (k[active] < min_group_size))
+        active, best, best_scores = active[grow], best[grow], best_scores[grow]
+        if len(active):
+            add(active, best)
+            ratios[active] = best_scores
 
-    def compute_ratio(I, O, k, n):
-        S = I / (I + O) if (I + O) > 0 else 0
-        S_expected = (k-1)/(n-1) if k > 1 and n > k else 0
-        return S / S_expected if S_expected > 0 else 0
-
-    current_ratio = compute_ratio(I, O, len(current_group), n)
-
-    while improved:
-        improved = False
-        #best_ratio = current_ratio
-        best_node = None
-
-        for node in candidate_nodes:
-            new_I = I
-            new_O = O
-            max_ratio = 0
-            for src, tgt in impacts:
-                in_group_src = src in current_group
-                in_group_tgt = tgt in current_group
-                if node == src and in_group_tgt:
-                    new_I += 2
-                elif node == tgt and in_group_src:
-                    new_I += 2
-                elif node == src or node == tgt:
-                    new_O += 1
-
-            new_k = len(current_group) + 1
-            new_ratio = compute_ratio(new_I, new_O, new_k, n)
-            if new_ratio > max_ratio:
-                max_ratio = new_ratio
-                best_node = node
-                best_I = new_I
-                best_O = new_O
-
-        if (max_ratio > current_ratio or len(current_group) < min_group_size):
-            current_group.add(best_node)
-            candidate_nodes.remove(best_node)
-            I, O = best_I, best_O
-            current_ratio = max_ratio
-            improved = True
-    return current_group
+    node_list = graph.node_list
+    groups = [{node_list[i] for i in np.flatnonzero(in_group[row]).tolist()} for row in rows]
+    if return_ratios:
+        return groups, ratios.tolist()
+    return groups
+
+def find_self_controlling_group(impacts, nodes: set,
+                                min_group_size = 4, seed = None):
+    """
+    Greedy algorithm to find a strongly self-controlling group.
+
+    Args:
+        impacts: dict of (src, tgt) -> any, or a list of (src, tgt) (e.g. flatten_impacts_all_time)
+        nodes: full set of nodes to select from
+        seed: node to start from (default: the node with the most impacts)
+
+    Returns:
+        group: set of nodes with strong internal impact (see find_self_controlling_groups)
+    """
+    groups = find_self_controlling_groups(impacts, nodes, None if seed is None else [seed], min_group_size)
+    return groups[0] if groups else set()
@@ -1,10 +1,14 @@
-from hoi.metrics import DTC, TC, RedundancyMMI, SynergyMMI
-from hoi.metrics import Oinfo, GradientOinfo
+import hashlib
+import numpy as np
+from collections import OrderedDict
+from itertools import combinations
+from typing import Dict, Iterable, List, Tuple
 
-#TODO mutual information, autocorrelation....
+#TODO autocorrelation....
 
 def compute_hoi_beh(x, nonzero_only=False, k=3, l=3):
     """This function computes the HOI using the Oinfo."""
+    from hoi.metrics import Oinfo #Lazy import, hoi loads jax
     model = Oinfo(x, verbose=False)
     hoi = model.fit(method="binning", minsize=k, maxsize=l)
     hoi = hoi.squeeze()
@@ -14,6 +18,7 @@ def compute_hoi_beh(x, nonzero_only=False, k=3, l=3):
 
 def compute_hoi_enc(x, y, nonzero_only=False, k=3, l=3):
     """This function computes the HOI using the Oinfo."""
+    from hoi.metrics import GradientOinfo #Lazy import, hoi loads jax
     model = GradientOinfo(x, y, verbose=False)
     hoi = model.fit(method="binning", minsize=k, maxsize=l)
     hoi = hoi.squeeze()
@@ -23,6 +28,7 @@ def compute_hoi_enc(x, y, nonzero_only=False, k=3, l=3):
 
 def compute_redundancyMMI(x, y, nonzero_only=False, k=3, l=3):
     """This function computes the HOI using the RedundancyMMI."""
+    from hoi.metrics import RedundancyMMI #Lazy import, hoi loads jax
     model = RedundancyMMI(x, y, verbose=False)
     hoi = model.fit(method="binning", minsize=k, maxsize=l)
     hoi = hoi.squeeze()
@@ -32,6 +38,7 @@ def compute_redundancyMMI(x, y, nonzero_only=False, k=3, l=3):
 
 def compute_synergyMMI(x, y, nonzero_only=False, k=3, l=3):
     """This function computes the HOI using the SynergyMMI."""
+    from hoi.metrics import SynergyMMI #Lazy import, hoi loads jax
     model = SynergyMMI(x, y, verbose=False)
     hoi = model.fit(method="binning", minsize=k, maxsize=l)
     hoi = hoi.squeeze()
@@ -41,6 +48,7 @@ def compute_synergyMMI(x, y, nonzero_only=False, k=3, l=3):
 
 def compute_TC(x, y, nonzero_only=False, k=3, l=3):
     """This function computes the HOI using the TC."""
+    from hoi.metrics import TC #Lazy import, hoi loads jax
     model = TC(x, y, verbose=False)
     hoi = model.fit(method="binning", minsize=k, maxsize=l)
     hoi = hoi.squeeze()
@@ -50,6 +58,7 @@ def compute_TC(x, y, nonzero_only=False, k=3, l=3):
 
 def compute_DTC(x, y, nonzero_only=False, k=3, l=3):
     """This function computes the HOI using the DTC."""
+    from hoi.metrics import DTC #Lazy import, hoi loads jax
     model = DTC(x, y, verbose=False)
     hoi = model.fit(method="binning", minsize=k, maxsize=l)
     hoi = hoi.squeeze()
@@ -59,9 +68,375 @@ def compute_DTC(x, y, nonzero_only=False, k=3, l=3):
 
 def compute_oinfo(x, y, nonzero_only=False, k=3, l=3):
     """This function computes the HOI using the Oinfo."""
+    from hoi.metrics import Oinfo #Lazy import, hoi loads jax
     model = Oinfo(x, y, verbose=False)
     hoi = model.fit(method="binning", minsize=k, maxsize=l)
     hoi = hoi.squeeze()
     if nonzero_only:
         return hoi[hoi != 0]
-    return hoi
\ No newline at end of file
+    return hoi
+
+##shared estimator: the metrics above from one table of entropies per dataset, instead of a hoi fit per metric
+
+HOI_METRICS = ("SynergyMMI", "RedundancyMMI", "TC", "DTC", "Oinfo", "GradientOinfo")
+HOI_CACHE_SIZE = 32
+BINCOUNT_MAX_STATES = 1 << 20 #joint states of a multiplet counted with np.bincount, beyond with np.unique
+BINCOUNT_CHUNK_CELLS = 1 << 24 #bins (and joint codes) counted at once
+_hoi_cache = OrderedDict() #content hash of (x, y): BinnedHOI, least recently used first
+
+class BinnedHOI:
+    """
+    The hoi metrics of discrete data (the "binning" method of hoi, in bits) from shared entropies: the joint
+        entropy of every set of features is computed once, counting the joint states of the samples with
+        np.bincount (exact, without the hoi/jax stack), and reused by all metrics and multiplet sizes.
+
+    x: integer array of shape (n_samples, n_features) or (n_samples, n_features, n_variables), y: the target
+        (n_samples,) or (n_samples, n_features_y), as for the hoi metrics. With y, TC, DTC and Oinfo are
+        task-related (the target is part of every multiplet), as in the compute_* functions.
+    """
+    def __init__(self, x, y=None):
+        x = np.asarray(x)
+        if x.ndim == 2:
+            x = x[..., np.newaxis]
+        if x.ndim != 3 or not (np.issubdtype(x.dtype, np.integer) or x.dtype == bool):
+            raise ValueError("x should be a 2D or 3D integer or boolean array (discretized data, as for the binning method of hoi).")
+        n_samples, self.n_features_x, self.n_variables = x.shape
+        self.n_features_y = 0
+        if y is not None:
+            y = np.asarray(y)
+            if y.shape[0] != n_samples:
+                raise ValueError(f"The number of samples of y ({y.shape[0]}) should match the samples of x ({n_samples}).")
+            if y.ndim == 1:
+                y = y[:, np.newaxis]
+            if y.ndim == 2:
+                y = np.repeat(y[:, :, np.newaxis], self.n_variables, axis=2)
+            self.n_features_y = y.shape[1]
+            x = np.concatenate([x, y.astype(x.dtype)], axis=1)
+        self.n_samples = n_samples
+        self.target = tuple(range(self.n_features_x, self.n_features_x + self.n_features_y))
+        #Codes from 0 for every (feature, variable), with the number of codes as radix of the joint codes
+        codes = x.astype(np.int64)
+        codes -= codes.min(axis=0)
+        self.levels = codes.max(axis=0, initial=0) + 1
+        for feature, variable in zip(*np.nonzero(self.levels > n_samples)): #sparse values, make them dense
+            values, codes[:, feature, variable] = np.unique(codes[:, feature, variable], return_inverse=True)
+            self.levels[feature, variable] = len(values)
+        self.codes = codes
+        self._entropies = [{(): 0.0} for _ in range(self.n_variables)] #features: entropy
+        self._results = {}
+
+    def _count_entropies(self, subsets: np.ndarray, variable: int) -> np.ndarray:
+        """
+        Entropies of subsets of the same size (n_subsets, size): the joint states of every subset are encoded
+            as integers (mixed radix of the feature codes) and counted together with one np.bincount.
+        """
+        n_subsets, size = subsets.shape
+        radices = self.levels[subsets, variable]
+        weights = np.cumprod(np.concatenate([np.ones((n_subsets, 1), dtype=np.int64), radices[:, :-1]], axis=1), axis=1)
+        states = np.prod(radices.astype(np.float64), axis=1)
+        entropies = np.empty(n_subsets)
+        log_n = np.log2(self.n_samples)
+        if states.max(initial=0) > BINCOUNT_MAX_STATES: #too many joint states to count in bins
+            for i, subset in enumerate(subsets):
+                counts = np.unique(self.codes[:, subset, variable], axis=0, return_counts=True)[1]
+                entropies[i] = log_n - (counts * np.log2(counts)).sum() / self.n_samples
+            return entropies
+        num_states = int(states.max(initial=1))
+        chunk = max(1, BINCOUNT_CHUNK_CELLS // max(num_states, self.n_samples * size))
+        codes = self.codes[:, :, variable]
+        for start in range(0, n_subsets, chunk):
+            end = min(start + chunk, n_subsets)
+            joint = (codes[:, subsets[start:end]] * weights[start:end]).sum(axis=2)
+            joint += np.arange(end - start) * num_states
+            counts = np.bincount(joint.ravel(), minlength=(end - start) * num_states).reshape(end - start, num_states)
+            plogp = counts * np.log2(np.maximum(counts, 1))
+            entropies[start:end] = log_n - plogp.sum(axis=1) / self.n_samples
+        return entropies
+
+    def entropies(self, subsets: List[Tuple], variable: int = 0) -> np.ndarray:
+        """Joint entropies (bits) of sets of features (indices of x, then of y), counting the new ones by size."""
+        subsets = [tuple(sorted(subset)) for subset in subsets]
+        entropies = self._entropies[variable]
+        missing = {}
+        for subset in subsets:
+            if subset not in entropies:
+                missing.setdefault(len(subset), set()).add(subset)
+        for size in sorted(missing):
+            new = sorted(missing[size])
+            entropies.update(zip(new, self._count_entropies(np.array(new, dtype=np.int64).reshape(len(new), size), variable).tolist()))
+        return np.array([entropies[subset] for subset in subsets])
+
+    def entropy(self, features, variable: int = 0) -> float:
+        """Joint entropy (bits) of a set of features (indices of x, then of y)."""
+        features = tuple(sorted(features))
+        entropies = self._entropies[variable]
+        if features not in entropies:
+            self.entropies([features], variable)
+        return entropies[features]
+
+    def _needed(self, multiplet: Tuple) -> List[Tuple]:
+        """The sets of features whose entropies the metrics of the multiplet use."""
+        needed = []
+        for features in ((multiplet + self.target, multiplet) if self.target else (multiplet,)):
+            needed += [features] + [features[:j] + features[j + 1:] for j in range(len(features))]
+            needed += [(j,) for j in features]
+        if self.target:
+            needed += [subset + self.target for subset in needed if len(subset) < len(multiplet)] + [self.target]
+        return needed
+
+    def _mi(self, features: Tuple, variable: int) -> float:
+        """Mutual information of the features with the target."""
+        return (self.entropy(features, variable) + self.entropy(self.target, variable)
+                - self.entropy(features + self.target, variable))
+
+    def _oinfo(self, features: Tuple, variable: int) -> float:
+        n = len(features)
+        return ((n - 2) * self.entropy(features, variable)
+                + sum(self.entropy((j,), variable) for j in features)
+                - sum(self.entropy(features[:j] + features[j + 1:], variable) for j in range(n)))
+
+    def _metric(self, metric: str, multiplet: Tuple, variable: int) -> float:
+        features = multiplet + self.target
+        n = len(features)
+        if metric == "TC":
+            return sum(self.entropy((j,), variable) for j in features) - self.entropy(features, variable)
+        if metric == "DTC":
+            return (sum(self.entropy(features[:j] + features[j + 1:], variable) for j in range(n))
+                    - (n - 1) * self.entropy(features, variable))
+        if metric == "Oinfo":
+            return self._oinfo(features, variable)
+        if metric == "GradientOinfo":
+            return self._oinfo(features, variable) - self._oinfo(multiplet, variable)
+        if metric == "RedundancyMMI":
+            return min(self._mi((j,), variable) for j in multiplet)
+        if metric == "SynergyMMI":
+            return self._mi(multiplet, variable) - max(self._mi(multiplet[:j] + multiplet[j + 1:], variable)
+                                                       for j in range(len(multiplet)))
+        raise ValueError(f"metric must be one of {HOI_METRICS}, not {metric}")
+
+    def multiplets(self, minsize: int = 2, maxsize: int = None) -> List[Tuple]:
+        """The multiplets of x features from minsize to maxsize, in the order of the hoi outputs."""
+        if maxsize is None:
+            maxsize = self.n_features_x + self.n_features_y
+        maxsize = max(1, min(maxsize, self.n_features_x + self.n_features_y))
+        return [multiplet for size in range(max(1, minsize), maxsize + 1)
+                for multiplet in combinations(range(self.n_features_x), size)]
+
+    def fit(self, metric: str, minsize: int = 2, maxsize: int = None) -> np.ndarray:
+        """
+        The metric of every multiplet, shape (n_multiplets, n_variables), as the fit of the hoi metric
+            with method="binning" (results are kept, so refitting is free).
+        """
+        if metric in ("SynergyMMI", "RedundancyMMI", "GradientOinfo") and not self.target:
+            raise ValueError(f"{metric} needs a target y.")
+        if metric in ("SynergyMMI", "RedundancyMMI"):
+            minsize = max(minsize, 2)
+        key = (metric, minsize, maxsize)
+        if key not in self._results:
+            multiplets = self.multiplets(minsize, maxsize)
+            needed = [subset for multiplet in multiplets for subset in self._needed(multiplet)]
+            for variable in range(self.n_variables):
+                self.entropies(needed, variable)
+            self._results[key] = np.array([[self._metric(metric, multiplet, variable) for variable in range(self.n_variables)]
+                                           for multiplet in multiplets], dtype=np.float32).reshape(len(multiplets), self.n_variables)
+        return self._results[key]
+
+def _content_hash(*arrays) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for array in arrays:
+        if array is None:
+            digest.update(b"none")
+            continue
+        array = np.ascontiguousarray(array)
+        digest.update(f"{array.dtype.str}{array.shape}".encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+def binned_hoi(x, y=None, cache: bool = True) -> BinnedHOI:
+    """
+    The BinnedHOI of (x, y), shared by content: the same arrays (by a hash of their values) give the same
+        estimator, with the entropies and metrics it already computed (the last HOI_CACHE_SIZE datasets are kept).
+    """
+    if not cache:
+        return BinnedHOI(x, y)
+    key = _content_hash(np.asarray(x), None if y is None else np.asarray(y))
+    if key in _hoi_cache:
+        _hoi_cache.move_to_end(key)
+    else:
+        _hoi_cache[key] = BinnedHOI(x, y)
+        while len(_hoi_cache) > HOI_CACHE_SIZE:
+            _hoi_cache.popitem(last=False)
+    return _hoi_cache[key]
+
+def compute_hoi_metrics(x, y=None, metrics: List[str] = HOI_METRICS[:5], nonzero_only=False, k=3, l=3,
+                        cache: bool = True) -> Dict[str, np.ndarray]:
+    """
+    Several hoi metrics of the same data at once, from shared entropies (see BinnedHOI), cached by the content
+        of x and y. Each result is the output of the matching compute_* function (compute_synergyMMI,
+        compute_redundancyMMI, compute_TC, compute_DTC, compute_oinfo, and compute_hoi_enc for GradientOinfo;
+        Oinfo without y is compute_hoi_beh).
+    """
+    estimator = binned_hoi(x, y, cache)
+    results = {}
+    for metric in metrics:
+        hoi = estimator.fit(metric, minsize=k, maxsize=l).squeeze()
+        results[metric] = hoi[hoi != 0] if nonzero_only else hoi
+    return results
+
+##local information dynamics: pointwise storage, transfer and entropy rate at every (cell, timestep) of grid histories
+
+class LocalInformationDynamics:
+    """
+    Local (pointwise) information dynamics of grid histories, as arrays of shape (..., timesteps, width, height)
+        (e.g. entities_time_array(extra_dimension=True), leading dimensions are runs of an ensemble):
+
+    - active information storage: log2 p(next | past) / p(next)
+    - entropy rate: -log2 p(next | past)
+    - transfer entropy from every neighbour (offsets as in dynamics.engines.grid_neighbour_offsets): log2 p(next | past, neighbour) / p(next | past)
+
+    with past the `history` previous states of the cell and neighbour the previous state of the neighbour.
+        The probabilities are tables over these configurations, counted over all cells, timesteps and runs
+        given to fit (the dynamics are taken as homogeneous and stationary), and the local values are
+        lookups in the tables, so long runs can be fitted and evaluated in chunks (see fit and iter_local_fields).
+    States are integers from 0 to num_states - 1.
+    """
+    def __init__(self, history: int = 1, periodic_boundary: bool = True, diagonal_neighbours: bool = True,
+                 num_states: int = 2):
+        if history < 1:
+            raise ValueError(f"history must be at least 1, not {history}")
+        self.history = history
+        self.periodic_boundary = periodic_boundary
+        #The neighbour offsets of dynamics.engines.grid_neighbour_offsets, without importing the dynamics
+        self.offsets = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+        if diagonal_neighbours:
+            self.offsets += [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+        self.num_states = num_states
+        self.num_pasts = num_states ** history
+        self.reset()
+
+    def reset(self):
+        """Forgets the fitted counts."""
+        self.samples = 0
+        self.counts = np.zeros((self.num_pasts, self.num_states), dtype=np.int64) #past, next
+        self.transfer_counts = np.zeros((len(self.offsets), self.num_pasts, self.num_states, self.num_states),
+                                        dtype=np.int64) #neighbour offset, past, neighbour, next
+        self._tables = None
+
+    def _configurations(self, states: np.ndarray, previous: np.ndarray = None):
+        """
+        (past codes, next states, previous states) of the timesteps of states that have a full past (with the
+            previous frames before states), and the number of timesteps without one.
+        """
+        states = np.asarray(states)
+        if not np.issubdtype(states.dtype, np.integer):
+            states = np.rint(states)
+        states = states.astype(np.int64)
+        if states.ndim < 3:
+            raise ValueError("states should have shape (..., timesteps, width, height).")
+        if states.size and (states.min() < 0 or states.max() >= self.num_states):
+            raise ValueError(f"states should be integers from 0 to {self.num_states - 1}.")
+        frames = states
+        if previous is not None:
+            previous = np.asarray(previous)[..., -self.history:, :, :]
+            frames = np.concatenate([np.rint(previous).astype(np.int64), states], axis=-3)
+        missing = max(0, min(states.shape[-3], self.history - (frames.shape[-3] - states.shape[-3])))
+        steps = frames.shape[-3]
+        past = np.zeros(frames[..., self.history:, :, :].shape, dtype=np.int64)
+        for lag in range(self.history, 0, -1):
+            past = past * self.num_states + frames[..., self.history - lag:steps - lag, :, :]
+        return past, frames[..., self.history:, :, :], frames[..., self.history - 1:steps - 1, :, :], missing
+
+    def _neighbour(self, frames: np.ndarray, dx: int, dy: int) -> np.ndarray:
+        """The state of the neighbour at (x + dx, y + dy) of every cell, dead beyond the edges without periodic boundary."""
+        if self.periodic_boundary:
+            return np.roll(frames, (-dx, -dy), axis=(-2, -1))
+        width, height = frames.shape[-2:]
+        padded = np.pad(frames, [(0, 0)] * (frames.ndim - 2) + [(1, 1), (1, 1)])
+        return padded[..., 1 + dx:1 + dx + width, 1 + dy:1 + dy + height]
+
+    def update(self, states: np.ndarray, previous: np.ndarray = None) -> "LocalInformationDynamics":
+        """
+        Adds the configurations of states to the counts. previous: the frames before states (e.g. the end of the
+            previous chunk of the run), otherwise the first `history` timesteps only serve as past.
+        """
+        past, next_states, last, _ = self._configurations(states, previous)
+        self.samples += past.size
+        self.counts += np.bincount((past * self.num_states + next_states).ravel(),
+                                   minlength=self.counts.size).reshape(self.counts.shape)
+        for i, (dx, dy) in enumerate(self.offsets):
+            codes = (past * self.num_states + self._neighbour(last, dx, dy)) * self.num_states + next_states
+            self.transfer_counts[i] += np.bincount(codes.ravel(), minlength=self.transfer_counts[i].size).reshape(self.transfer_counts[i].shape)
+        self._tables = None
+        return self
+
+    def fit(self, chunks: np.ndarray | Iterable[np.ndarray]) -> "LocalInformationDynamics":
+        """
+        Counts the configurations of a history array, or of consecutive chunks of one (along the time axis,
+            e.g. read from a run file), from scratch.
+        """
+        self.reset()
+        previous = None
+        for chunk in ([chunks] if isinstance(chunks, np.ndarray) else chunks):
+            self.update(chunk, previous)
+            previous = chunk if previous is None else np.concatenate([previous, chunk], axis=-3)[..., -self.history:, :, :]
+        return self
+
+    @property
+    def tables(self) -> Dict[str, np.ndarray]:
+        """The local values of every configuration (nan for configurations never counted)."""
+        if self._tables is None:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                pasts = self.counts.sum(axis=1, keepdims=True)
+                nexts = self.counts.sum(axis=0, keepdims=True)
+                seen = self.counts > 0
+                joint = self.transfer_counts.sum(axis=3, keepdims=True) #past, neighbour
+                self._tables = {
+                    "active_information_storage": np.where(seen, np.log2(self.counts * self.samples / (pasts * nexts)), np.nan),
+                    "entropy_rate": np.where(seen, -np.log2(self.counts / pasts), np.nan),
+                    "transfer_entropy": np.where(self.transfer_counts > 0, np.log2(self.transfer_counts * pasts[np.newaxis, :, :, np.newaxis]
+                                                                                   / (joint * self.counts[np.newaxis, :, np.newaxis, :])), np.nan),
+                }
+        return self._tables
+
+    def averages(self) -> Dict[str, float | np.ndarray]:
+        """The averages of the local values over the fitted data (the usual, global measures; transfer per offset)."""
+        tables = self.tables
+        weights = self.counts / max(self.samples, 1)
+        transfer_weights = self.transfer_counts / max(self.samples, 1)
+        return {"active_information_storage": float(np.nansum(weights * tables["active_information_storage"])),
+                "entropy_rate": float(np.nansum(weights * tables["entropy_rate"])),
+                "transfer_entropy": np.nansum(transfer_weights * tables["transfer_entropy"], axis=(1, 2, 3))}
+
+    def local_fields(self, states: np.ndarray, previous: np.ndarray = None) -> Dict[str, np.ndarray]:
+        """
+        The local values at every (cell, timestep) of states, with the shape of states (transfer entropy with an
+            extra last dimension over the neighbour offsets), nan at the first timesteps without a full past.
+        """
+        tables = self.tables
+        past, next_states, last, missing = self._configurations(states, previous)
+        shape = np.shape(states)
+        fields = {}
+        for name in ("active_information_storage", "entropy_rate"):
+            fields[name] = np.full(shape, np.nan)
+            fields[name][..., missing:, :, :] = tables[name][past, next_states]
+        fields["transfer_entropy"] = np.full(shape + (len(self.offsets),), np.nan)
+        for i, (dx, dy) in enumerate(self.offsets):
+            fields["transfer_entropy"][..., missing:, :, :, i] = tables["transfer_entropy"][i, past, self._neighbour(last, dx, dy), next_states]
+        return fields
+
+    def iter_local_fields(self, chunks: Iterable[np.ndarray]):
+        """Yields the local fields of consecutive chunks of a history, each continuing from the previous ones."""
+        previous = None
+        for chunk in chunks:
+            yield self.local_fields(chunk, previous)
+            previous = chunk if previous is None else np.concatenate([previous, chunk], axis=-3)[..., -self.history:, :, :]
+
+    def __repr__(self):
+        return f"{type(self).__name__}(history={self.history}, {self.samples} samples)"
+
+def local_information_dynamics(states: np.ndarray, history: int = 1, periodic_boundary: bool = True,
+                               diagonal_neighbours: bool = True) -> Dict[str, np.ndarray]:
+    """The local information dynamics fields of a (..., timesteps, width, height) history, fitted on itself."""
+    num_states = int(np.max(states)) + 1 if np.size(states) else 2
+    estimator = LocalInformationDynamics(history, periodic_boundary, diagonal_neighbours, max(num_states, 2))
+    return estimator.fit(np.asarray(states)).local_fields(states)
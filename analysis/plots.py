@@ -204,7 +204,7 @@ def plot_impact_group_ratio_over_time(model, group, timestep_names=None, return_
     """
     Plot the ratio of group-to-group impacts over time for a Model object.
     Args:
-        model: Model instance with .impact attribute (dict of timestep_name -> impacts dict)
+        model: Model instance with .impact attribute (ImpactLog or dict of timestep_name -> impacts dict)
         group: set of entities (e.g., set of (x, y) tuples)
         timestep_names: list of timestep names to plot (default: all in model.impact)
         return_counts: if True, also plot counts as dashed lines
@@ -219,16 +219,12 @@ def plot_impact_group_ratio_over_time(model, group, timestep_names=None, return_
         start_time, end_time = timestep_names
         base_name = model.base_name
         if end_time is None:
-            end_time = max(model.impact.keys(), key=lambda x: int(''.join(filter(str.isdigit, x))))
+            end_time = max(int(''.join(filter(str.isdigit, x))) for x in model.impact.keys())
         timestep_names = [f"{base_name}{i}" for i in range(start_time, end_time + 1)]
-    ratios = []
-    between_counts = []
-    total_counts = []
-    for t in timestep_names:
-        result = impact_group_ratio(model.impact[t], group, return_counts=True)
-        ratios.append(result[0])
-        between_counts.append(result[1])
-        total_counts.append(result[2])
+    metrics = group_metrics(model.impact, [group], timestep_names)
+    ratios = metrics["ratio"][0]
+    between_counts = metrics["between"][0]
+    total_counts = metrics["total"][0]
     plt.figure(figsize=(8, 4))
     if not return_counts:
         plt.plot(timestep_names, ratios, marker='o', label='Ratio (within group / all involving group)')
@@ -261,13 +257,10 @@ def plot_group_strength_over_time(model, group, timestep_names=None):
     elif type(timestep_names) is tuple:
         base_name = model.base_name
         start_time, end_time = timestep_names
-        end_time = end_time or max(model.impact.keys(), key=lambda x: int(''.join(filter(str.isdigit, x))))
+        end_time = end_time or max(int(''.join(filter(str.isdigit, x))) for x in model.impact.keys())
         timestep_names = [f"{base_name}{i}" for i in range(start_time, end_time + 1)]
 
-    ratios = []
-    for t in timestep_names:
-        ratio = group_impact_strength(model.impact[t], group, return_counts=False)
-        ratios.append(ratio)
+    ratios = group_metrics(model.impact, [group], timestep_names)["strength"][0]
 
     plt.figure(figsize=(8, 4))
     plt.plot(timestep_names, ratios, marker='o', label='S / S_expected')
@@ -0,0 +1,211 @@
+import numpy as np
+import networkx as nx
+from typing import Dict, List, Tuple
+from higherorder.structures.structures import Structure, Grid
+from higherorder.structures.components import grid_neighbours_of, union_find, label_grid, label_graph, labels_to_lists
+from higherorder.structures.topology import unwrap_components
+##component tracking: which component descends from which over time (births, deaths, splits and merges)
+
+class ComponentTracker:
+    """
+    Follows the connected components of the live (nonzero) entities of a structure over timesteps,
+        updated from the changes of every step (see update).
+
+    Only the components that contain a changed entity or touch a born one are labeled again, the others
+        keep their id, size and bounding box, so a step costs in proportion to the activity instead of
+        labeling all components from scratch (as utils.blobs per timestep).
+
+    - ids: a component keeps the id of its parent (the component of the previous timestep it shares
+        entities with) if it has one parent with no other child, otherwise it gets a new id
+    - edges: (timestep, parent id, child id) for every new id descending from earlier components
+        (splits, merges), see lineage_graph and events
+    - births, deaths: id: first and last timestep of the component (deaths only of ended ids)
+    - sizes and bounding boxes are kept at the timesteps where they change, see size_series and bbox_series.
+        Bounding boxes (min x, min y, max x, max y) are only kept on grids, across the periodic boundary
+        the max can be beyond the width or height (the box wraps around)
+    """
+    def __init__(self, structure: Structure, states: np.ndarray | Dict = None,
+                 time_step: int = None, base_name: str = None):
+        self.structure = structure
+        base_name = base_name or getattr(structure, "key_name", {}).get("base_name", "t_")
+        self.time_step = getattr(structure, "initial_time_step", 0) if time_step is None else time_step
+        if states is None:
+            states = structure.get_state_array(base_name + str(self.time_step))
+        elif isinstance(states, dict):
+            states = structure.states_to_array(states)
+        self.alive = np.asarray(states).ravel() != 0
+
+        self.grid = None
+        if isinstance(structure, Grid) and len(structure.entities) == structure.width * structure.height:
+            self.grid = (structure.width, structure.height, structure.periodic_boundary, structure.diagonal_neighbours)
+            labels, count = label_grid(self.alive.reshape(structure.width, structure.height),
+                                       structure.periodic_boundary, structure.diagonal_neighbours)
+            labels = labels.ravel()
+        else:
+            labels, count = label_graph(structure.adjacency, self.alive)
+        self.labels = labels
+        self.next_id = count + 1
+        self.members = {} #id: entity indices
+        self.births = {}
+        self.deaths = {}
+        self.edges = []
+        self.series = {} #id: [(timestep, size, bbox)] at the timesteps they change
+        self.initial_time_step = self.time_step
+        self._add_components(list(range(1, count + 1)), labels_to_lists(labels, count))
+
+    @classmethod
+    def from_history(cls, structure: Structure, base_name: str = None,
+                     start_timestamp: int = None, end_timestamp: int = None) -> "ComponentTracker":
+        """Tracks the components over the stored timesteps of a structure, from start_timestamp to end_timestamp."""
+        base_name = base_name or getattr(structure, "key_name", {}).get("base_name", "t_")
+        start = getattr(structure, "initial_time_step", 0) if start_timestamp is None else start_timestamp
+        end = structure.last_iterations.get(base_name, start) if end_timestamp is None else end_timestamp
+        tracker = cls(structure, time_step=start, base_name=base_name)
+        for t in range(start + 1, end + 1):
+            tracker.update(states=structure.get_state_array(base_name + str(t)))
+        return tracker
+
+    def _neighbours_of(self, ids: np.ndarray):
+        if self.grid is not None:
+            return grid_neighbours_of(ids, *self.grid)
+        return self.structure.adjacency.neighbours_of(ids)
+
+    def _bboxes(self, components: List[np.ndarray]) -> List[Tuple[int, int, int, int] | None]:
+        if self.grid is None or not components:
+            return [None] * len(components)
+        width, height, periodic_boundary, _ = self.grid
+        cells = np.concatenate(components)
+        labels = np.repeat(np.arange(len(components)), [len(component) for component in components])
+        xs, ys = np.divmod(cells, height)
+        unwrapped_x, unwrapped_y, _, _ = unwrap_components(xs, ys, labels, width, height, periodic_boundary)
+        first = np.cumsum([0] + [len(component) for component in components[:-1]])
+        start_x = (xs[first] - unwrapped_x[first]) % width
+        start_y = (ys[first] - unwrapped_y[first]) % height
+        extent_x = np.zeros(len(components), dtype=np.int64)
+        extent_y = np.zeros(len(components), dtype=np.int64)
+        np.maximum.at(extent_x, labels, unwrapped_x)
+        np.maximum.at(extent_y, labels, unwrapped_y)
+        return list(zip(start_x.tolist(), start_y.tolist(), (start_x + extent_x).tolist(), (start_y + extent_y).tolist()))
+
+    def _add_components(self, ids: List[int], components: List[np.ndarray]):
+        """Stores the members of the components, and their size and bounding box if changed."""
+        for component_id, component, bbox in zip(ids, components, self._bboxes(components)):
+            self.members[component_id] = component
+            self.labels[component] = component_id
+            self.births.setdefault(component_id, self.time_step)
+            series = self.series.setdefault(component_id, [])
+            if not series or series[-1][1:] != (len(component), bbox):
+                series.append((self.time_step, len(component), bbox))
+
+    def update(self, changes: Tuple[np.ndarray, np.ndarray] = None, states: np.ndarray | Dict = None):
+        """
+        Advances the components by one timestep, from the changes of the step as (entity indices, new values)
+            (e.g. of LifeEngine.frontier_step) or from the states of the next timestep.
+        """
+        if states is not None:
+            if isinstance(states, dict):
+                states = self.structure.states_to_array(states)
+            changed = np.flatnonzero((np.asarray(states).ravel() != 0) != self.alive)
+        else:
+            indices, values = (np.asarray(array) for array in changes)
+            changed = indices[(values != 0) != self.alive[indices]]
+        self.alive[changed] = ~self.alive[changed]
+        born = changed[self.alive[changed]]
+        died = changed[~self.alive[changed]]
+        self.time_step += 1
+
+        #Components that lost an entity or touch a born one, the others stay the same
+        touched, _ = self._neighbours_of(born)
+        affected = np.unique(self.labels[np.concatenate([died, touched])])
+        affected = affected[affected > 0].tolist()
+        region = np.concatenate([born] + [self.members.pop(component_id) for component_id in affected])
+        region = np.unique(region[self.alive[region]])
+        parents = self.labels[region]
+        self.labels[died] = 0
+
+        #Label the region: it is not connected to the components that stay the same
+        neighbours, owners = self._neighbours_of(region)
+        positions = np.minimum(np.searchsorted(region, neighbours), max(len(region) - 1, 0))
+        inside = region[positions] == neighbours
+        roots = union_find(len(region), owners[inside], positions[inside])
+        roots, component = np.unique(roots, return_inverse=True)
+
+        #Parents of every new component: the labels its entities had (0 for born ones)
+        pairs = np.unique(np.stack([component, parents], axis=1)[parents > 0], axis=0).reshape(-1, 2)
+        parents_of = {c: [] for c in range(len(roots))}
+        children_of = {p: 0 for p in affected}
+        for c, p in pairs.tolist():
+            parents_of[c].append(p)
+            children_of[p] += 1
+        ids = []
+        for c in range(len(roots)):
+            if len(parents_of[c]) == 1 and children_of[parents_of[c][0]] == 1:
+                ids.append(parents_of[c][0])
+                continue
+            ids.append(self.next_id)
+            for p in parents_of[c]:
+                self.edges.append((self.time_step, p, self.next_id))
+            self.next_id += 1
+        for p in set(affected) - set(ids):
+            self.deaths[p] = self.time_step - 1
+        order = np.argsort(component, kind="stable")
+        bounds = np.cumsum(np.bincount(component, minlength=len(roots)))[:-1]
+        self._add_components(ids, np.split(region[order], bounds) if len(roots) else [])
+
+    @property
+    def num_components(self) -> int:
+        return len(self.members)
+
+    def get_components(self) -> Dict:
+        """The current components: id: list of entities."""
+        entity_list = self.structure.get_entity_list()
+        return {component_id: [entity_list[i] for i in component.tolist()]
+                for component_id, component in self.members.items()}
+
+    def _series(self, component_id: int, column: int):
+        series = self.series[component_id]
+        end = self.deaths.get(component_id, self.time_step)
+        times = np.arange(series[0][0], end + 1)
+        changes = np.searchsorted([t for t, _, _ in series], times, side="right") - 1
+        return times, [series[i][column] for i in changes.tolist()]
+
+    def size_series(self, component_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """The timesteps of the component and its size at each."""
+        times, sizes = self._series(component_id, 1)
+        return times, np.array(sizes, dtype=np.int64)
+
+    def bbox_series(self, component_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """The timesteps of the component and its (min x, min y, max x, max y) bounding box at each (grids only)."""
+        times, bboxes = self._series(component_id, 2)
+        return times, np.array(bboxes, dtype=np.int64).reshape(len(times), -1)
+
+    def events(self) -> List[Tuple[int, str, Tuple, Tuple]]:
+        """
+        (timestep, kind, parent ids, child ids) of every birth (no parents), death (no children),
+            split (a parent with several children) and merge (a child with several parents), by timestep.
+        """
+        children, parents = {}, {}
+        for t, p, c in self.edges:
+            children.setdefault(p, (t, []))[1].append(c)
+            parents.setdefault(c, (t, []))[1].append(p)
+        events = [(t, "birth", (), (c,)) for c, t in self.births.items()
+                  if c not in parents and t > self.initial_time_step]
+        events += [(t + 1, "death", (p,), ()) for p, t in self.deaths.items() if p not in children]
+        events += [(t, "split", (p,), tuple(c)) for p, (t, c) in children.items() if len(c) > 1]
+        events += [(t, "merge", tuple(p), (c,)) for c, (t, p) in parents.items() if len(p) > 1]
+        return sorted(events, key=lambda event: event[0])
+
+    def lineage_graph(self) -> nx.DiGraph:
+        """
+        Directed graph of the component ids, with an edge from each parent to its children of a new id
+            (attribute time: the first timestep of the child). Nodes have birth and death (None if alive).
+        """
+        G = nx.DiGraph()
+        for component_id, birth in self.births.items():
+            G.add_node(component_id, birth=birth, death=self.deaths.get(component_id))
+        for t, p, c in self.edges:
+            G.add_edge(p, c, time=t)
+        return G
+
+    def __repr__(self):
+        return f"{type(self).__name__}(t={self.time_step}, {self.num_components} components, {len(self.births)} ids)"
@@ -1,3 +1,9 @@
 from .model import Model
 from .rules import *
-from .impacts import *
\ No newline at end of file
+from .impacts import *
+from .engines import *
+from .ensemble import *
+from .runner import *
+from .bitpacked import *
+from .hashlife import *
+from .sinks import *
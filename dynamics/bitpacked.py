@@ -0,0 +1,191 @@
+import numpy as np
+from typing import Dict, Iterable, Callable
+from higherorder.structures.structures import Grid
+from .rules import game_of_life
+from .engines import life_like_counts
+##bit-packed grids: 64 cells per uint64 word, stepped with bitwise operations on whole words
+
+WORD_BITS = 64
+_ONE = np.uint64(1)
+_TOP = np.uint64(WORD_BITS - 1)
+
+def pack_grid(array: np.ndarray) -> np.ndarray:
+    """
+    Packs a (..., width, height) binary array (e.g. from utils.dict_to_array) into (..., width, words)
+        uint64 words along the height: cell y is bit y % 64 of word y // 64. Positive values are live.
+    """
+    height = array.shape[-1]
+    words = -(-height // WORD_BITS)
+    bits = np.zeros(array.shape[:-1] + (words * WORD_BITS,), dtype=np.uint8)
+    bits[..., :height] = array > 0
+    return np.packbits(bits, axis=-1, bitorder="little").view("<u8").astype(np.uint64)
+
+def unpack_grid(packed: np.ndarray, height: int) -> np.ndarray:
+    """
+    Unpacks (..., width, words) uint64 words into a (..., width, height) uint8 array of 0s and 1s.
+    """
+    bytes_ = np.ascontiguousarray(packed.astype("<u8")).view(np.uint8)
+    return np.unpackbits(bytes_, axis=-1, bitorder="little")[..., :height]
+
+def _height_mask(height: int) -> np.ndarray:
+    """Per word mask of the bits that are cells (the last word can have unused bits)."""
+    words = -(-height // WORD_BITS)
+    mask = np.full(words, np.iinfo(np.uint64).max, dtype=np.uint64)
+    if height % WORD_BITS:
+        mask[-1] = (_ONE << np.uint64(height % WORD_BITS)) - _ONE
+    return mask
+
+class BitPackedLife:
+    """
+    A Life-like rule on a binary grid stored as 64 cells per uint64 word (see pack_grid),
+        1 bit per cell instead of a byte (or a float in dicts).
+
+    A step shifts the words to the neighbours' positions and adds them with a bit-sliced adder:
+        4 bit planes hold the neighbour count of every cell, and the next state is the union of
+        the planes equal to the birth (dead cells) and survival (live cells) counts.
+        The same states as GridLifeEngine (and rules.game_of_life on the grid), for any number of steps.
+
+    dynamics_func: game_of_life or a rules.LifeLikeRule (or birth and survival neighbour counts)
+    """
+    def __init__(self, states: np.ndarray,
+                 periodic_boundary: bool = True,
+                 diagonal_neighbours: bool = True,
+                 dynamics_func: Callable = game_of_life,
+                 birth: Iterable[int] = None,
+                 survival: Iterable[int] = None,
+                 time_step: int = 0):
+        if birth is None or survival is None:
+            life_like = life_like_counts(dynamics_func)
+            if life_like is None:
+                raise ValueError(f"BitPackedLife supports Life-like rules only, not {getattr(dynamics_func, '__name__', dynamics_func)}")
+            birth, survival = life_like
+        self.width, self.height = states.shape
+        if periodic_boundary and min(self.width, self.height) < 3:
+            raise ValueError("Periodic sides shorter than 3 cells are not supported, use Model instead.")
+        self.periodic_boundary = periodic_boundary
+        self.diagonal_neighbours = diagonal_neighbours
+        self.birth = tuple(sorted(set(birth)))
+        self.survival = tuple(sorted(set(survival)))
+        self.time_step = time_step
+        self.mask = _height_mask(self.height)
+        self.words = pack_grid(states)
+
+    @classmethod
+    def from_grid(cls, grid: Grid, key_name: str = None,
+                  dynamics_func: Callable = game_of_life, **kwargs) -> "BitPackedLife":
+        """The states of a Grid at key_name (default: its last timestep), with its boundary and neighbourhood."""
+        base_name = grid.key_name["base_name"]
+        if key_name is None:
+            key_name = base_name + str(grid.last_iterations.get(base_name, grid.initial_time_step))
+        if len(grid.entities) != grid.width * grid.height:
+            raise ValueError("The grid entities do not match the array layout of the grid.")
+        states = grid.get_state_array(key_name).reshape(grid.width, grid.height)
+        time_step = int(key_name[len(base_name):]) if key_name[len(base_name):].isdigit() else 0
+        return cls(states, grid.periodic_boundary, grid.diagonal_neighbours, dynamics_func,
+                   time_step=time_step, **kwargs)
+
+    @classmethod
+    def from_dict(cls, entities: Dict, width: int = None, height: int = None, **kwargs) -> "BitPackedLife":
+        """States from a dict of (x, y): value (e.g. from load_init_grid_dicts), see utils.dict_to_array."""
+        from higherorder.utils.utils import dict_to_array #Lazy import to avoid circular import
+        return cls(dict_to_array(entities, width, height, dtype=np.uint8), **kwargs)
+
+    def to_array(self) -> np.ndarray:
+        """The (width, height) uint8 array of the states (the layout of utils.dict_to_array)."""
+        return unpack_grid(self.words, self.height)
+
+    def to_dict(self, only_nonzero: bool = True) -> Dict:
+        """The states as a dict of (x, y): value, the format of Grid time slices."""
+        array = self.to_array()
+        if only_nonzero:
+            return {(x, y): 1 for x, y in zip(*(axis.tolist() for axis in np.nonzero(array)))}
+        return {(x, y): int(array[x, y]) for x in range(self.width) for y in range(self.height)}
+
+    def to_grid(self, grid: Grid, key_name: str = None):
+        """
+        Writes the states into a Grid of the same size as the time slice key_name
+            (default: base_name + the current timestep of this object).
+        """
+        if (grid.width, grid.height) != (self.width, self.height):
+            raise ValueError(f"Grid of size {grid.width}x{grid.height} does not match {self.width}x{self.height}")
+        base_name = grid.key_name["base_name"]
+        if key_name is None:
+            key_name = base_name + str(self.time_step)
+        grid.set_time_slice(self.to_array().ravel(), key_name)
+        time_step = key_name[len(base_name):]
+        if time_step.isdigit() and int(time_step) > grid.last_iterations.get(base_name, 0):
+            grid.last_iterations[base_name] = int(time_step)
+
+    @property
+    def population(self) -> int:
+        return int(np.unpackbits(self.words.view(np.uint8)).sum())
+
+    @property
+    def nbytes(self) -> int:
+        return self.words.nbytes
+
+    def _shift_y(self, words: np.ndarray, direction: int) -> np.ndarray:
+        """The words of the neighbours at y - 1 (direction 1) or y + 1 (direction -1) of every cell."""
+        top = np.uint64((self.height - 1) % WORD_BITS)
+        if direction == 1:
+            shifted = words << _ONE
+            shifted[..., 1:] |= words[..., :-1] >> _TOP
+            if self.periodic_boundary:
+                shifted[..., 0] |= (words[..., -1] >> top) & _ONE
+        else:
+            shifted = words >> _ONE
+            shifted[..., :-1] |= (words[..., 1:] & _ONE) << _TOP
+            if self.periodic_boundary:
+                shifted[..., -1] |= (words[..., 0] & _ONE) << top
+        return shifted & self.mask
+
+    def _shift_x(self, words: np.ndarray, direction: int) -> np.ndarray:
+        """The words of the neighbours at x - direction of every cell."""
+        if self.periodic_boundary:
+            return np.roll(words, direction, axis=-2)
+        shifted = np.zeros_like(words)
+        if direction == 1:
+            shifted[..., 1:, :] = words[..., :-1, :]
+        else:
+            shifted[..., :-1, :] = words[..., 1:, :]
+        return shifted
+
+    def neighbour_planes(self, words: np.ndarray = None) -> list:
+        """
+        The live neighbour counts of all cells, as 4 bit planes (count bit i of every cell in plane i).
+        """
+        words = self.words if words is None else words
+        rows = [self._shift_x(words, 1), words, self._shift_x(words, -1)]
+        neighbours = [rows[0], rows[2]]
+        for row in rows if self.diagonal_neighbours else rows[1:2]:
+            neighbours += [self._shift_y(row, 1), self._shift_y(row, -1)]
+        planes = [np.zeros_like(words) for _ in range(4)]
+        for neighbour in neighbours:
+            carry = neighbour
+            for i in range(4):
+                carry, planes[i] = planes[i] & carry, planes[i] ^ carry
+        return planes
+
+    def _count_equals(self, planes: list, count: int) -> np.ndarray:
+        equal = np.full_like(planes[0], np.iinfo(np.uint64).max)
+        for i, plane in enumerate(planes):
+            equal &= plane if (count >> i) & 1 else ~plane
+        return equal
+
+    def step(self, steps: int = 1) -> np.ndarray:
+        """Advances the states by `steps` generations, returns the packed words."""
+        for _ in range(steps):
+            planes = self.neighbour_planes()
+            alive, dead = self.words, ~self.words
+            words = np.zeros_like(alive)
+            for count in self.birth:
+                words |= dead & self._count_equals(planes, count)
+            for count in self.survival:
+                words |= alive & self._count_equals(planes, count)
+            self.words = words & self.mask
+            self.time_step += 1
+        return self.words
+
+    def __repr__(self):
+        rule = "B" + "".join(map(str, self.birth)) + "/S" + "".join(map(str, self.survival))
+        return f"{type(self).__name__}({self.width}x{self.height}, {rule}, t={self.time_step})"
@@ -0,0 +1,383 @@
+import numpy as np
+from typing import Callable, Dict, Iterable
+from higherorder.structures.structures import Structure, Grid, Graph
+from higherorder.structures.components import grid_neighbours_of
+from .rules import game_of_life, LifeLikeRule
+##array engines: step the states of all entities at once, instead of per entity dicts
+
+def grid_neighbour_offsets(diagonal_neighbours: bool = True) -> list:
+    """
+    The (dx, dy) offsets of the neighbours of a cell: Moore neighbourhood if diagonal_neighbours,
+        otherwise von Neumann.
+    """
+    offsets = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+    if diagonal_neighbours:
+        offsets += [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+    return offsets
+
+def grid_neighbour_counts(states: np.ndarray,
+                          periodic_boundary: bool = True,
+                          diagonal_neighbours: bool = True) -> np.ndarray:
+    """
+    Number of live (positive) neighbours of every cell of a (..., width, height) array.
+    Leading dimensions are treated as independent grids (e.g. an ensemble or a history).
+
+    Without periodic boundary, cells beyond the edges count as dead.
+    """
+    alive = (states > 0).astype(np.uint8)
+    counts = np.zeros(alive.shape, dtype=np.uint8)
+    if periodic_boundary:
+        for dx, dy in grid_neighbour_offsets(diagonal_neighbours):
+            counts += np.roll(alive, (dx, dy), axis=(-2, -1))
+        return counts
+    width, height = alive.shape[-2:]
+    padded = np.pad(alive, [(0, 0)] * (alive.ndim - 2) + [(1, 1), (1, 1)])
+    for dx, dy in grid_neighbour_offsets(diagonal_neighbours):
+        counts += padded[..., 1 - dx:1 - dx + width, 1 - dy:1 - dy + height]
+    return counts
+
+class Engine:
+    """
+    Array backend of a rule on a structure.
+
+    States are 1D arrays in entity index order (see Structure.get_state_array), and step returns
+        the states of the next timestep in the same layout.
+    """
+    def __init__(self, structure: Structure):
+        self.structure = structure
+
+    def step(self, states: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+class LifeEngine(Engine):
+    """
+    Life-like (outer totalistic) rule: the next states are looked up from the live neighbour counts.
+
+    A live entity survives with a neighbour count in `survival`, a dead entity is born with a count in `birth`.
+        The default is Conway's Game of Life (B3/S23), giving the same states as rules.game_of_life.
+    Concrete engines implement neighbour_counts.
+    """
+    def __init__(self, structure: Structure,
+                 birth: Iterable[int] = (3,),
+                 survival: Iterable[int] = (2, 3),
+                 max_neighbours: int = 8):
+        super().__init__(structure)
+        counts = np.arange(max_neighbours + 1)
+        self.birth_table = np.isin(counts, list(birth))
+        self.survival_table = np.isin(counts, list(survival))
+
+    def neighbour_counts(self, states: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def neighbours_of(self, ids: np.ndarray):
+        """The neighbours of the entities `ids`, see AdjacencyIndex.neighbours_of."""
+        return self.structure.adjacency.neighbours_of(ids)
+
+    def step(self, states: np.ndarray, counts: np.ndarray = None) -> np.ndarray:
+        """
+        counts: the live neighbour counts of the states, if already computed (e.g. shared with impacts).
+        """
+        if counts is None:
+            counts = self.neighbour_counts(states)
+        alive = states > 0
+        return np.where(alive, self.survival_table[counts], self.birth_table[counts]).astype(np.uint8)
+
+    def frontier_step(self, states: np.ndarray, frontier: np.ndarray = None,
+                      counts: np.ndarray = None):
+        """
+        The entities whose states change in the next step, as (entity indices, new values).
+
+        frontier: the indices of the entities that changed in the previous step (the output of the
+            previous frontier_step). Other entities can only change next to them, so only the frontier
+            and its neighbours are evaluated, at a cost proportional to the activity instead of the
+            number of entities. None evaluates all entities (e.g. the first step).
+        counts: the live neighbour counts of all entities, if already computed (then all are evaluated).
+        """
+        if frontier is None or counts is not None:
+            next_states = self.step(states, counts)
+            changed = np.flatnonzero(next_states != states)
+            return changed, next_states[changed]
+        neighbours, _ = self.neighbours_of(frontier)
+        candidates = np.unique(np.concatenate([np.asarray(frontier, dtype=np.int64), neighbours]))
+        neighbours, owners = self.neighbours_of(candidates)
+        counts = np.bincount(owners, weights=states[neighbours] > 0, minlength=len(candidates)).astype(np.int64)
+        previous = states[candidates]
+        next_states = np.where(previous > 0, self.survival_table[counts], self.birth_table[counts]).astype(np.uint8)
+        changed = next_states != previous
+        return candidates[changed], next_states[changed]
+
+class GridLifeEngine(LifeEngine):
+    """
+    Life-like rule on a Grid, with neighbour counts computed over the (width, height) array.
+    """
+    def __init__(self, structure: Grid,
+                 birth: Iterable[int] = (3,),
+                 survival: Iterable[int] = (2, 3)):
+        if not grid_engine_compatible(structure):
+            raise ValueError("The grid entities or connections do not match the array layout of the grid.")
+        super().__init__(structure, birth, survival,
+                         max_neighbours=len(grid_neighbour_offsets(structure.diagonal_neighbours)))
+        self.shape = (structure.width, structure.height)
+        self.periodic_boundary = structure.periodic_boundary
+        self.diagonal_neighbours = structure.diagonal_neighbours
+
+    def neighbour_counts(self, states: np.ndarray) -> np.ndarray:
+        return grid_neighbour_counts(states.reshape(self.shape), self.periodic_boundary,
+                                     self.diagonal_neighbours).ravel()
+
+    def neighbours_of(self, ids: np.ndarray):
+        """The neighbours of the cells `ids` from their coordinates, without the adjacency index."""
+        return grid_neighbours_of(ids, *self.shape, self.periodic_boundary, self.diagonal_neighbours)
+
+class GraphLifeEngine(LifeEngine):
+    """
+    Life-like rule on any structure (e.g. a Graph), with neighbour counts as the product of the
+        sparse adjacency matrix (Structure.adjacency) with the live states.
+    """
+    def __init__(self, structure: Structure,
+                 birth: Iterable[int] = (3,),
+                 survival: Iterable[int] = (2, 3)):
+        self.adjacency = structure.adjacency
+        degrees = self.adjacency.degrees
+        super().__init__(structure, birth, survival,
+                         max_neighbours=int(degrees.max()) if len(degrees) else 0)
+
+    def neighbour_counts(self, states: np.ndarray) -> np.ndarray:
+        return self.adjacency.neighbour_sum((states > 0).astype(np.float64)).astype(np.int64)
+
+class RuleTable:
+    """
+    A binary local rule compiled to a lookup table over the configurations of an entity and its grid neighbours
+        (see compile_rule).
+
+    - table: the next state of every configuration code, bit 0 the state of the entity, bit i + 1 the state
+        of its neighbour at offsets[i] (at x + dx, y + dy)
+    - birth, survival: the live neighbour counts of the rule if it is outer totalistic, otherwise None
+    """
+    def __init__(self, table: np.ndarray, offsets: list):
+        self.table = np.asarray(table, dtype=np.uint8)
+        self.offsets = list(offsets)
+        self.birth = self.survival = None
+        codes = np.arange(len(self.table))
+        live = (codes >> 1)[:, np.newaxis] >> np.arange(len(self.offsets)) & 1
+        counts = live.sum(axis=1)
+        center = codes & 1
+        #Outer totalistic: the same next state for all configurations with the same state and live neighbour count
+        by_count = np.zeros((2, len(self.offsets) + 1), dtype=np.int64)
+        np.maximum.at(by_count, (center, counts), self.table)
+        if np.array_equal(by_count[center, counts], self.table):
+            self.birth = tuple(np.flatnonzero(by_count[0]).tolist())
+            self.survival = tuple(np.flatnonzero(by_count[1]).tolist())
+
+    @property
+    def totalistic(self) -> bool:
+        return self.birth is not None
+
+    def codes(self, alive: np.ndarray, periodic_boundary: bool = True) -> np.ndarray:
+        """The configuration code of every cell of a (..., width, height) array of live (1) and dead (0) cells."""
+        alive = alive.astype(np.uint16)
+        codes = alive.copy()
+        width, height = alive.shape[-2:]
+        if not periodic_boundary:
+            padded = np.pad(alive, [(0, 0)] * (alive.ndim - 2) + [(1, 1), (1, 1)])
+        for i, (dx, dy) in enumerate(self.offsets):
+            if periodic_boundary:
+                codes |= np.roll(alive, (-dx, -dy), axis=(-2, -1)) << (i + 1)
+            else:
+                codes |= padded[..., 1 + dx:1 + dx + width, 1 + dy:1 + dy + height] << (i + 1)
+        return codes
+
+    def __call__(self, states: np.ndarray, periodic_boundary: bool = True) -> np.ndarray:
+        """The next states of a (..., width, height) array, with one lookup per cell."""
+        return self.table[self.codes(states > 0, periodic_boundary)]
+
+    def __repr__(self):
+        kind = f"B{''.join(map(str, self.birth))}/S{''.join(map(str, self.survival))}" if self.totalistic else "not totalistic"
+        return f"{type(self).__name__}({len(self.offsets)} neighbours, {kind})"
+
+def _probe_rule(rule_function: Callable, center: tuple, neighbours: list, connections_LUT: Dict,
+                structure: Structure = None) -> np.ndarray:
+    """
+    The next state of the center entity for every configuration of it (bit 0) and its neighbours (bit i + 1
+        for neighbours[i]), from the rule over the dict of these entities only.
+    """
+    patch = [center] + list(neighbours)
+    table = np.zeros(2 ** len(patch), dtype=np.uint8)
+    for code in range(len(table)):
+        entities = {entity: code >> i & 1 for i, entity in enumerate(patch)}
+        state = rule_function(entities=entities, connections_LUT=connections_LUT, structure=structure)[center]
+        if state not in (0, 1):
+            raise ValueError(f"The rule gives the state {state}, not a binary one.")
+        table[code] = state
+    return table
+
+def _patch_connections(center: tuple, neighbours: list, connections_LUT: Dict) -> Dict:
+    """The connections lookup table of a probe: the center with its neighbours, the neighbours within the patch."""
+    patch = set(neighbours) | {center}
+    return {center: list(neighbours), **{neighbour: [entity for entity in connections_LUT[neighbour] if entity in patch]
+                                         for neighbour in neighbours}}
+
+def _check_rule_table(rule_table: RuleTable, rule_function: Callable, structure: Grid):
+    """
+    Probes the rule at cells of the grid (the corners, the middles of the sides and the center) with their
+        real neighbours and connections, raising a ValueError where the table gives another state
+        (e.g. a rule depending on the number of neighbours at the edges of a grid without periodic boundary).
+    """
+    width, height = structure.width, structure.height
+    connections_LUT = structure.get_entities_connections_LUT()
+    cells = sorted({(x, y) for x in (0, width // 2, width - 1) for y in (0, height // 2, height - 1)})
+    for cell in cells:
+        neighbours = list(connections_LUT[cell])
+        positions = []
+        for x, y in neighbours:
+            offset = (x - cell[0], y - cell[1])
+            if structure.periodic_boundary:
+                offset = ((offset[0] + 1) % width - 1, (offset[1] + 1) % height - 1)
+            if offset not in rule_table.offsets:
+                raise ValueError(f"The neighbour {(x, y)} of {cell} is not in the neighbourhood of the table.")
+            positions.append(rule_table.offsets.index(offset))
+        expected = _probe_rule(rule_function, cell, neighbours, _patch_connections(cell, neighbours, connections_LUT), structure)
+        codes = np.arange(len(expected))
+        table_codes = codes & 1
+        for i, position in enumerate(positions):
+            table_codes |= (codes >> (i + 1) & 1) << (position + 1)
+        if not np.array_equal(rule_table.table[table_codes], expected):
+            raise ValueError(f"The rule gives other states than its table at {cell}.")
+
+def compile_rule(rule_function: Callable, diagonal_neighbours: bool = True,
+                 structure: Structure = None) -> RuleTable:
+    """
+    Compiles a rule function over dicts of binary states (as game_of_life) into a RuleTable, by calling it once
+        on every configuration of an entity and its grid neighbours (512 for the Moore neighbourhood).
+
+    The rule must be local, deterministic and the same everywhere: the configurations are probed at two
+        positions, and on a Grid structure again at its corners, sides and center with the connections of the
+        grid. A ValueError is raised if the probes differ, if the rule fails on them or gives non binary states.
+    """
+    offsets = grid_neighbour_offsets(diagonal_neighbours)
+    name = getattr(rule_function, '__name__', rule_function)
+    try:
+        tables = []
+        for center in ((1, 1), (4, 7)):
+            neighbours = [(center[0] + dx, center[1] + dy) for dx, dy in offsets]
+            connections_LUT = {neighbour: [entity for entity in [center] + neighbours if entity != neighbour and
+                                           (entity[0] - neighbour[0], entity[1] - neighbour[1]) in offsets]
+                               for neighbour in neighbours}
+            tables.append(_probe_rule(rule_function, center, neighbours, _patch_connections(center, neighbours, connections_LUT), structure))
+        if not np.array_equal(*tables):
+            raise ValueError(f"The rule {name} is not the same at every position.")
+        rule_table = RuleTable(tables[0], offsets)
+        if isinstance(structure, Grid):
+            _check_rule_table(rule_table, rule_function, structure)
+    except ValueError:
+        raise
+    except Exception as error:
+        raise ValueError(f"The rule {name} could not be probed: {error!r}")
+    return rule_table
+
+class TableEngine(Engine):
+    """
+    Any binary local rule on a Grid, compiled to a RuleTable: the next states are one lookup per cell
+        of the configuration codes (see RuleTable.codes).
+    """
+    def __init__(self, structure: Grid, rule_table: RuleTable):
+        if not grid_engine_compatible(structure):
+            raise ValueError("The grid entities or connections do not match the array layout of the grid.")
+        super().__init__(structure)
+        self.rule_table = rule_table
+        self.shape = (structure.width, structure.height)
+        self.periodic_boundary = structure.periodic_boundary
+        self.diagonal_neighbours = structure.diagonal_neighbours
+
+    def step(self, states: np.ndarray, counts: np.ndarray = None) -> np.ndarray:
+        return self.rule_table(states.reshape(self.shape), self.periodic_boundary).ravel()
+
+    def frontier_step(self, states: np.ndarray, frontier: np.ndarray = None,
+                      counts: np.ndarray = None):
+        """The entities whose states change in the next step, as LifeEngine.frontier_step."""
+        if frontier is None:
+            next_states = self.step(states)
+            changed = np.flatnonzero(next_states != states)
+            return changed, next_states[changed]
+        neighbours, _ = grid_neighbours_of(frontier, *self.shape, self.periodic_boundary, self.diagonal_neighbours)
+        candidates = np.unique(np.concatenate([np.asarray(frontier, dtype=np.int64), neighbours]))
+        width, height = self.shape
+        alive = (states > 0).reshape(self.shape)
+        xs, ys = np.divmod(candidates, height)
+        codes = alive[xs, ys].astype(np.int64)
+        for i, (dx, dy) in enumerate(self.rule_table.offsets):
+            nx, ny = xs + dx, ys + dy
+            if self.periodic_boundary:
+                codes |= alive[nx % width, ny % height].astype(np.int64) << (i + 1)
+            else:
+                inside = (nx >= 0) & (nx < width) & (ny >= 0) & (ny < height)
+                codes[inside] |= alive[nx[inside], ny[inside]].astype(np.int64) << (i + 1)
+        next_states = self.rule_table.table[codes]
+        changed = next_states != states[candidates]
+        return candidates[changed], next_states[changed]
+
+def grid_engine_compatible(structure: Grid) -> bool:
+    """
+    Whether the grid can be stepped as a (width, height) array: no entities added beyond the grid,
+        and no neighbour counted twice by the connections (periodic sides shorter than 3 cells are).
+    """
+    if len(structure.entities) != structure.width * structure.height:
+        return False
+    return not (structure.periodic_boundary and min(structure.width, structure.height) < 3)
+
+def binary_states(structure: Structure) -> bool:
+    """Whether the states of the last timestep of the structure are all 0 or 1."""
+    base_name = getattr(structure, "key_name", {}).get("base_name", "t_")
+    key_name = base_name + str(getattr(structure, "last_iterations", {}).get(base_name, 0))
+    if not structure.has_time_key(key_name):
+        return True
+    states = structure.get_state_array(key_name)
+    return bool(((states == 0) | (states == 1)).all())
+
+def life_like_counts(rule_function: Callable):
+    """
+    Returns the (birth, survival) neighbour counts of a Life-like rule function, or None if it is not one.
+    """
+    if rule_function is game_of_life:
+        return (3,), (2, 3)
+    if isinstance(rule_function, LifeLikeRule):
+        return tuple(rule_function.birth), tuple(rule_function.survival)
+    return None
+
+def select_engine(structure: Structure, rule_function: Callable,
+                  engine: str = "auto") -> Engine | None:
+    """
+    Returns the array engine for a rule function on a structure, or None to use the dict path.
+
+    engine:
+        - "auto": an array engine if one exists for the rule and the structure (Life-like rules), otherwise None
+        - "compile": as "auto", and other rules on a Grid with binary states are compiled to a lookup table
+            (see compile_rule, the rule is probed for every configuration at up to 11 cells, about 5600 calls
+            for the Moore neighbourhood), None if the rule cannot be compiled
+        - "array": as "compile", raising ValueError if there is no array engine
+        - "dict" or None: None (rule functions over dicts of entities)
+    """
+    if engine in (None, "dict"):
+        return None
+    if engine not in ("auto", "compile", "array"):
+        raise ValueError(f"engine must be 'auto', 'compile', 'array', 'dict' or None, not {engine}")
+    life_like = life_like_counts(rule_function)
+    if life_like is not None:
+        if isinstance(structure, Grid) and grid_engine_compatible(structure):
+            return GridLifeEngine(structure, *life_like)
+        return GraphLifeEngine(structure, *life_like)
+    reason = "no array engine"
+    if engine != "auto" and isinstance(structure, Grid) and grid_engine_compatible(structure):
+        #Other rules: compiled to a lookup table if they are binary and local
+        try:
+            if not binary_states(structure):
+                raise ValueError("The states of the grid are not all 0 or 1.")
+            rule_table = compile_rule(rule_function, structure.diagonal_neighbours, structure)
+            if rule_table.totalistic:
+                return GridLifeEngine(structure, rule_table.birth, rule_table.survival)
+            return TableEngine(structure, rule_table)
+        except ValueError as error:
+            reason = str(error)
+    if engine == "array":
+        raise ValueError(f"No array engine for {getattr(rule_function, '__name__', rule_function)} on {type(structure).__name__}: {reason}")
+    return None
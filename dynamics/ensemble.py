@@ -0,0 +1,148 @@
+import numpy as np
+from typing import Dict, List, Callable
+from higherorder.structures.structures import Grid
+from .rules import game_of_life
+from .engines import grid_neighbour_counts, grid_neighbour_offsets, life_like_counts
+##ensembles: many initial grids stepped together as one (members x width x height) array
+
+class EnsembleResult:
+    """
+    Per-member outcomes of simulate_ensemble, matching Model.simulate_till_periodicity run on each grid:
+
+    - has_ended: the member died out (Model.has_ended)
+    - last_simulation_steps: the number of steps taken (Model.last_simulation_step - initial timestep)
+    - max_times: the last timestep with stored (nonzero) states, i.e. the run length of the notebook
+    - periods, period_starts: the period and the first timestep of the repeated topology (Model.period and
+        Model.transient), -1 if there was none within max_steps. A member that died out repeats the empty
+        state (period 1)
+    - states: the (timesteps x width x height) states of every member, up to its max_time
+    """
+    def __init__(self, has_ended: np.ndarray, last_simulation_steps: np.ndarray,
+                 max_times: np.ndarray, periods: np.ndarray, period_starts: np.ndarray,
+                 states: List[np.ndarray] = None, base_name: str = "t_"):
+        self.has_ended = has_ended
+        self.last_simulation_steps = last_simulation_steps
+        self.max_times = max_times
+        self.periods = periods
+        self.period_starts = period_starts
+        self.states = states
+        self.base_name = base_name
+
+    def __len__(self):
+        return len(self.has_ended)
+
+    def get_entities_states(self, i: int) -> Dict:
+        """
+        States of member i in the format of Structure.get_entities_states (only nonzero values).
+        """
+        states = self.states[i]
+        time_slices = {}
+        for t, x, y in zip(*np.nonzero(states)):
+            time_slices.setdefault((int(x), int(y)), {})[self.base_name + str(int(t))] = states[t, x, y].item()
+        return {entity: time_slices[entity] for entity in sorted(time_slices)}
+
+def ensemble_initial_states(initial_states: List[Dict] | np.ndarray,
+                            width: int = None, height: int = None) -> np.ndarray:
+    """
+    Stacks initial states (dicts of (x, y): value, e.g. from load_init_grid_dicts) into a
+        (members x width x height) uint8 array of live (1) and dead (0) cells.
+    """
+    if isinstance(initial_states, np.ndarray):
+        return (initial_states > 0).astype(np.uint8)
+    if not width:
+        width = 1 + max(x for states in initial_states for x, _ in states)
+    if not height:
+        height = 1 + max(y for states in initial_states for _, y in states)
+    array = np.zeros((len(initial_states), width, height), dtype=np.uint8)
+    for i, states in enumerate(initial_states):
+        for (x, y), value in states.items():
+            if value > 0:
+                array[i, x, y] = 1
+    return array
+
+def simulate_ensemble(initial_states: List[Dict] | np.ndarray,
+                      width: int = None, height: int = None,
+                      dynamics_func: Callable = game_of_life,
+                      periodic_boundary: bool = True,
+                      diagonal_neighbours: bool = True,
+                      max_steps: int = 1000,
+                      return_states: bool = True,
+                      base_name: str = "t_",
+                      ) -> EnsembleResult:
+    """
+    Simulates many initial grids till periodicity at once, stepping all running members as one array.
+
+    Equivalent to building a Grid and a Model per initial state and calling simulate_till_periodicity
+        (with only_nonzero=True), for Life-like rules (game_of_life or rules.LifeLikeRule).
+        Members leave the batch as they die out or repeat the topology of an earlier timestep.
+
+    Args:
+        initial_states: list of dicts of (x, y): value, or a (members x width x height) array
+        width, height: grid size (default: from the initial states)
+        max_steps: maximum number of steps per member
+        return_states: whether to collect the states of every member (EnsembleResult.states)
+    """
+    life_like = life_like_counts(dynamics_func)
+    if life_like is None:
+        raise ValueError(f"simulate_ensemble supports Life-like rules only, not {getattr(dynamics_func, '__name__', dynamics_func)}")
+    current = ensemble_initial_states(initial_states, width, height)
+    members, width, height = current.shape
+    if periodic_boundary and min(width, height) < 3:
+        raise ValueError("Periodic sides shorter than 3 cells are not supported, use Model instead.")
+    max_neighbours = len(grid_neighbour_offsets(diagonal_neighbours))
+    birth_table = np.isin(np.arange(max_neighbours + 1), list(life_like[0]))
+    survival_table = np.isin(np.arange(max_neighbours + 1), list(life_like[1]))
+
+    #Template grid for the topology representation of the components
+    template = Grid(width=width, height=height, periodic_boundary=periodic_boundary,
+                    diagonal_neighbours=diagonal_neighbours)
+
+    has_ended = np.zeros(members, dtype=bool)
+    last_simulation_steps = np.full(members, max_steps, dtype=np.int64)
+    max_times = np.full(members, max_steps, dtype=np.int64)
+    periods = np.full(members, -1, dtype=np.int64)
+    period_starts = np.full(members, -1, dtype=np.int64)
+    seen = [{key: 0} for key in template.get_components_topology_keys(current)]
+
+    active = np.arange(members)
+    history = [(active, current)] if return_states else None
+    step = 0
+    while len(active) and step < max_steps:
+        counts = grid_neighbour_counts(current, periodic_boundary, diagonal_neighbours)
+        current = np.where(current > 0, survival_table[counts], birth_table[counts]).astype(np.uint8)
+        step += 1
+        keep = np.ones(len(active), dtype=bool)
+        died = ~current.reshape(len(active), -1).any(axis=1)
+        #Topology keys of the running members, labeled together in one batch
+        keys = iter(template.get_components_topology_keys(current[~died]))
+        for position, i in enumerate(active):
+            if died[position]:
+                #The Model takes one more step (which finds no states) before stopping
+                has_ended[i] = True
+                last_simulation_steps[i] = step if b"" in seen[i] else step + 1
+                max_times[i] = step - 1
+                period_starts[i] = seen[i].get(b"", step)
+                periods[i] = 1
+                keep[position] = False
+                continue
+            key = next(keys)
+            if key in seen[i]:
+                last_simulation_steps[i] = max_times[i] = step
+                period_starts[i] = seen[i][key]
+                periods[i] = step - seen[i][key]
+                keep[position] = False
+            else:
+                seen[i][key] = step
+        if return_states:
+            history.append((active, current))
+        active, current = active[keep], current[keep]
+
+    states = None
+    if return_states:
+        states = [np.zeros((max_times[i] + 1, width, height), dtype=np.uint8) for i in range(members)]
+        for t, (ids, batch) in enumerate(history):
+            for position, i in enumerate(ids):
+                if t <= max_times[i]:
+                    states[i][t] = batch[position]
+    return EnsembleResult(has_ended, last_simulation_steps, max_times, periods, period_starts,
+                          states=states, base_name=base_name)
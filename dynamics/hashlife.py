@@ -0,0 +1,337 @@
+import numpy as np
+from typing import Dict, Iterable, Callable, Tuple
+from higherorder.structures.structures import Grid
+from .rules import game_of_life
+from .engines import life_like_counts
+##hashlife: hash-consed quadtree with memoized futures, for jumping many generations of Life-like rules
+
+class QuadNode:
+    """
+    Node of a hash-consed quadtree: a square of 2**level cells made of 4 nodes of level - 1,
+        nw (low x, low y), ne (low x, high y), sw (high x, low y) and se (high x, high y).
+        Level 0 nodes are single cells. Equal squares are the same node (see HashLife.join).
+    """
+    __slots__ = ("level", "nw", "ne", "sw", "se", "population")
+
+    def __init__(self, level: int, nw=None, ne=None, sw=None, se=None, population: int = 0):
+        self.level = level
+        self.nw, self.ne, self.sw, self.se = nw, ne, sw, se
+        self.population = population
+
+    def __repr__(self):
+        return f"{type(self).__name__}(level={self.level}, population={self.population})"
+
+DEAD = QuadNode(0, population=0)
+ALIVE = QuadNode(0, population=1)
+
+class HashLife:
+    """
+    HashLife (Gosper's algorithm) for a Life-like rule: every node is stored once, and the future of
+        its centre, 2**j generations ahead, is computed once and memoized. Repeating patterns (e.g. gliders,
+        oscillators and empty space) then cost a lookup, so 2**k generations can be jumped at once.
+
+    max_nodes bounds the cache: when it is exceeded after an operation, only the nodes reachable from
+        the nodes in use are kept (see collect), and the memoized futures are dropped.
+    Rules with birth on 0 neighbours (B0) are not supported, as empty space would not stay empty.
+    """
+    def __init__(self, dynamics_func: Callable = game_of_life,
+                 birth: Iterable[int] = None,
+                 survival: Iterable[int] = None,
+                 diagonal_neighbours: bool = True,
+                 max_nodes: int = 2**20):
+        if birth is None or survival is None:
+            life_like = life_like_counts(dynamics_func)
+            if life_like is None:
+                raise ValueError(f"HashLife supports Life-like rules only, not {getattr(dynamics_func, '__name__', dynamics_func)}")
+            birth, survival = life_like
+        if 0 in birth:
+            raise ValueError("Rules with birth on 0 neighbours (B0) are not supported by HashLife.")
+        self.birth = frozenset(birth)
+        self.survival = frozenset(survival)
+        self.diagonal_neighbours = diagonal_neighbours
+        self.max_nodes = max_nodes
+        self.collections = 0
+        self._nodes = {} #(nw, ne, sw, se): node
+        self._results = {} #(node, j): centre of the node 2**j generations later
+        self._empty = [DEAD]
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def join(self, nw: QuadNode, ne: QuadNode, sw: QuadNode, se: QuadNode) -> QuadNode:
+        """The (unique) node made of 4 nodes of the same level."""
+        key = (nw, ne, sw, se)
+        node = self._nodes.get(key)
+        if node is None:
+            node = QuadNode(nw.level + 1, nw, ne, sw, se,
+                            nw.population + ne.population + sw.population + se.population)
+            self._nodes[key] = node
+        return node
+
+    def empty(self, level: int) -> QuadNode:
+        while len(self._empty) <= level:
+            e = self._empty[-1]
+            self._empty.append(self.join(e, e, e, e))
+        return self._empty[level]
+
+    def centre(self, node: QuadNode) -> QuadNode:
+        """The node one level up with `node` in its middle (padded with empty space)."""
+        e = self.empty(node.level - 1)
+        return self.join(self.join(e, e, e, node.nw), self.join(e, e, node.ne, e),
+                         self.join(e, node.sw, e, e), self.join(node.se, e, e, e))
+
+    def inner(self, node: QuadNode) -> QuadNode:
+        """The middle half of a node (one level down)."""
+        return self.join(node.nw.se, node.ne.sw, node.sw.ne, node.se.nw)
+
+    def from_array(self, array: np.ndarray) -> QuadNode:
+        """The node of a square (2**level, 2**level) binary array, indexed [x, y]."""
+        size = array.shape[0]
+        if array.shape != (size, size) or size & (size - 1):
+            raise ValueError(f"The array must be square with a power of 2 side, not {array.shape}")
+        level = size.bit_length() - 1
+
+        def build(a, level):
+            if not a.any():
+                return self.empty(level)
+            if level == 0:
+                return ALIVE
+            h = a.shape[0] // 2
+            return self.join(build(a[:h, :h], level - 1), build(a[:h, h:], level - 1),
+                             build(a[h:, :h], level - 1), build(a[h:, h:], level - 1))
+        return build(array > 0, level)
+
+    def to_array(self, node: QuadNode, origin: Tuple[int, int] = (0, 0),
+                 window: Tuple[int, int, int, int] = None) -> np.ndarray:
+        """
+        The cells of a node placed with its low corner at origin, in the window (x0, y0, width, height)
+            (default: the whole node), as a uint8 array indexed [x - x0, y - y0].
+        """
+        if window is None:
+            window = (origin[0], origin[1], 2**node.level, 2**node.level)
+        x0, y0, width, height = window
+        array = np.zeros((width, height), dtype=np.uint8)
+        stack = [(node, origin[0], origin[1])]
+        while stack:
+            node, x, y = stack.pop()
+            size = 2**node.level
+            if node.population == 0 or x >= x0 + width or y >= y0 + height or x + size <= x0 or y + size <= y0:
+                continue
+            if node.level == 0:
+                array[x - x0, y - y0] = 1
+                continue
+            h = size // 2
+            stack += [(node.nw, x, y), (node.ne, x, y + h), (node.sw, x + h, y), (node.se, x + h, y + h)]
+        return array
+
+    def _life_4x4(self, node: QuadNode) -> QuadNode:
+        """Base case: the middle 2x2 cells of a level 2 node, one generation later."""
+        cells = self.to_array(node)
+        offsets = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+        if self.diagonal_neighbours:
+            offsets += [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+        new = []
+        for x, y in [(1, 1), (1, 2), (2, 1), (2, 2)]:
+            count = sum(int(cells[x + dx, y + dy]) for dx, dy in offsets)
+            alive = count in self.survival if cells[x, y] else count in self.birth
+            new.append(ALIVE if alive else DEAD)
+        return self.join(*new)
+
+    def successor(self, node: QuadNode, j: int = None) -> QuadNode:
+        """
+        The middle half of a node (level >= 2), 2**j generations later (j <= level - 2, default the most).
+        """
+        if j is None or j > node.level - 2:
+            j = node.level - 2
+        if node.population == 0:
+            return self.empty(node.level - 1)
+        result = self._results.get((node, j))
+        if result is not None:
+            return result
+        if node.level == 2:
+            result = self._life_4x4(node)
+        else:
+            nw, ne, sw, se = node.nw, node.ne, node.sw, node.se
+            join = self.join
+            #The 9 overlapping sub-squares of level - 1, advanced
+            c = [self.successor(square, j) for square in (
+                nw, join(nw.ne, ne.nw, nw.se, ne.sw), ne,
+                join(nw.sw, nw.se, sw.nw, sw.ne), join(nw.se, ne.sw, sw.ne, se.nw), join(ne.sw, ne.se, se.nw, se.ne),
+                sw, join(sw.ne, se.nw, sw.se, se.sw), se)]
+            quarters = [(c[0], c[1], c[3], c[4]), (c[1], c[2], c[4], c[5]),
+                        (c[3], c[4], c[6], c[7]), (c[4], c[5], c[7], c[8])]
+            if j < node.level - 2:
+                result = join(*[join(a.se, b.sw, c_.ne, d.nw) for a, b, c_, d in quarters])
+            else:
+                result = join(*[self.successor(join(*quarter), j) for quarter in quarters])
+        self._results[(node, j)] = result
+        return result
+
+    def collect(self, *roots: QuadNode):
+        """Evicts every node not reachable from the roots, and the memoized futures."""
+        nodes = {}
+        stack = [root for root in roots if root is not None] + self._empty[1:]
+        while stack:
+            node = stack.pop()
+            if node.level == 0 or (node.nw, node.ne, node.sw, node.se) in nodes:
+                continue
+            nodes[(node.nw, node.ne, node.sw, node.se)] = node
+            stack += [node.nw, node.ne, node.sw, node.se]
+        self._nodes = nodes
+        self._results = {}
+        self.collections += 1
+
+    def _check_cache(self, *roots: QuadNode):
+        if len(self._nodes) > self.max_nodes:
+            self.collect(*roots)
+
+    def advance_torus(self, node: QuadNode, generations: int) -> QuadNode:
+        """
+        A torus (periodic square of 2**level cells, level >= 2) `generations` later, 2**j generations
+            at a time: the successor of a tiling of 2**p x 2**p copies of it is the middle of the tiling,
+            i.e. the torus rolled by half its side for p = 1, and not rolled for p >= 2 (rolled back here).
+        """
+        level = node.level
+        while generations > 0:
+            j = generations.bit_length() - 1
+            tiled = node
+            while tiled.level < max(level + 1, j + 2):
+                tiled = self.join(tiled, tiled, tiled, tiled)
+            result = self.successor(tiled, j)
+            while result.level > level:
+                result = result.nw
+            if tiled.level == level + 1:
+                result = self.join(result.se, result.sw, result.ne, result.nw)
+            node = result
+            generations -= 2**j
+        return node
+
+    def advance_plane(self, node: QuadNode, origin: Tuple[int, int],
+                      generations: int) -> Tuple[QuadNode, Tuple[int, int]]:
+        """
+        A pattern on the infinite plane (node with its low corner at origin) `generations` later,
+            padded with empty space as needed. Returns the new node and its origin.
+        """
+        x, y = origin
+        while generations > 0:
+            j = generations.bit_length() - 1
+            #The pattern has to stay in the middle quarter, so it can not grow out of the result
+            while node.level < j + 3 or node.population != self.inner(self.inner(node)).population:
+                half = 2**(node.level - 1)
+                node, x, y = self.centre(node), x - half, y - half
+            quarter = 2**(node.level - 2)
+            node, x, y = self.successor(node, j), x + quarter, y + quarter
+            generations -= 2**j
+        return node, (x, y)
+
+class HashLifeGrid:
+    """
+    The states of a grid advanced with HashLife, for long horizons:
+
+    - periodic (default): a torus of the grid size, which must be a power of 2 in both directions
+        (the torus is tiled into a square, which stays periodic)
+    - unbounded: the states placed on an infinite plane, read back in the window of the grid
+        (not the same as a grid without periodic boundary, where cells beyond the edges never come alive)
+
+    The initial states are kept, so states_at (and to_grid) can return any generation, reusing the
+        memoized futures of the shared HashLife cache.
+    """
+    def __init__(self, states: np.ndarray,
+                 periodic_boundary: bool = True,
+                 diagonal_neighbours: bool = True,
+                 dynamics_func: Callable = game_of_life,
+                 unbounded: bool = False,
+                 max_nodes: int = 2**20,
+                 time_step: int = 0,
+                 hashlife: HashLife = None):
+        self.width, self.height = states.shape
+        if not unbounded:
+            if not periodic_boundary:
+                raise ValueError("HashLife steps a torus or the infinite plane (unbounded=True), not a grid with edges.")
+            if any(side < 4 or side & (side - 1) for side in (self.width, self.height)):
+                raise ValueError(f"Periodic grids need power of 2 sides of at least 4 for HashLife, not {self.width}x{self.height}")
+        self.unbounded = unbounded
+        self.hashlife = hashlife or HashLife(dynamics_func, diagonal_neighbours=diagonal_neighbours, max_nodes=max_nodes)
+        self.initial_time_step = time_step
+        self.generation = 0
+        if unbounded:
+            size = 1 << max(2, (max(self.width, self.height) - 1).bit_length())
+            padded = np.zeros((size, size), dtype=np.uint8)
+            padded[:self.width, :self.height] = states > 0
+            self.initial_root, self.initial_origin = self.hashlife.from_array(padded), (0, 0)
+        else:
+            size = max(self.width, self.height)
+            tiled = np.tile(states > 0, (size // self.width, size // self.height))
+            self.initial_root, self.initial_origin = self.hashlife.from_array(tiled), (0, 0)
+        self.root, self.origin = self.initial_root, self.initial_origin
+
+    @classmethod
+    def from_grid(cls, grid: Grid, key_name: str = None,
+                  dynamics_func: Callable = game_of_life, **kwargs) -> "HashLifeGrid":
+        """The states of a Grid at key_name (default: its last timestep)."""
+        base_name = grid.key_name["base_name"]
+        if key_name is None:
+            key_name = base_name + str(grid.last_iterations.get(base_name, grid.initial_time_step))
+        if len(grid.entities) != grid.width * grid.height:
+            raise ValueError("The grid entities do not match the array layout of the grid.")
+        states = grid.get_state_array(key_name).reshape(grid.width, grid.height)
+        suffix = key_name[len(base_name):]
+        return cls(states, grid.periodic_boundary, grid.diagonal_neighbours, dynamics_func,
+                   time_step=int(suffix) if suffix.isdigit() else 0, **kwargs)
+
+    def _advance(self, root: QuadNode, origin: Tuple[int, int], generations: int):
+        if self.unbounded:
+            return self.hashlife.advance_plane(root, origin, generations)
+        return self.hashlife.advance_torus(root, generations), origin
+
+    def step(self, generations: int = 1):
+        """Advances the current states by `generations`."""
+        self.root, self.origin = self._advance(self.root, self.origin, generations)
+        self.generation += generations
+        self.hashlife._check_cache(self.initial_root, self.root)
+
+    def jump(self, k: int):
+        """Advances the current states by 2**k generations."""
+        self.step(2**k)
+
+    def states_at(self, generation: int = None) -> np.ndarray:
+        """The (width, height) uint8 states at a generation (default: the current one)."""
+        if generation is None or generation == self.generation:
+            root, origin = self.root, self.origin
+        elif generation > self.generation:
+            root, origin = self._advance(self.root, self.origin, generation - self.generation)
+        else:
+            root, origin = self._advance(self.initial_root, self.initial_origin, generation)
+        self.hashlife._check_cache(self.initial_root, self.root)
+        if self.unbounded:
+            return self.hashlife.to_array(root, origin, window=(0, 0, self.width, self.height))
+        return self.hashlife.to_array(root)[:self.width, :self.height]
+
+    @property
+    def population(self) -> int:
+        """Live cells of the current states (in the grid window if unbounded)."""
+        return int(self.states_at().sum())
+
+    def to_dict(self, generation: int = None) -> Dict:
+        """The states at a generation as a dict of (x, y): 1 of the live cells (a Grid time slice)."""
+        return {(x, y): 1 for x, y in zip(*(axis.tolist() for axis in np.nonzero(self.states_at(generation))))}
+
+    def to_grid(self, grid: Grid, generation: int = None, key_name: str = None):
+        """
+        Writes the states at a generation (default: the current one) into a Grid of the same size, as the
+            time slice key_name (default: base_name + initial time step + generation).
+        """
+        if (grid.width, grid.height) != (self.width, self.height):
+            raise ValueError(f"Grid of size {grid.width}x{grid.height} does not match {self.width}x{self.height}")
+        generation = self.generation if generation is None else generation
+        base_name = grid.key_name["base_name"]
+        if key_name is None:
+            key_name = base_name + str(self.initial_time_step + generation)
+        grid.set_time_slice(self.states_at(generation).ravel(), key_name)
+        suffix = key_name[len(base_name):]
+        if suffix.isdigit() and int(suffix) > grid.last_iterations.get(base_name, 0):
+            grid.last_iterations[base_name] = int(suffix)
+
+    def __repr__(self):
+        mode = "unbounded" if self.unbounded else "torus"
+        return f"{type(self).__name__}({self.width}x{self.height} {mode}, generation={self.generation}, {len(self.hashlife)} nodes)"
@@ -1,5 +1,8 @@
-from typing import Dict, Callable#, Any, List, Tuple
+import numpy as np
+from collections.abc import MutableMapping
+from typing import Dict, List, Tuple, Callable, Iterable#, Any
 from higherorder.structures.structures import Structure, Grid, Graph
+from higherorder.structures.adjacency import AdjacencyIndex
 ##rule (dynamics logic) functions
 
 def general_impact(impact_function:Callable,
@@ -20,7 +23,7 @@ def general_impact(impact_function:Callable,
     if field_name:
         entities = {k: v[field_name] for k, v in entities.items() if field_name in v}
     if structure:
-        for entity in structure.get_entities():
+        for entity in structure.get_entity_list():
             if entity not in entities:
                 entities[entity] = 0
     elif connections_LUT:
@@ -91,4 +94,297 @@ def game_of_life_impact(entities: Dict = None,
                 if neighbor_state == 1 and neighbor_other_live_neighbors == 1:
                     impacts[(entity, neighbor)] = "live"
 
-    return impacts
\ No newline at end of file
+    return impacts
+
+##array impacts: impacts as (source id, target id, code) arrays, computed from the live neighbour counts
+
+#Code table of the impact types, code 0 is no impact
+IMPACT_TYPES = ("", "kill", "redundancy_kill", "birth", "no_birth", "redundancy_live", "live",
+                "nonactive_kill", "nonactive_live", "nonactive_redundancy_live", "nonactive_birth", "nonactive_no_birth")
+IMPACT_CODES = {name: code for code, name in enumerate(IMPACT_TYPES)}
+ACTIVE_IMPACT_TYPES = ("kill", "redundancy_kill", "birth", "no_birth", "redundancy_live")
+
+def game_of_life_impact_table(max_neighbours: int = 8) -> np.ndarray:
+    """
+    The impact code of game_of_life_impact, indexed by [source state, target state, live neighbours
+        of the target other than the source].
+    """
+    table = np.zeros((2, 2, max_neighbours + 1), dtype=np.uint8)
+    for others, name in [(3, "kill"), (2, "redundancy_live"), (1, "live")]:
+        if others <= max_neighbours:
+            table[1, 1, others] = IMPACT_CODES[name]
+    table[1, 1, 4:] = IMPACT_CODES["redundancy_kill"]
+    for others, name in [(2, "birth"), (3, "no_birth")]:
+        if others <= max_neighbours:
+            table[1, 0, others] = IMPACT_CODES[name]
+    for others, name in [(1, "nonactive_kill"), (3, "nonactive_live"), (2, "nonactive_redundancy_live")]:
+        if others <= max_neighbours:
+            table[0, 1, others] = IMPACT_CODES[name]
+    for others, name in [(3, "nonactive_birth"), (2, "nonactive_no_birth")]:
+        if others <= max_neighbours:
+            table[0, 0, others] = IMPACT_CODES[name]
+    return table
+
+def array_impact_table(impact_function: Callable, max_neighbours: int = 8) -> np.ndarray | None:
+    """
+    Returns the impact code table of an impact function, or None if it has no array version.
+    """
+    if impact_function is game_of_life_impact:
+        return game_of_life_impact_table(max_neighbours)
+    return None
+
+def array_impacts(adjacency: AdjacencyIndex,
+                  states: np.ndarray,
+                  impact_table: np.ndarray,
+                  counts: np.ndarray = None,
+                  active_only: bool = True) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Impacts of every entity on each of its neighbours, from the states (1D array in entity index order).
+
+    impact_table: code table covering the largest degree (see game_of_life_impact_table)
+    counts: live neighbour counts of the entities, if already computed (e.g. by the engine stepping
+        the same states), otherwise computed from the adjacency.
+
+    Returns the source ids, target ids and impact codes (see IMPACT_TYPES) of the impacts,
+        ordered by source and then target id.
+    """
+    alive = (states > 0).astype(np.int64)
+    if counts is None:
+        counts = adjacency.neighbour_sum(alive.astype(np.float64))
+    sources, targets = adjacency.row_ids, adjacency.indices
+    if active_only:
+        live_entries = alive[sources] > 0
+        sources, targets = sources[live_entries], targets[live_entries]
+    others = np.asarray(counts, dtype=np.int64)[targets] - alive[sources]
+    codes = impact_table[alive[sources], alive[targets], others]
+    impacting = codes > 0
+    return sources[impacting], targets[impacting], codes[impacting]
+
+def impact_arrays_to_dict(entity_list: List, sources: np.ndarray, targets: np.ndarray,
+                          codes: np.ndarray) -> Dict:
+    """
+    Converts impact arrays to the {(source, target): impact type} format of the impact functions.
+    """
+    return {(entity_list[source], entity_list[target]): IMPACT_TYPES[code]
+            for source, target, code in zip(sources.tolist(), targets.tolist(), codes.tolist())}
+
+##impact log: impacts of all timesteps as columns (time, source id, target id, type code)
+
+class ImpactStep(dict):
+    """
+    The {(source, target): impact type} dict of a timestep read from an ImpactLog, built on every access,
+        so writes into it raise TypeError (they would not reach the log). copy() gives a plain dict.
+    """
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("The impacts of a timestep are read-only, set the whole timestep in the ImpactLog.")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    update = pop = popitem = clear = setdefault = _read_only
+
+    def copy(self) -> Dict:
+        return dict(self)
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+class ImpactLog(MutableMapping):
+    """
+    Columnar store of the impacts of a simulation, keeping the {"t_0": {(source, target): impact type}}
+        API of Model.impact (a timestep reads as a read-only ImpactStep dict sorted by (source, target), built
+        on every access: set a whole timestep, log[key_name] = impacts, to change it).
+
+    Every timestep is stored as source and target entity ids (positions in entity_list) and uint8 type
+        codes (positions in impact_types, which starts with IMPACT_TYPES and grows with unknown types).
+    The columns of all timesteps (times, sources, targets, codes) are used for masks and counts
+        without building dicts.
+    """
+    def __init__(self, entity_list: List = None, base_name: str = "t_"):
+        self.entity_list = list(entity_list or [])
+        self.entity_index = {entity: i for i, entity in enumerate(self.entity_list)}
+        self.impact_types = list(IMPACT_TYPES)
+        self.impact_codes = dict(IMPACT_CODES)
+        self.base_name = base_name
+        self._steps = {} #key_name: (sources, targets, codes)
+        self._columns = None
+
+    @classmethod
+    def from_dict(cls, impacts: Dict, entity_list: List = None, base_name: str = "t_") -> "ImpactLog":
+        """Builds a log from the {timestep: {(source, target): impact type}} dict format."""
+        if isinstance(impacts, ImpactLog):
+            return impacts
+        log = cls(entity_list, base_name)
+        for key_name, step_impacts in impacts.items():
+            log[key_name] = step_impacts
+        return log
+
+    def sync_entities(self, entity_list: List):
+        """Appends the entities added to the structure (entity_list) since the log was created."""
+        for entity in entity_list[len(self.entity_list):]:
+            self.entity_index[entity] = len(self.entity_list)
+            self.entity_list.append(entity)
+
+    def _entity_ids(self, entities: Iterable) -> np.ndarray:
+        ids = []
+        for entity in entities:
+            if entity not in self.entity_index:
+                self.entity_index[entity] = len(self.entity_list)
+                self.entity_list.append(entity)
+            ids.append(self.entity_index[entity])
+        return np.array(ids, dtype=np.int64)
+
+    def _type_code(self, name: str) -> int:
+        if name not in self.impact_codes:
+            if len(self.impact_types) > np.iinfo(np.uint8).max:
+                raise ValueError("More than 255 impact types can not be stored.")
+            self.impact_codes[name] = len(self.impact_types)
+            self.impact_types.append(name)
+        return self.impact_codes[name]
+
+    def append(self, key_name: str, sources: np.ndarray, targets: np.ndarray, codes: np.ndarray):
+        """
+        Stores the impacts of a timestep as arrays (entity ids and codes of IMPACT_TYPES,
+            e.g. from array_impacts), replacing the timestep if stored.
+        """
+        self._steps.pop(key_name, None)
+        self._steps[key_name] = (np.asarray(sources, dtype=np.int64), np.asarray(targets, dtype=np.int64),
+                                 np.asarray(codes, dtype=np.uint8))
+        self._columns = None
+
+    def step_arrays(self, key_name: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """The impacts of a timestep as (source ids, target ids, codes) arrays, see append."""
+        return self._steps[key_name]
+
+    def __setitem__(self, key_name: str, impacts: Dict):
+        """Stores the impacts of a timestep from the {(source, target): impact type} format."""
+        self.append(key_name, self._entity_ids(source for source, _ in impacts),
+                    self._entity_ids(target for _, target in impacts),
+                    np.array([self._type_code(name) for name in impacts.values()], dtype=np.uint8))
+
+    def __getitem__(self, key_name: str) -> ImpactStep:
+        return ImpactStep(self._step_dict(key_name))
+
+    def _step_dict(self, key_name: str) -> Dict:
+        sources, targets, codes = self._steps[key_name]
+        impacts = {(self.entity_list[source], self.entity_list[target]): self.impact_types[code]
+                   for source, target, code in zip(sources.tolist(), targets.tolist(), codes.tolist())}
+        return {k: v for k, v in sorted(impacts.items(), key=lambda item: item[0])}
+
+    def __delitem__(self, key_name: str):
+        del self._steps[key_name]
+        self._columns = None
+
+    def __iter__(self):
+        return iter(self._steps)
+
+    def __len__(self):
+        return len(self._steps)
+
+    def __contains__(self, key_name):
+        return key_name in self._steps
+
+    def time(self, key_name: str) -> int:
+        """The timestep of a key name (its position among the keys if it is not base_name + int)."""
+        suffix = key_name[len(self.base_name):] if key_name.startswith(self.base_name) else ""
+        return int(suffix) if suffix.lstrip("-").isdigit() else list(self._steps).index(key_name)
+
+    @property
+    def columns(self) -> Dict[str, np.ndarray]:
+        """The impacts of all timesteps as "time", "source", "target" and "code" arrays, in timestep order."""
+        if self._columns is None:
+            steps = list(self._steps.items())
+            sizes = [len(codes) for _, (_, _, codes) in steps]
+            self._columns = {
+                "time": np.repeat(np.array([self.time(key_name) for key_name, _ in steps], dtype=np.int64), sizes),
+                "source": np.concatenate([sources for _, (sources, _, _) in steps] or [np.zeros(0, np.int64)]),
+                "target": np.concatenate([targets for _, (_, targets, _) in steps] or [np.zeros(0, np.int64)]),
+                "code": np.concatenate([codes for _, (_, _, codes) in steps] or [np.zeros(0, np.uint8)]),
+            }
+        return self._columns
+
+    @property
+    def times(self) -> np.ndarray:
+        return self.columns["time"]
+
+    @property
+    def sources(self) -> np.ndarray:
+        return self.columns["source"]
+
+    @property
+    def targets(self) -> np.ndarray:
+        return self.columns["target"]
+
+    @property
+    def codes(self) -> np.ndarray:
+        return self.columns["code"]
+
+    def type_codes(self, impact_type: str | List[str] = None, redundancy: bool = False) -> np.ndarray:
+        """
+        Codes of the selected impact types: impact_type can be a type, a list of types or "active"
+            (ACTIVE_IMPACT_TYPES), redundancy keeps the types containing "redundancy".
+        """
+        selected = np.ones(len(self.impact_types), dtype=bool)
+        selected[0] = False
+        if redundancy:
+            selected &= np.array(["redundancy" in name for name in self.impact_types])
+        if impact_type is not None:
+            names = ACTIVE_IMPACT_TYPES if impact_type == "active" else (
+                [impact_type] if isinstance(impact_type, str) else impact_type)
+            selected &= np.isin(self.impact_types, list(names))
+        return np.flatnonzero(selected).astype(np.uint8)
+
+    def mask(self, impact_type: str | List[str] = None, redundancy: bool = False) -> np.ndarray:
+        """Boolean mask over the columns of the impacts of the selected types (see type_codes)."""
+        return np.isin(self.codes, self.type_codes(impact_type, redundancy))
+
+    def filter(self, impact_type: str | List[str] = None, redundancy: bool = False) -> "ImpactLog":
+        """
+        A log with only the impacts of the selected types (see type_codes), keeping every timestep.
+        """
+        log = ImpactLog(base_name=self.base_name)
+        log.entity_list, log.entity_index = self.entity_list, self.entity_index
+        log.impact_types, log.impact_codes = self.impact_types, self.impact_codes
+        selected = self.type_codes(impact_type, redundancy)
+        for key_name, (sources, targets, codes) in self._steps.items():
+            kept = np.isin(codes, selected)
+            log._steps[key_name] = (sources[kept], targets[kept], codes[kept])
+        return log
+
+    def counts_per_step(self) -> np.ndarray:
+        """
+        Number of impacts of each type at each timestep, as a (timesteps x impact types) array
+            (in key order, columns following impact_types).
+        """
+        num_types = len(self.impact_types)
+        sizes = [len(codes) for _, _, codes in self._steps.values()]
+        step_ids = np.repeat(np.arange(len(sizes)), sizes)
+        counts = np.bincount(step_ids * num_types + self.codes, minlength=len(sizes) * num_types)
+        return counts.reshape(len(sizes), num_types)
+
+    def type_counts(self) -> Dict[str, int]:
+        """Number of impacts of each type over all timesteps."""
+        counts = np.bincount(self.codes, minlength=len(self.impact_types))
+        return {name: int(count) for name, count in zip(self.impact_types[1:], counts[1:])}
+
+    def to_dict(self) -> Dict:
+        """Materializes the log into the plain {timestep: {(source, target): impact type}} dict."""
+        return {key_name: self._step_dict(key_name) for key_name in self}
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for step in self._steps.values() for array in step)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({len(self)} timesteps, {sum(len(step[2]) for step in self._steps.values())} impacts)"
+
+def impact_type_counts(impacts: ImpactLog | Dict | List) -> Dict[str, int]:
+    """
+    Number of impacts of each type, over all timesteps of an impact log (or a dict in its format),
+        or of a list of them (e.g. the impacts of many simulations).
+    """
+    if isinstance(impacts, list):
+        total = {}
+        for log in impacts:
+            for name, count in impact_type_counts(log).items():
+                total[name] = total.get(name, 0) + count
+        return total
+    return ImpactLog.from_dict(impacts).type_counts()
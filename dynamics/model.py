@@ -1,12 +1,18 @@
+import numpy as np
 from higherorder.structures.structures import Grid, Graph, Structure
+from higherorder.structures.history import StateSlice
+from higherorder.utils.utils import get_nonzero_entities
 from .rules import general_rule
-from typing import Dict, Tuple, Any, Callable, Union
-from .impacts import general_impact
+from typing import Dict, Tuple, Any, Callable, Union, List, Generator
+from .impacts import general_impact, array_impact_table, array_impacts, ImpactLog
+from .engines import select_engine, LifeEngine
+from .sinks import SimulationStep, as_sink
 
 class Model:
     def __init__(self, structure: Grid | Graph,
                  dynamics_func: Callable,
                  time_step: int = None, base_name: str = None,
+                 engine: str = "auto",
                  #initial_state=None
                  ):
         """
@@ -17,8 +23,17 @@ class Model:
         - time_step: The previous (discrete) timestep, simulation starts from one value above it. Default is 0
         - base_name: The base name for the key in the structure. Default is None, which is automatically set to either
                 "t_" or structure.key_name[base_name].
+        - engine: "auto" (default) steps the states as arrays when an array engine exists for the rule and
+                the structure (e.g. game_of_life on a Grid), "compile" also compiles other binary local rules on
+                a Grid to a lookup table (when it gives the same states as the rule), "array" raises if there
+                is no array engine, "dict" always calls the rule function on dicts. See engines.select_engine.
+                The engines of rule functions given to step are selected (compiled) once and kept per rule.
+
+        The way states are stored over time (dict, array or sparse) is set on the structure (store_mode).
+            The array engines write each step as a row; the dict store still holds one value per entity
+            and timestep, so it bounds the speedup (about 25x for game_of_life on a 128x128 Grid, against
+            over 100x with store_mode="array" or "sparse").
 
-        #TODO store_mode='sparse',
         #TODO initial_state?
         """
         #if not isinstance(structure, Structure):
@@ -34,11 +49,16 @@ class Model:
         #self.entities = structure.get_entities()
         #self.connections
         self.dynamics_func = dynamics_func
+        self.engine = select_engine(structure, dynamics_func, engine)
+        self.engine_mode = engine
         self.base_name = base_name
         self.time_step = time_step
         self.initial_time_step = time_step
-        self.impact = {}
+        self.impact = ImpactLog(structure.get_entity_list(), base_name)
         self.has_ended = False #TODO keep resetting it to False
+        self.period = None
+        self.transient = None
+        self._frontier = None #(key name, rule function, entities changed in the step to key name)
 
     def _setup_key_name(self, time_step=None, base_name=None, raise_error=True):
         if isinstance(base_name, type(None)):
@@ -48,7 +68,7 @@ class Model:
             time_step = getattr(self.structure, 'last_iterations', {}).get(base_name, 0)
         
         key_name = base_name + str(time_step)
-        if not any([key_name in v for v in self.structure.entities.values()]):
+        if not self.structure.has_time_key(key_name):
             if raise_error:
                 raise ValueError(f"Key name {key_name} not found in some structure entities\
                              - possibly not initialized, or the simulation")
@@ -56,6 +76,43 @@ class Model:
                 return None, None, None
         return key_name, base_name, time_step
 
+    def _get_states(self, key_name: str):
+        """The states under key_name, as an array view when an engine steps them."""
+        if self.engine is not None:
+            return self.structure.array_to_states(self.structure.get_state_array(key_name))
+        return self.structure.get_time_slice(key_name, only_nonzero=False)
+
+    def _get_connections_LUT(self, store_impact: bool = False, impact_function: Callable = None):
+        """The connections lookup table, unless only the engine needs the connections."""
+        if self.engine is not None and (not store_impact or self._get_impact_table(impact_function) is not None):
+            return None
+        return self.structure.get_entities_connections_LUT()
+
+    def _get_engine(self, rule_function: Callable = None):
+        """The array engine of a rule function (selected, or compiled, once per rule), None for the dict path."""
+        if rule_function in (None, self.dynamics_func):
+            return self.engine
+        engines = self.__dict__.setdefault("_engines", {})
+        if rule_function not in engines:
+            engine_mode = getattr(self, "engine_mode", "auto")
+            engines[rule_function] = select_engine(self.structure, rule_function,
+                                                   "compile" if engine_mode == "array" else engine_mode)
+        return engines[rule_function]
+
+    def _get_impact_table(self, impact_function: Callable = None, engine = None):
+        """
+        The array impact code table of the impact function when the engine can compute impacts
+            in the same pass as the states (from the same neighbour counts), otherwise None.
+        """
+        if not isinstance(engine or self.engine, LifeEngine) or impact_function is None:
+            return None
+        impact_tables = self.__dict__.setdefault("_impact_tables", {})
+        if impact_function not in impact_tables:
+            degrees = self.structure.adjacency.degrees
+            impact_tables[impact_function] = array_impact_table(impact_function,
+                                                                int(degrees.max()) if len(degrees) else 0)
+        return impact_tables[impact_function]
+
     def step(self, rule_function: Callable = None,
              entity_states: Dict = None,
              connections_LUT: Dict = None,
@@ -71,11 +128,27 @@ class Model:
         key_name, base_name, time_step = self._setup_key_name(time_step, base_name, raise_error=False)
         if key_name is None:
             return None
+        engine = self._get_engine(rule_function)
+        use_engine = engine is not None
         rule_function = rule_function or self.dynamics_func
-        entity_states = entity_states or {k: v[key_name] for k, v in self.structure.entities.items()}
-        connections_LUT = connections_LUT or self.structure.get_entities_connections_LUT()
+        impact_table = self._get_impact_table(impact_function, engine) if use_engine and store_impact else None
+        if use_engine:
+            states_array = (self.structure.states_to_array(entity_states) if entity_states
+                            else self.structure.get_state_array(key_name))
+        if not use_engine or (store_impact and impact_table is None):
+            if isinstance(entity_states, StateSlice):
+                entity_states = entity_states.copy()
+            entity_states = entity_states or self.structure.get_time_slice(key_name, only_nonzero=False)
+            connections_LUT = connections_LUT or self.structure.get_entities_connections_LUT()
 
-        if store_impact:
+        counts = None
+        if impact_table is not None:
+            #Impacts and the next states from the same neighbour counts
+            counts = engine.neighbour_counts(states_array)
+            self.impact.sync_entities(self.structure.get_entity_list())
+            self.impact.append(key_name, *array_impacts(self.structure.adjacency, states_array, impact_table,
+                                                        counts=counts, active_only=active_only))
+        elif store_impact:
             impacts = general_impact(impact_function=impact_function,
                                      structure=self.structure,
                                      field_name = None,
@@ -83,36 +156,120 @@ class Model:
                                      connections_LUT=connections_LUT,
                                      active_only=active_only,
                                     )
-            #take dict, sorted by key
-            self.impact[key_name] = {k: v for k, v in sorted(impacts.items(), key=lambda item: item[0])}
+            self.impact[key_name] = impacts #read back sorted by key
             
-        states = general_rule(rule_function=rule_function,
-                        structure=self.structure,
-                        #field_name = None, #key_name,
-                        entities=entity_states,
-                        connections_LUT=connections_LUT,
-                        only_nonzero=only_nonzero,
-                        only_state_change=only_state_change,
-                     )
+        #Frontier: the entities that changed in the step to key_name, if it was taken with this rule
+        frontier = None
+        if only_state_change and self._frontier is not None and self._frontier[:2] == (key_name, rule_function):
+            frontier = self._frontier[2]
+        if use_engine and only_state_change:
+            changes = engine.frontier_step(states_array, frontier, counts)
+            states_array = states_array.copy()
+            states_array[changes[0]] = changes[1]
+            states = self.structure.array_to_states(states_array, only_nonzero=only_nonzero)
+        elif use_engine:
+            states = self.structure.array_to_states(engine.step(states_array, counts), only_nonzero=only_nonzero)
+        elif only_state_change:
+            changes = general_rule(rule_function=rule_function,
+                            structure=self.structure,
+                            entities=entity_states,
+                            connections_LUT=connections_LUT,
+                            only_state_change=True,
+                            frontier=frontier,
+                         )
+            states = {**entity_states, **changes}
+            if only_nonzero:
+                states = get_nonzero_entities(states)
+        else:
+            states = general_rule(rule_function=rule_function,
+                            structure=self.structure,
+                            #field_name = None, #key_name,
+                            entities=entity_states,
+                            connections_LUT=connections_LUT,
+                            only_nonzero=only_nonzero,
+                            only_state_change=only_state_change,
+                         )
         if not states:
             self.has_ended = True
         previous_key_name = key_name
         key_name = base_name + str(time_step + 1)
-        if only_state_change:
-            #TODO construct the correct states dict
-            raise NotImplementedError("only_state_change=True not implemented yet")
-            for entity, value in states.items():
-                self.structure.entities[entity][key_name] = self.structure.entities[entity][previous_key_name]
-        for entity, value in states.items():
-            if entity not in self.structure.entities:
-                #TODO: fix bug - some entities go "beyond" the grid (e.g. instead of going around)
-                self.structure.entities[entity] = {}
-            self.structure.entities[entity][key_name] = states[entity]
+        if only_state_change and (states or not only_nonzero):
+            #Only the changes are written, and they are the frontier of the next step
+            self.structure.set_time_slice_changes(changes, key_name, previous_key_name)
+            self._frontier = (key_name, rule_function, changes[0] if use_engine else list(changes))
+        else:
+            self.structure.set_time_slice(states, key_name)
         self.structure.last_iterations[base_name] = time_step + 1
         self.key_name = {"base_name": base_name, "index": time_step + 1}
         self.time_step = time_step + 1
         return states
 
+    def iter_simulation(self, steps: int = None,
+                        time_step = None,
+                        base_name = None,
+                        only_nonzero=False,
+                        only_state_change=False,
+                        store_impact=False,
+                        impact_function=None,
+                        active_only=True,
+                        store_history: bool = True,
+                        sinks: List = None,
+                        ) -> Generator[SimulationStep, None, None]:
+        """
+        Steps the simulation, yielding a SimulationStep (the states of all entities as an array, and the
+            impacts of the step if stored) after every step, and writing it to the sinks.
+
+        - steps: the number of steps, None to run until the states die out
+        - store_history: if False, only the last timestep is kept in the structure (and no impacts in
+            model.impact), so a run takes constant memory. The steps are still yielded and written to the sinks
+        - sinks: where every step goes (see sinks: RunFileSink, StatisticsSink, or a function of the step)
+
+        The other arguments are as in step. The sinks are closed when the iteration ends or is stopped.
+        """
+        key_name, base_name, time_step = self._setup_key_name(time_step, base_name)
+        states = self._get_states(key_name)
+        connections_LUT = self._get_connections_LUT(store_impact, impact_function)
+        sinks = [as_sink(sink) for sink in sinks or []]
+        self.last_simulation_step = time_step
+        for sink in sinks:
+            sink.open(self)
+        try:
+            i = 0
+            while steps is None or i < steps:
+                states = self.step(
+                            rule_function = self.dynamics_func,
+                            entity_states = states,
+                            connections_LUT = connections_LUT,
+                            only_nonzero = only_nonzero,
+                            only_state_change = only_state_change,
+                            base_name = base_name,
+                            time_step = time_step + i,
+                            store_impact = store_impact,
+                            impact_function = impact_function,
+                            active_only = active_only,
+                         )
+                if states is None:
+                    break
+                previous_key_name, key_name = base_name + str(time_step + i), base_name + str(time_step + i + 1)
+                impacts = self.impact.step_arrays(previous_key_name) if store_impact and previous_key_name in self.impact else None
+                array = states.array if isinstance(states, StateSlice) else self.structure.states_to_array(states)
+                step = SimulationStep(time_step + i + 1, key_name, array, impacts)
+                if not store_history:
+                    self.structure.discard_history(time_step + i + 1, base_name)
+                    if impacts is not None:
+                        del self.impact[previous_key_name]
+                self.last_simulation_step = time_step + i + 1
+                for sink in sinks:
+                    sink.write(step)
+                yield step
+                i += 1
+                if not states:
+                    self.has_ended = True #TODO keep resetting it to False
+                    break
+        finally:
+            for sink in sinks:
+                sink.close(self)
+
     def simulation(self, steps=10,
                    time_step = None,
                    base_name = None,
@@ -120,29 +277,17 @@ class Model:
                    only_state_change=False,
                    store_impact=False,
                    impact_function=None,
-                   active_only=True,):
-        key_name, base_name, time_step = self._setup_key_name(time_step, base_name)
-        states = {k: v[key_name] for k, v in self.structure.get_entities().items()}
-        connections_LUT = self.structure.get_entities_connections_LUT()
+                   active_only=True,
+                   store_history: bool = True,
+                   sinks: List = None,):
+        """
+        Steps the simulation `steps` times (or until the states die out), see iter_simulation.
+        """
         #self.initial_key_name = key_name #TODO rethink
         #self.initial_time_step = time_step
-        for i in range(0, steps):
-            states = self.step(
-                        rule_function = self.dynamics_func,
-                        entity_states = states,
-                        connections_LUT = connections_LUT,
-                        only_nonzero = only_nonzero,
-                        only_state_change = only_state_change,
-                        base_name = base_name,
-                        time_step = time_step + i,
-                        store_impact = store_impact,
-                        impact_function = impact_function,
-                        active_only = active_only,
-                     )
-            if not states:
-                self.has_ended = True #TODO keep resetting it to False
-                break
-        self.last_simulation_step = time_step + i + 1
+        for _ in self.iter_simulation(steps, time_step, base_name, only_nonzero, only_state_change,
+                                      store_impact, impact_function, active_only, store_history, sinks):
+            pass
         #return self.structure.entities, self.structure.last_iterations, self.key_name
 
     def simulate_till_periodicity(self, 
@@ -154,18 +299,61 @@ class Model:
                                  store_impact=False,
                                  impact_function=None,
                                  active_only=True,
+                                 cycle_detection: str = "dict",
+                                 store_history: bool = True,
                                  ):
+        """
+        Simulates until the topology of the states (see get_components_topology_key)
+            repeats, or for max_steps steps.
+
+        Sets self.period (steps between the repeated topologies) and self.transient (steps before
+            the first of them), or None if no repetition was found within max_steps.
+
+        only_state_change: frontier stepping, each step only evaluates the entities that changed in the
+            previous step and their neighbours (the rule must be local), and only the changes are written
+
+        cycle_detection:
+            - "dict" (default): every topology is kept in a dict by its hash, with the first timestep
+                it was seen, so the simulation stops at the first repetition
+            - "brent": Brent's algorithm, keeping one past topology only, for very long runs. The repetition
+                is detected up to a few periods later (so more steps are simulated), the transient is then
+                found by stepping two copies of the initial states a period apart (see _find_transient).
+                As equal topologies do not mean equal states (e.g. a glider before a collision), it can
+                find a later cycle than "dict"
+        store_history: if False, only the last timestep is kept in the structure (and no impacts in
+            model.impact), as in iter_simulation. With "brent", the run then takes constant memory
+        """
+        if cycle_detection not in ("dict", "brent"):
+            raise ValueError(f"cycle_detection must be 'dict' or 'brent', not {cycle_detection}")
         key_name, base_name, time_step = self._setup_key_name(time_step, base_name)
-        states = {k: v[key_name] for k, v in self.structure.get_entities().items()}
-        connections_LUT = self.structure.get_entities_connections_LUT()
+        states = self._get_states(key_name)
+        connections_LUT = self._get_connections_LUT(store_impact, impact_function)
+        self.period = None
+        self.transient = None
+        initial_states = self.structure.get_state_array(key_name).copy() if cycle_detection == "brent" else None
 
-        states_topology = self.structure.get_components_topology_representation(entities=states,
-                                                                                only_nonzero = only_nonzero,
-                                                                                )
-        states_topologies = []
+        states_topology = self._topology_key(states, only_nonzero)
+        states_topologies = {} #topology: first timestep
+        power = period = 1 #Brent's algorithm
         steps = 0
-        while (states_topology not in states_topologies) and (steps < max_steps):
-            states_topologies.append(states_topology)
+        while steps < max_steps:
+            if cycle_detection == "dict":
+                if states_topology in states_topologies:
+                    self.transient = states_topologies[states_topology] - time_step
+                    self.period = time_step + steps - states_topologies[states_topology]
+                    break
+                states_topologies[states_topology] = time_step + steps
+            elif steps == 0:
+                tortoise = states_topology
+            elif states_topology == tortoise:
+                self.period = period
+                break
+            else:
+                if power == period:
+                    tortoise = states_topology
+                    power *= 2
+                    period = 0
+                period += 1
             states = self.step(
                         rule_function = self.dynamics_func,
                         entity_states = states,
@@ -178,39 +366,92 @@ class Model:
                         impact_function = impact_function,
                         active_only = active_only,
                      )
-            states_topology = self.structure.get_components_topology_representation(entities=states,
-                                                                                    only_nonzero = only_nonzero,
-                                                                                    )
+            if not store_history and states is not None:
+                self.structure.discard_history(time_step + steps + 1, base_name)
+                if store_impact and base_name + str(time_step + steps) in self.impact:
+                    del self.impact[base_name + str(time_step + steps)]
+            states_topology = self._topology_key(states, only_nonzero)
             steps += 1
+        else:
+            if cycle_detection == "dict" and states_topology in states_topologies:
+                self.transient = states_topologies[states_topology] - time_step
+                self.period = time_step + steps - states_topologies[states_topology]
+            elif cycle_detection == "brent" and steps and states_topology == tortoise:
+                self.period = period
+        if cycle_detection == "brent" and self.period is not None:
+            self.transient = self._find_transient(initial_states, self.period, only_nonzero)
         self.last_simulation_step = time_step + steps
         #return states_topologies, steps, states
 
+    def _topology_key(self, states: Dict, only_nonzero: bool = True, connections_LUT: Dict = None) -> bytes:
+        """
+        Hashable key of the topology of the states (see get_components_topology_key).
+            No states (died out, or after the last stored timestep) have no components.
+        """
+        if not states:
+            return b""
+        return self.structure.get_components_topology_key(entities=states,
+                                                          only_nonzero=only_nonzero,
+                                                          connections_LUT=connections_LUT)
+
+    def _find_transient(self, initial_states: np.ndarray, period: int,
+                        only_nonzero: bool = True, connections_LUT: Dict = None) -> int:
+        """
+        Number of steps from the initial states before the topology first repeats with the given period
+            (the second phase of Brent's algorithm): two copies of the initial states (an array in entity
+            index order), period steps apart, are stepped together until their topologies are equal,
+            without reading or storing timesteps. States that died out stay without components.
+        """
+        def advance(states: np.ndarray) -> np.ndarray:
+            if not states.any():
+                return states
+            if self.engine is not None:
+                return self.engine.step(states)
+            return self.structure.states_to_array(general_rule(rule_function=self.dynamics_func, structure=self.structure,
+                                                               entities=dict(self.structure.array_to_states(states)),
+                                                               connections_LUT=connections_LUT))
+
+        def topology(states: np.ndarray) -> bytes:
+            return self._topology_key(self.structure.array_to_states(states, only_nonzero=only_nonzero),
+                                      only_nonzero, connections_LUT)
+
+        tortoise = hare = initial_states
+        for _ in range(period):
+            hare = advance(hare)
+        transient = 0
+        while topology(tortoise) != topology(hare):
+            tortoise, hare = advance(tortoise), advance(hare)
+            transient += 1
+        return transient
+
     def get_impact(self, impacts:Dict = None,
                    timestep_name:str = None,
-                   impact_type:str = None,
+                   impact_type:str | list = None,
                    redundancy = False):
-        #TODO make impact_type a list
+        """
+        The stored impacts (an ImpactLog), filtered by type: impact_type can be a type, a list of types
+            or "active", redundancy keeps the redundancy types. With timestep_name, the
+            {(source, target): impact type} dict of that timestep.
+        """
         if impacts is None:
             impacts = getattr(self, 'impact', None)
         if not impacts:
             print("No impacts stored")
             return None
-        
-        if redundancy:
-            impacts = {t: {k: w for k, w in v.items() if "redundancy" in w}
-                       for t, v in impacts.items()}
-
-        if impact_type is not None:
-            if impact_type == 'active':
-                active_types = ["kill", "redundancy_kill", "birth", "no_birth", "redundancy_live"]
-                impacts = {t: {k: w for k, w in v.items() if w in active_types}
-                           for t, v in impacts.items()}
-            else:
-                impacts = {t: {k: w for k, w in v.items() if w == impact_type}
-                           for t, v in impacts.items()}
+        impacts = ImpactLog.from_dict(impacts, base_name=self.base_name)
+
+        if redundancy or impact_type is not None:
+            impacts = impacts.filter(impact_type=impact_type, redundancy=redundancy)
 
         if timestep_name is not None:
-            impacts = impacts[timestep_name]
+            impacts = impacts[timestep_name].copy()
         #TODO if impact_type is a string, then just return the list of such impacts
 
-        return impacts
\ No newline at end of file
+        return impacts
+
+    def get_impact_counts(self, per_step: bool = False):
+        """
+        Number of stored impacts of each type: a {type: count} dict over all timesteps, or with per_step
+            a (timesteps x impact types) array (columns following self.impact.impact_types).
+        """
+        return self.impact.counts_per_step() if per_step else self.impact.type_counts()
@@ -1,6 +1,22 @@
-from typing import Dict, Callable#, Any, List, Tuple
+from typing import Dict, Callable, Iterable#, Any, List, Tuple
 from higherorder.structures.structures import Structure, Grid, Graph
 from higherorder.utils.utils import get_nonzero_entities
+
+class _RegionStates(dict):
+    """
+    The states of a region of the entities (see general_rule frontier), other entities are read
+        from all the states (0 if missing), so rules can read the states of any entity.
+    """
+    def __init__(self, all_states: Dict, region_states: Dict):
+        super().__init__(region_states)
+        self.all_states = all_states
+
+    def __missing__(self, key):
+        return self.all_states.get(key, 0)
+
+    def copy(self):
+        return _RegionStates(self.all_states, self)
+
 ##rule (dynamics logic) functions
 
 def general_rule(rule_function:Callable,
@@ -10,7 +26,16 @@ def general_rule(rule_function:Callable,
                  connections_LUT: Dict = {},
                  only_nonzero=False,
                  only_state_change=False,
+                 frontier: Iterable = None,
                  **kwargs):
+    """
+    frontier: the entities that changed in the previous step. With a local rule (the next state of an
+        entity only depends on its own and its neighbours' states), other entities keep their states,
+        so the rule is only evaluated on the frontier and its neighbours, and only the changes are
+        returned (as with only_state_change). Missing entities are 0. The rule gets the states of the
+        region, and reads the states of other entities from entities; if it still raises a KeyError,
+        it is evaluated on all entities.
+    """
     if not entities:
         entities = structure.get_entities()
     if not connections_LUT:
@@ -18,8 +43,27 @@ def general_rule(rule_function:Callable,
 
     if field_name:
         entities = {k: v[field_name] for k, v in entities.items() if field_name in v}
+    if frontier is not None:
+        if not frontier:
+            return {}
+        candidates = set(frontier)
+        for entity in frontier:
+            candidates.update(connections_LUT[entity])
+        region = set(candidates)
+        for entity in candidates:
+            region.update(connections_LUT[entity])
+        region_entities = _RegionStates(entities, {entity: entities.get(entity, 0) for entity in region})
+        try:
+            states = rule_function(entities = region_entities, connections_LUT = connections_LUT,
+                                   structure = structure, **kwargs)
+            return {k: states[k] for k in candidates if region_entities[k] != states[k]}
+        except KeyError:
+            #The rule reads the states in a way the region cannot serve, evaluated on all entities
+            changes = general_rule(rule_function, structure, None, dict(entities), connections_LUT,
+                                   only_state_change=True, **kwargs)
+            return {k: v for k, v in changes.items() if k in candidates}
     if structure:
-        for entity in structure.get_entities():
+        for entity in structure.get_entity_list():
             if entity not in entities:
                 entities[entity] = 0
     elif connections_LUT:
@@ -68,6 +112,74 @@ def game_of_life(entities: Dict = None,
                 new_states[entity] = 0
     return new_states
 
+class LifeLikeRule:
+    """
+    Outer totalistic rule on binary states, given by the live neighbour counts for which a dead entity
+        is born and a live entity survives, in B/S notation: "B3/S23" (Game of Life), "B36/S23" (HighLife),
+        "B2/S" (Seeds), ... Values > 0 count as live, as in game_of_life.
+
+    Calling it runs the rule over dicts, like the other rule functions. As the dynamics_func of a Model,
+        it is stepped by an array engine instead (stencil on a Grid, sparse adjacency product on a Graph,
+        see engines.select_engine).
+    """
+    def __init__(self, rule: str = "B3/S23",
+                 birth = None, survival = None):
+        if birth is None and survival is None:
+            birth, survival = self.parse_rule(rule)
+        self.birth = frozenset(int(count) for count in (birth or ()))
+        self.survival = frozenset(int(count) for count in (survival or ()))
+        self.__name__ = self.rule_string
+
+    @staticmethod
+    def parse_rule(rule: str):
+        """
+        Parses "B3/S23" (or "b3s23", "S23/B3") into the birth and survival neighbour counts.
+        """
+        rule = rule.upper().replace(" ", "")
+        birth = survival = None
+        for part in rule.replace("/", " ").replace("S", " S").split():
+            if part[0] == "B" and part[1:].isdigit() or part == "B":
+                birth = {int(c) for c in part[1:]}
+            elif part[0] == "S" and part[1:].isdigit() or part == "S":
+                survival = {int(c) for c in part[1:]}
+            else:
+                raise ValueError(f"Rule {rule} is not in B/S notation, e.g. B3/S23")
+        if birth is None or survival is None:
+            raise ValueError(f"Rule {rule} is not in B/S notation, e.g. B3/S23")
+        return birth, survival
+
+    @property
+    def rule_string(self) -> str:
+        return "B" + "".join(map(str, sorted(self.birth))) + "/S" + "".join(map(str, sorted(self.survival)))
+
+    def __call__(self, entities: Dict = None,
+                 connections_LUT: Dict = None,
+                 structure: Structure = None,
+                 **kwargs):
+        if not entities:
+            entities = structure.get_entities()
+        if not connections_LUT:
+            connections_LUT = structure.get_entities_connections_LUT()
+
+        new_states = {}
+        entities = {k: 0 if v <= 0 else 1 for k, v in entities.items()}
+        for entity in entities.keys():
+            live_neighbors = sum(entities[neighbor] for neighbor in connections_LUT[entity] if neighbor in entities)
+            if entities[entity] == 1:
+                new_states[entity] = 1 if live_neighbors in self.survival else 0
+            else:
+                new_states[entity] = 1 if live_neighbors in self.birth else 0
+        return new_states
+
+    def __eq__(self, other):
+        return isinstance(other, LifeLikeRule) and (self.birth, self.survival) == (other.birth, other.survival)
+
+    def __hash__(self):
+        return hash((self.birth, self.survival))
+
+    def __repr__(self):
+        return f"LifeLikeRule('{self.rule_string}')"
+
 def operations_in_sequence(sequence: list,
                            entities: Dict = None,
                            connections_LUT: Dict = None,
@@ -0,0 +1,170 @@
+import os
+import sys
+import numpy as np
+from typing import Dict, List, Callable, Iterator
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from higherorder.structures.structures import Structure, Grid
+from .model import Model
+##runner: Model.simulate_till_periodicity over many structures, in worker processes
+
+class RunResult:
+    """
+    Compact outcome of one simulation: the states over time as an array instead of the structure.
+
+    - index: position of the structure in the input list
+    - has_ended, last_simulation_step: as on the Model
+    - states: (timesteps x entities) array of the stored timesteps, starting at initial_time_step,
+        entities in the order of entity_list
+    - impact: the impacts of the Model (if an impact function was given)
+    """
+    def __init__(self, index: int, has_ended: bool, last_simulation_step: int,
+                 entity_list: List, states: np.ndarray, initial_time_step: int = 0,
+                 base_name: str = "t_", impact: Dict = None):
+        self.index = index
+        self.has_ended = has_ended
+        self.last_simulation_step = last_simulation_step
+        self.entity_list = entity_list
+        self.states = states
+        self.initial_time_step = initial_time_step
+        self.base_name = base_name
+        self.impact = impact
+
+    @property
+    def max_time(self) -> int:
+        return self.initial_time_step + len(self.states) - 1
+
+    def get_entities_states(self) -> Dict:
+        """
+        The states in the format of Structure.get_entities_states (only nonzero values).
+        """
+        time_slices = {}
+        timesteps, indices = np.nonzero(self.states)
+        for t, i in zip(timesteps.tolist(), indices.tolist()):
+            entity = self.entity_list[i]
+            if entity not in time_slices:
+                time_slices[entity] = {}
+            time_slices[entity][self.base_name + str(self.initial_time_step + t)] = self.states[t, i].item()
+        return time_slices
+
+def structure_states_array(structure: Structure, base_name: str = "t_", start_timestamp: int = 0) -> np.ndarray:
+    """
+    The stored states of a structure as a (timesteps x entities) array, from start_timestamp
+        to the last stored timestep (missing values are 0).
+    """
+    history = getattr(structure, "history", None)
+    if history is not None and base_name == history.base_name:
+        return np.array(history.get_rows(max(start_timestamp, history.initial_time_step), None))
+    entity_index = structure.get_entity_index()
+    values = [(int(key[len(base_name):]) - start_timestamp, entity_index[entity], value)
+              for entity, states in structure.get_entities_states(base_name, start_timestamp).items()
+              for key, value in states.items()]
+    if not values:
+        return np.zeros((0, len(entity_index)), dtype=np.uint8)
+    timesteps, indices, values = (np.array(column) for column in zip(*values))
+    array = np.zeros((timesteps.max() + 1, len(entity_index)), dtype=values.dtype)
+    array[timesteps, indices] = values
+    return array
+
+def _run_simulation(index: int, structure: Structure | Dict, dynamics_func: Callable,
+                    impact_function: Callable = None, structure_kwargs: Dict = None,
+                    simulation_kwargs: Dict = None) -> RunResult:
+    if not isinstance(structure, Structure):
+        structure = Grid(structure, **(structure_kwargs or {}))
+    simulation_kwargs = dict(simulation_kwargs or {})
+    if impact_function is not None:
+        simulation_kwargs.update(store_impact=True, impact_function=impact_function)
+    model = Model(structure, dynamics_func=dynamics_func)
+    model.simulate_till_periodicity(**simulation_kwargs)
+    return RunResult(index, model.has_ended, model.last_simulation_step,
+                     entity_list=structure.get_entity_list(),
+                     states=structure_states_array(structure, model.base_name, model.initial_time_step),
+                     initial_time_step=model.initial_time_step, base_name=model.base_name,
+                     impact=model.impact if impact_function is not None else None)
+
+def _run_chunk(chunk: List, dynamics_func: Callable, impact_function: Callable = None,
+               structure_kwargs: Dict = None, simulation_kwargs: Dict = None) -> List[RunResult]:
+    return [_run_simulation(index, structure, dynamics_func, impact_function, structure_kwargs, simulation_kwargs)
+            for index, structure in chunk]
+
+def _report_progress(progress: bool | Callable, done: int, total: int):
+    if callable(progress):
+        progress(done, total)
+    elif progress:
+        print(f"\r{done}/{total} simulations", end="\n" if done == total else "", file=sys.stderr)
+
+def iter_simulations(structures: List[Structure | Dict],
+                     dynamics_func: Callable,
+                     impact_function: Callable = None,
+                     structure_kwargs: Dict = None,
+                     simulation_kwargs: Dict = None,
+                     max_workers: int = None,
+                     chunksize: int = 1,
+                     max_in_flight: int = None,
+                     progress: bool | Callable = False,
+                     ) -> Iterator[RunResult]:
+    """
+    Runs Model.simulate_till_periodicity on every structure in worker processes, yielding
+        a RunResult per structure in input order.
+
+    Args:
+        structures: Structure objects, or initial states (dicts of (x, y): value, e.g. from
+            load_init_grid_dicts) that are made into Grids with structure_kwargs (width, height, store_mode, ...)
+        dynamics_func, impact_function: the rule and impact functions (module level functions or
+            picklable objects such as rules.LifeLikeRule); with an impact function impacts are stored
+        simulation_kwargs: further arguments of simulate_till_periodicity (e.g. max_steps)
+        max_workers: number of processes (default: os.cpu_count()), 0 runs in this process
+        chunksize: number of structures sent to a process at once
+        max_in_flight: maximum number of chunks submitted or waiting to be yielded
+            (default: 2 * max_workers), which bounds the memory of the results held at once
+        progress: True prints the number of finished simulations, or a callable(done, total)
+
+    The structures are copied to the workers and left unchanged.
+    """
+    total = len(structures)
+    if chunksize < 1:
+        raise ValueError(f"chunksize must be at least 1, not {chunksize}")
+    items = list(enumerate(structures))
+    chunks = [items[start:start + chunksize] for start in range(0, total, chunksize)]
+    arguments = (dynamics_func, impact_function, structure_kwargs, simulation_kwargs)
+    done = 0
+    if max_workers == 0:
+        for chunk in chunks:
+            results = _run_chunk([(index, structure.copy() if isinstance(structure, Structure) else structure)
+                                  for index, structure in chunk], *arguments)
+            done += len(results)
+            _report_progress(progress, done, total)
+            yield from results
+        return
+
+    if max_in_flight is None:
+        max_in_flight = 2 * (max_workers or os.cpu_count() or 1)
+    max_in_flight = max(1, max_in_flight)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+        finished = {}
+        next_chunk = 0
+        next_result = 0
+        while next_result < len(chunks):
+            #Submit while the submitted and unyielded chunks stay under the cap
+            while next_chunk < len(chunks) and len(pending) + len(finished) < max_in_flight:
+                pending[executor.submit(_run_chunk, chunks[next_chunk], *arguments)] = next_chunk
+                next_chunk += 1
+            completed, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in completed:
+                results = future.result()
+                finished[pending.pop(future)] = results
+                done += len(results)
+                _report_progress(progress, done, total)
+            while next_result in finished:
+                yield from finished.pop(next_result)
+                next_result += 1
+
+def run_simulations(structures: List[Structure | Dict],
+                    dynamics_func: Callable,
+                    impact_function: Callable = None,
+                    **kwargs) -> List[RunResult]:
+    """
+    Runs Model.simulate_till_periodicity on every structure in worker processes,
+        returning a list of RunResults in input order. See iter_simulations for the arguments.
+    """
+    return list(iter_simulations(structures, dynamics_func, impact_function, **kwargs))
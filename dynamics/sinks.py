@@ -0,0 +1,136 @@
+import numpy as np
+from typing import Dict, Callable, NamedTuple, Tuple
+##sinks: where the steps of Model.iter_simulation go (files, online statistics, callbacks)
+
+class SimulationStep(NamedTuple):
+    """
+    One step of Model.iter_simulation:
+
+    - time_step, key_name: the timestep reached by the step
+    - states: the states of all entities at time_step, 1D array in entity index order
+    - impacts: the impacts of the step (from time_step - 1) as (source ids, target ids, codes) arrays
+        (codes of model.impact.impact_types), None if impacts are not stored
+    """
+    time_step: int
+    key_name: str
+    states: np.ndarray
+    impacts: Tuple[np.ndarray, np.ndarray, np.ndarray] | None = None
+
+class Sink:
+    """
+    Receives the steps of Model.iter_simulation: open before the first step (the model is at its initial
+        timestep), write for every step, close after the last one (also when the iteration is stopped early).
+    """
+    def open(self, model):
+        pass
+
+    def write(self, step: SimulationStep):
+        raise NotImplementedError
+
+    def close(self, model):
+        pass
+
+class CallbackSink(Sink):
+    """Calls function(step) for every step; plain functions given as sinks are wrapped in it."""
+    def __init__(self, function: Callable):
+        self.function = function
+
+    def write(self, step: SimulationStep):
+        self.function(step)
+
+class RunFileSink(Sink):
+    """
+    Writes the run to a run file (utils.storage): the initial states, then the states and impacts of every
+        step, with the outcome of the model as metadata.
+
+    writer: a RunWriter (several sinks can share one, one run each) or a path (the file is closed with the sink).
+    """
+    def __init__(self, writer, seed: int = None, metadata: Dict = None, **writer_kwargs):
+        from higherorder.utils.storage import RunWriter #Lazy import, utils imports dynamics lazily too
+        self.owns_writer = not isinstance(writer, RunWriter)
+        self.writer = RunWriter(writer, **writer_kwargs) if self.owns_writer else writer
+        self.seed = seed
+        self.metadata = metadata
+        self.run = None
+
+    def open(self, model):
+        self.run = self.writer.begin_run(model.structure, rule=model.dynamics_func, seed=self.seed,
+                                         initial_time_step=model.time_step, base_name=model.base_name,
+                                         impact_types=model.impact.impact_types, metadata=self.metadata)
+        self.writer.append_states(self.run, model.structure.get_state_array(model.base_name + str(model.time_step)))
+
+    def write(self, step: SimulationStep):
+        self.writer.append_states(self.run, step.states)
+        if step.impacts is not None:
+            self.writer.append_impacts(self.run, step.time_step - 1, *step.impacts)
+
+    def close(self, model):
+        self.writer.runs[self.run]["impacts"]["types"] = list(model.impact.impact_types)
+        self.writer.end_run(self.run, {name: getattr(model, name, None) for name in
+                                       ("has_ended", "last_simulation_step", "period", "transient")})
+        if self.owns_writer:
+            self.writer.close()
+
+class StatisticsSink(Sink):
+    """
+    Online statistics of a run in constant memory:
+
+    - steps: the number of steps written
+    - live_mean, live_var: mean and variance of the number of live (nonzero) entities over the steps (Welford)
+    - activity: per entity, the fraction of steps it was live
+    - changes: per entity, the number of steps its state changed
+    - impact_counts: the number of impacts of every code over the steps (see model.impact.impact_types)
+    - live_counts: the number of live entities at every step, only if keep_series
+    """
+    def __init__(self, keep_series: bool = False):
+        self.keep_series = keep_series
+        self.steps = 0
+        self.live_mean = 0.0
+        self._live_m2 = 0.0
+        self.activity = None
+        self.changes = None
+        self.impact_counts = np.zeros(0, dtype=np.int64)
+        self.live_counts = [] if keep_series else None
+        self._previous = None
+
+    def open(self, model):
+        self._previous = model.structure.get_state_array(model.base_name + str(model.time_step))
+        self.activity = np.zeros(len(self._previous), dtype=np.float64)
+        self.changes = np.zeros(len(self._previous), dtype=np.int64)
+
+    def write(self, step: SimulationStep):
+        live = step.states != 0
+        count = int(np.count_nonzero(live))
+        self.steps += 1
+        delta = count - self.live_mean
+        self.live_mean += delta / self.steps
+        self._live_m2 += delta * (count - self.live_mean)
+        if len(live) > len(self.activity): #entities added during the run
+            self.activity = np.concatenate([self.activity, np.zeros(len(live) - len(self.activity))])
+            self.changes = np.concatenate([self.changes, np.zeros(len(live) - len(self.changes), dtype=np.int64)])
+            self._previous = np.concatenate([self._previous, np.zeros(len(live) - len(self._previous), dtype=self._previous.dtype)])
+        self.activity[:len(live)] += (live - self.activity[:len(live)]) / self.steps
+        self.changes[:len(live)] += step.states != self._previous
+        self._previous = step.states
+        if step.impacts is not None and len(step.impacts[2]):
+            counts = np.bincount(step.impacts[2])
+            if len(counts) > len(self.impact_counts):
+                self.impact_counts = np.concatenate([self.impact_counts, np.zeros(len(counts) - len(self.impact_counts), dtype=np.int64)])
+            self.impact_counts[:len(counts)] += counts
+        if self.keep_series:
+            self.live_counts.append(count)
+
+    @property
+    def live_var(self) -> float:
+        return self._live_m2 / self.steps if self.steps else 0.0
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.steps} steps, live mean {self.live_mean:.3g})"
+
+def as_sink(sink) -> Sink:
+    """A Sink from a sink or a function of the step."""
+    if isinstance(sink, Sink):
+        return sink
+    if callable(sink):
+        return CallbackSink(sink)
+    raise ValueError(f"A sink must be a Sink or a function of the step, not {type(sink)}")
@@ -1,7 +1,9 @@
 from .structures import Structure, Grid, Graph
+from .adjacency import AdjacencyIndex
 
 __all__ = [
     "Structure",
     "Grid",
     "Graph",
+    "AdjacencyIndex",
 ]
\ No newline at end of file
@@ -0,0 +1,94 @@
+import numpy as np
+from typing import List, Tuple, Dict, Any
+
+class AdjacencyIndex:
+    """
+    Compressed sparse row (CSR) index of the connections of a structure, over integer entity ids
+        (the entity index of the structure, see Structure.get_entity_list).
+
+    - indptr, indices: the neighbours of entity i are indices[indptr[i]:indptr[i+1]]
+        (undirected, without duplicates, sorted by id)
+    - edge_indptr, edge_ids: the connections of entity i are edge_ids[edge_indptr[i]:edge_indptr[i+1]],
+        as positions in the connections list (in connection order, duplicates kept)
+
+    Built once per structure (Structure.adjacency), so neighbour queries cost O(degree)
+        instead of a scan of all connections.
+    """
+    def __init__(self, entity_list: List, connections: List[Tuple[Any, Any]],
+                 entity_index: Dict = None):
+        if entity_index is None:
+            entity_index = {entity: i for i, entity in enumerate(entity_list)}
+        self.entity_list = list(entity_list)
+        self.entity_index = entity_index
+        self.num_entities = len(self.entity_list)
+        n = self.num_entities
+
+        try:
+            sources = np.fromiter((entity_index[a] for a, _ in connections), dtype=np.int64, count=len(connections))
+            targets = np.fromiter((entity_index[b] for _, b in connections), dtype=np.int64, count=len(connections))
+        except KeyError as e:
+            raise ValueError(f"Connection endpoint {e.args[0]} is not an entity of the structure.") from None
+        edges = np.arange(len(connections), dtype=np.int64)
+
+        #Incidence: every connection is listed at both of its ends (once for self-loops)
+        not_loop = sources != targets
+        ends = np.concatenate([sources, targets[not_loop]])
+        end_edges = np.concatenate([edges, edges[not_loop]])
+        order = np.lexsort((end_edges, ends))
+        self.edge_ids = end_edges[order]
+        self.edge_indptr = np.concatenate([[0], np.cumsum(np.bincount(ends, minlength=n))])
+
+        #Neighbours: symmetric, duplicates removed
+        codes = np.unique(np.concatenate([sources * n + targets, targets * n + sources]))
+        rows = codes // n if n else codes
+        self.indices = (codes % n if n else codes).astype(np.int64)
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=n))]).astype(np.int64)
+
+    @classmethod
+    def from_structure(cls, structure) -> "AdjacencyIndex":
+        return cls(structure.get_entity_list(), structure.connections, structure.get_entity_index())
+
+    @property
+    def degrees(self) -> np.ndarray:
+        return np.diff(self.indptr)
+
+    @property
+    def row_ids(self) -> np.ndarray:
+        """The entity id each entry of `indices` belongs to (the row of the CSR entry)."""
+        row_ids = getattr(self, "_row_ids", None)
+        if row_ids is None:
+            row_ids = np.repeat(np.arange(self.num_entities), self.degrees)
+            self._row_ids = row_ids
+        return row_ids
+
+    def neighbours(self, i: int) -> np.ndarray:
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def connection_ids(self, i: int) -> np.ndarray:
+        return self.edge_ids[self.edge_indptr[i]:self.edge_indptr[i + 1]]
+
+    def neighbour_sum(self, values: np.ndarray) -> np.ndarray:
+        """
+        Sum of `values` over the neighbours of every entity (adjacency matrix - vector product).
+        """
+        return np.bincount(self.row_ids, weights=values[self.indices], minlength=self.num_entities)
+
+    def neighbours_of(self, ids: np.ndarray):
+        """
+        The neighbours of the entities `ids` as flat arrays (neighbour ids, position in `ids` of the entity),
+            in O(sum of their degrees).
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        starts = self.indptr[ids]
+        lengths = self.indptr[ids + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return self.indices[offsets + np.arange(int(lengths.sum()))], np.repeat(np.arange(len(ids)), lengths)
+
+    def to_lookup_table(self, entity_list: List = None) -> Dict:
+        """
+        The {entity: [neighbour entities]} lookup table of the index.
+        """
+        entity_list = self.entity_list if entity_list is None else entity_list
+        neighbours = [entity_list[j] for j in self.indices.tolist()]
+        indptr = self.indptr.tolist()
+        return {entity: neighbours[indptr[i]:indptr[i + 1]] for i, entity in enumerate(entity_list)}
@@ -0,0 +1,154 @@
+import numpy as np
+from typing import Tuple
+from .adjacency import AdjacencyIndex
+##components: connected components of the live entities as label arrays, instead of Tarjan on dicts (utils.blobs)
+
+def grid_forward_offsets(diagonal_neighbours: bool = True) -> list:
+    """
+    Half of the neighbour offsets of a cell (one of each opposite pair), enough to list every
+        neighbouring pair of cells once.
+    """
+    offsets = [(1, 0), (0, 1)]
+    if diagonal_neighbours:
+        offsets += [(1, 1), (1, -1)]
+    return offsets
+
+def grid_neighbours_of(ids: np.ndarray, width: int, height: int,
+                       periodic_boundary: bool = True, diagonal_neighbours: bool = True):
+    """
+    The neighbours of the cells `ids` (entity indices of a grid, x * height + y) from their coordinates,
+        as flat arrays (neighbour ids, position in `ids` of the cell), as AdjacencyIndex.neighbours_of.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    xs, ys = np.divmod(ids, height)
+    positions = np.arange(len(ids))
+    neighbours, owners = [], []
+    for dx, dy in grid_forward_offsets(diagonal_neighbours):
+        for nx, ny in ((xs + dx, ys + dy), (xs - dx, ys - dy)):
+            if periodic_boundary:
+                neighbours.append((nx % width) * height + ny % height)
+                owners.append(positions)
+            else:
+                inside = (nx >= 0) & (nx < width) & (ny >= 0) & (ny < height)
+                neighbours.append(nx[inside] * height + ny[inside])
+                owners.append(positions[inside])
+    return np.concatenate(neighbours), np.concatenate(owners)
+
+def _find_roots(parent: np.ndarray) -> np.ndarray:
+    """Pointer jumping until every node points to its root."""
+    while True:
+        grandparent = parent[parent]
+        if np.array_equal(grandparent, parent):
+            return parent
+        parent = grandparent
+
+def union_find(num_nodes: int, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """
+    The root of every node for the undirected edges (sources, targets): the smallest node of its component.
+
+    Vectorized union-find: in every round the larger root of the ends of each edge is hooked under the smaller,
+        then the paths are compressed by pointer jumping, and only the edges between different roots are kept.
+    """
+    parent = np.arange(num_nodes)
+    sources, targets = np.asarray(sources, dtype=np.int64), np.asarray(targets, dtype=np.int64)
+    while len(sources):
+        parent = _find_roots(parent)
+        a, b = parent[sources], parent[targets]
+        different = a != b
+        if not different.any():
+            break
+        a, b = a[different], b[different]
+        sources, targets = sources[different], targets[different]
+        np.minimum.at(parent, np.maximum(a, b), np.minimum(a, b))
+    return _find_roots(parent)
+
+def _grid_edges(ids: np.ndarray, alive: np.ndarray, periodic_boundary: bool, diagonal_neighbours: bool):
+    """The pairs of neighbouring live cells of (..., width, height) arrays, as flat cell ids."""
+    width, height = alive.shape[-2:]
+    sources, targets = [], []
+    for dx, dy in grid_forward_offsets(diagonal_neighbours):
+        if periodic_boundary:
+            source_ids, source_alive = ids, alive
+            target_ids = np.roll(ids, (-dx, -dy), axis=(-2, -1))
+            target_alive = np.roll(alive, (-dx, -dy), axis=(-2, -1))
+        else:
+            source = (..., slice(max(0, -dx), width - max(0, dx)), slice(max(0, -dy), height - max(0, dy)))
+            target = (..., slice(max(0, dx), width - max(0, -dx)), slice(max(0, dy), height - max(0, -dy)))
+            source_ids, source_alive = ids[source], alive[source]
+            target_ids, target_alive = ids[target], alive[target]
+        both = source_alive & target_alive
+        sources.append(source_ids[both])
+        targets.append(target_ids[both])
+    return np.concatenate(sources), np.concatenate(targets)
+
+def label_grid(states: np.ndarray,
+               periodic_boundary: bool = True,
+               diagonal_neighbours: bool = True) -> Tuple[np.ndarray, np.ndarray | int]:
+    """
+    Connected components of the live (nonzero) cells of a (..., width, height) array (the layout of
+        Grid.get_state_array reshaped, or of utils.dict_to_array). Leading dimensions are independent grids,
+        so a whole (timesteps, width, height) history is labeled in one call.
+
+    Components connect across the periodic boundary, with Moore (diagonal_neighbours) or von Neumann neighbours.
+
+    Returns the labels (same shape: 0 for dead cells, 1 to n for the components of each grid, numbered in the
+        order of their first cell in entity order) and the number of components (per grid for leading dimensions).
+    """
+    alive = np.asarray(states) != 0
+    frames = alive.shape[:-2]
+    cells_per_frame = alive.shape[-2] * alive.shape[-1]
+    alive_ids = np.flatnonzero(alive)
+    #Union-find over the live cells only
+    index = np.full(alive.size, -1, dtype=np.int64)
+    index[alive_ids] = np.arange(len(alive_ids))
+    sources, targets = _grid_edges(index.reshape(alive.shape), alive, periodic_boundary, diagonal_neighbours)
+    roots = union_find(len(alive_ids), sources, targets)
+
+    #Roots are the first cells of the components, so the unique roots are in order of first cell
+    component_roots, component = np.unique(roots, return_inverse=True)
+    component_frames = alive_ids[component_roots] // cells_per_frame if cells_per_frame else component_roots
+    num_frames = int(np.prod(frames)) if frames else 1
+    counts = np.bincount(component_frames, minlength=num_frames)
+    first = np.cumsum(counts) - counts
+    labels = np.zeros(alive.size, dtype=np.int64)
+    labels[alive_ids] = component - first[component_frames[component]] + 1
+    return labels.reshape(alive.shape), (counts.reshape(frames) if frames else int(counts[0]))
+
+def label_graph(adjacency: AdjacencyIndex, states: np.ndarray) -> Tuple[np.ndarray, int]:
+    """
+    Connected components of the live (nonzero) entities of a structure (states in entity index order),
+        by breadth first search over its CSR index (Structure.adjacency), one level of the search at a time.
+
+    Returns the labels (0 for dead entities, 1 to n for the components, in the order of their first entity)
+        and the number of components.
+    """
+    alive = np.asarray(states) != 0
+    labels = np.zeros(len(alive), dtype=np.int64)
+    unvisited = alive.copy()
+    count = 0
+    for seed in np.flatnonzero(alive).tolist():
+        if not unvisited[seed]:
+            continue
+        count += 1
+        unvisited[seed] = False
+        labels[seed] = count
+        frontier = np.array([seed], dtype=np.int64)
+        while len(frontier):
+            neighbours, _ = adjacency.neighbours_of(frontier)
+            frontier = np.unique(neighbours[unvisited[neighbours]])
+            unvisited[frontier] = False
+            labels[frontier] = count
+    return labels, count
+
+def labels_to_lists(labels: np.ndarray, count: int = None) -> list:
+    """
+    The entity indices of every component of a 1D label array (label_graph, or label_grid raveled),
+        as a list of arrays in label order, each in entity order.
+    """
+    live = np.flatnonzero(labels)
+    if not len(live):
+        return []
+    order = np.argsort(labels[live], kind="stable")
+    count = int(labels.max()) if count is None else count
+    bounds = np.cumsum(np.bincount(labels[live], minlength=count + 1)[1:])[:-1]
+    return np.split(live[order], bounds)
@@ -0,0 +1,502 @@
+import numpy as np
+from collections.abc import Mapping, MutableMapping
+from typing import List, Dict, Any
+
+class StateHistory:
+    """
+    Stores the states of every entity of a structure over time, as a (timesteps x entities) table.
+
+    Row 0 is the timestep `initial_time_step`, the columns follow the entity index of the structure
+        (see Structure.get_entity_index). Timesteps that are not written read as 0.
+    Concrete stores implement get_row, set_row, add_entities and nbytes.
+    """
+    def __init__(self, num_entities: int, initial_time_step: int = 0,
+                 base_name: str = "t_", dtype = np.uint8):
+        self.num_entities = num_entities
+        self.initial_time_step = initial_time_step
+        self.base_name = base_name
+        self.dtype = np.dtype(dtype)
+        self.num_steps = 0
+
+    def key(self, t: int) -> str:
+        return self.base_name + str(t)
+
+    def parse_key(self, key) -> int | None:
+        """Returns the timestep of a key such as "t_12", or None if the key is not a time key."""
+        if not isinstance(key, str) or not key.startswith(self.base_name):
+            return None
+        suffix = key[len(self.base_name):]
+        if not suffix.lstrip("-").isdigit():
+            return None
+        return int(suffix)
+
+    @property
+    def last_time_step(self) -> int:
+        return self.initial_time_step + self.num_steps - 1
+
+    def has_time_step(self, t: int) -> bool:
+        return self.initial_time_step <= t <= self.last_time_step
+
+    def time_steps(self) -> range:
+        return range(self.initial_time_step, self.initial_time_step + self.num_steps)
+
+    def _row_index(self, t: int) -> int:
+        if t < self.initial_time_step:
+            raise ValueError(f"Timestep {t} is before the first stored timestep {self.initial_time_step}.")
+        return t - self.initial_time_step
+
+    def _fit_dtype(self, values) -> np.ndarray:
+        """Widens the dtype of the store if `values` can not be represented in it (e.g. 0.5 in uint8)."""
+        values = np.asarray(values)
+        if values.dtype != self.dtype and values.size:
+            if not np.array_equal(values.astype(self.dtype), values):
+                self._set_dtype(np.result_type(self.dtype, values.dtype))
+        return values
+
+    def _set_dtype(self, dtype):
+        raise NotImplementedError
+
+    def get_row(self, t: int) -> np.ndarray:
+        raise NotImplementedError
+
+    def set_row(self, t: int, values: np.ndarray):
+        raise NotImplementedError
+
+    def get_rows(self, start: int = None, end: int = None) -> np.ndarray:
+        """Returns the (timesteps x entities) states from `start` to `end` (both inclusive)."""
+        start = self.initial_time_step if start is None else max(start, self.initial_time_step)
+        end = self.last_time_step if end is None else min(end, self.last_time_step)
+        if end < start:
+            return np.zeros((0, self.num_entities), dtype=self.dtype)
+        return np.stack([self.get_row(t) for t in range(start, end + 1)])
+
+    def get_value(self, t: int, index: int):
+        return self.get_row(t)[index]
+
+    def set_value(self, t: int, index: int, value):
+        row = self.get_row(t).copy() if self.has_time_step(t) else np.zeros(self.num_entities, dtype=self.dtype)
+        value = self._fit_dtype(value)
+        row = row.astype(self.dtype)
+        row[index] = value
+        self.set_row(t, row)
+
+    def set_row_changes(self, t: int, indices: np.ndarray, values, previous: int = None):
+        """
+        Stores at timestep t the states of timestep `previous` (default t - 1) with the values of
+            the entities `indices` changed (e.g. the changes of a frontier step, see Model.step).
+        """
+        previous = t - 1 if previous is None else previous
+        row = self.get_row(previous).copy() if self.has_time_step(previous) else np.zeros(self.num_entities, dtype=self.dtype)
+        values = self._fit_dtype(values)
+        row = row.astype(self.dtype)
+        row[indices] = values
+        self.set_row(t, row)
+
+    def add_entities(self, count: int = 1):
+        raise NotImplementedError
+
+    def discard_before(self, t: int):
+        """Drops the stored timesteps before t, which becomes the first stored timestep (if stored)."""
+        raise NotImplementedError
+
+    @property
+    def nbytes(self) -> int:
+        raise NotImplementedError
+
+class ArrayHistory(StateHistory):
+    """
+    Contiguous (timesteps x entities) NumPy array, grown by doubling along the time axis.
+    """
+    def __init__(self, num_entities: int, initial_time_step: int = 0,
+                 base_name: str = "t_", dtype = np.uint8, capacity: int = 16):
+        super().__init__(num_entities, initial_time_step, base_name, dtype)
+        self.array = np.zeros((max(capacity, 1), num_entities), dtype=self.dtype)
+
+    @property
+    def states(self) -> np.ndarray:
+        """View of the stored rows, shape (num_steps, num_entities)."""
+        return self.array[:self.num_steps]
+
+    def _reserve(self, num_steps: int):
+        if num_steps > self.array.shape[0]:
+            capacity = max(num_steps, 2 * self.array.shape[0])
+            array = np.zeros((capacity, self.num_entities), dtype=self.dtype)
+            array[:self.num_steps] = self.array[:self.num_steps]
+            self.array = array
+
+    def _set_dtype(self, dtype):
+        self.dtype = np.dtype(dtype)
+        self.array = self.array.astype(self.dtype)
+
+    def get_row(self, t: int) -> np.ndarray:
+        i = self._row_index(t)
+        if i >= self.num_steps:
+            return np.zeros(self.num_entities, dtype=self.dtype)
+        return self.array[i]
+
+    def get_rows(self, start: int = None, end: int = None) -> np.ndarray:
+        start = self.initial_time_step if start is None else max(start, self.initial_time_step)
+        end = self.last_time_step if end is None else min(end, self.last_time_step)
+        return self.array[start - self.initial_time_step:max(end - self.initial_time_step + 1, 0)]
+
+    def set_row(self, t: int, values):
+        i = self._row_index(t)
+        values = self._fit_dtype(values)
+        if i >= self.num_steps:
+            self._reserve(i + 1)
+            self.array[self.num_steps:i] = 0
+            self.num_steps = i + 1
+        self.array[i] = values
+
+    def get_value(self, t: int, index: int):
+        i = self._row_index(t)
+        return self.array[i, index] if i < self.num_steps else self.dtype.type(0)
+
+    def set_value(self, t: int, index: int, value):
+        i = self._row_index(t)
+        self._fit_dtype(value)
+        if i >= self.num_steps:
+            self._reserve(i + 1)
+            self.array[self.num_steps:i + 1] = 0
+            self.num_steps = i + 1
+        self.array[i, index] = value
+
+    def add_entities(self, count: int = 1):
+        self.array = np.concatenate([self.array, np.zeros((self.array.shape[0], count), dtype=self.dtype)], axis=1)
+        self.num_entities += count
+
+    def discard_before(self, t: int):
+        #The kept rows are moved to the start, so the array does not grow with the discarded ones
+        k = min(max(t - self.initial_time_step, 0), self.num_steps)
+        if not k:
+            return
+        self.array[:self.num_steps - k] = self.array[k:self.num_steps]
+        self.num_steps -= k
+        self.initial_time_step += k
+
+    @property
+    def nbytes(self) -> int:
+        return self.array[:self.num_steps].nbytes
+
+class SparseHistory(StateHistory):
+    """
+    Stores every timestep as coordinate arrays (entity indices, values) instead of a dense row.
+
+    encoding:
+        - "delta": the entities that changed since the previous timestep, with a keyframe
+            (all nonzero entities) every `keyframe_interval` timesteps, so any timestep is rebuilt
+            from the closest keyframe before it
+        - "live": every timestep stores its nonzero entities (each timestep is a keyframe)
+    The last two timesteps are also kept as dense rows, to append and to edit the last timestep quickly.
+    """
+    def __init__(self, num_entities: int, initial_time_step: int = 0,
+                 base_name: str = "t_", dtype = np.uint8,
+                 encoding: str = "delta", keyframe_interval: int = 64):
+        super().__init__(num_entities, initial_time_step, base_name, dtype)
+        if encoding not in ("delta", "live"):
+            raise ValueError(f"encoding must be 'delta' or 'live', not {encoding}")
+        self.encoding = encoding
+        self.keyframe_interval = max(int(keyframe_interval), 1)
+        self.index_dtype = np.int32 if num_entities < 2**31 else np.int64
+        self.rows = [] #(indices, values) per timestep
+        self._last = None
+        self._previous = None
+        self._cache = (None, None) #(row index, dense row) of the last decoded timestep
+
+    def _is_keyframe(self, i: int) -> bool:
+        return self.encoding == "live" or i % self.keyframe_interval == 0
+
+    def _encode(self, i: int, row: np.ndarray, previous: np.ndarray = None):
+        if self._is_keyframe(i) or previous is None:
+            indices = np.flatnonzero(row)
+        else:
+            indices = np.flatnonzero(row != previous)
+        return indices.astype(self.index_dtype), row[indices].copy()
+
+    def _decode(self, i: int) -> np.ndarray:
+        if i == self.num_steps - 1:
+            return self._last
+        if i == self.num_steps - 2 and self._previous is not None:
+            return self._previous
+        cached_i, cached_row = self._cache
+        if cached_i is not None and cached_i <= i and not any(self._is_keyframe(j) for j in range(cached_i + 1, i + 1)):
+            start, row = cached_i, cached_row.copy()
+        else:
+            start = i
+            while not self._is_keyframe(start):
+                start -= 1
+            row = np.zeros(self.num_entities, dtype=self.dtype)
+            indices, values = self.rows[start]
+            row[indices] = values
+        for j in range(start + 1, i + 1):
+            indices, values = self.rows[j]
+            row[indices] = values
+        self._cache = (i, row)
+        return row
+
+    def _set_dtype(self, dtype):
+        self.dtype = np.dtype(dtype)
+        self.rows = [(indices, values.astype(self.dtype)) for indices, values in self.rows]
+        if self._last is not None:
+            self._last = self._last.astype(self.dtype)
+        if self._previous is not None:
+            self._previous = self._previous.astype(self.dtype)
+        self._cache = (None, None)
+
+    def get_row(self, t: int) -> np.ndarray:
+        i = self._row_index(t)
+        if i >= self.num_steps:
+            return np.zeros(self.num_entities, dtype=self.dtype)
+        return self._decode(i).copy() #the decoded rows are kept (last rows, cache), callers may modify theirs
+
+    def get_rows(self, start: int = None, end: int = None) -> np.ndarray:
+        start = self.initial_time_step if start is None else max(start, self.initial_time_step)
+        end = self.last_time_step if end is None else min(end, self.last_time_step)
+        if end < start:
+            return np.zeros((0, self.num_entities), dtype=self.dtype)
+        first, last = start - self.initial_time_step, end - self.initial_time_step
+        rows = np.empty((last - first + 1, self.num_entities), dtype=self.dtype)
+        row = self._decode(first).copy()
+        rows[0] = row
+        for i in range(first + 1, last + 1):
+            indices, values = self.rows[i]
+            if self._is_keyframe(i):
+                row[:] = 0
+            row[indices] = values
+            rows[i - first] = row
+        return rows
+
+    def set_row(self, t: int, values):
+        i = self._row_index(t)
+        values = self._fit_dtype(values)
+        row = np.array(values, dtype=self.dtype)
+        while self.num_steps < i:
+            self._append(np.zeros(self.num_entities, dtype=self.dtype))
+        if i == self.num_steps:
+            self._append(row)
+        elif i == self.num_steps - 1:
+            self._last = row
+            self.rows[i] = self._encode(i, row, self._previous)
+        else:
+            following = self._decode(i + 1).copy()
+            self.rows[i] = self._encode(i, row, self._decode(i - 1) if i > 0 else None)
+            self.rows[i + 1] = self._encode(i + 1, following, row)
+            if i == self.num_steps - 2:
+                self._previous = row
+        self._cache = (None, None)
+
+    def _append(self, row: np.ndarray):
+        i = self.num_steps
+        self.rows.append(self._encode(i, row, self._last))
+        self._previous, self._last = self._last, row
+        self.num_steps += 1
+
+    def set_row_changes(self, t: int, indices: np.ndarray, values, previous: int = None):
+        """
+        Appending the timestep after the last one with the delta encoding stores the changes as they are,
+            without comparing whole rows.
+        """
+        i = self._row_index(t)
+        if (previous not in (None, t - 1) or i != self.num_steps or i == 0
+                or self._is_keyframe(i)):
+            return super().set_row_changes(t, indices, values, previous)
+        values = self._fit_dtype(values)
+        indices = np.asarray(indices, dtype=self.index_dtype)
+        order = np.argsort(indices, kind="stable")
+        indices, values = indices[order], np.asarray(values, dtype=self.dtype)[order]
+        row = self._last.copy()
+        row[indices] = values
+        changed = self._last[indices] != values
+        self.rows.append((indices[changed], values[changed]))
+        self._previous, self._last = self._last, row
+        self.num_steps += 1
+        self._cache = (None, None)
+
+    def set_value(self, t: int, index: int, value):
+        i = self._row_index(t)
+        self._fit_dtype(value)
+        if i < self.num_steps - 1:
+            return super().set_value(t, index, value)
+        if i >= self.num_steps:
+            self.set_row(t, np.zeros(self.num_entities, dtype=self.dtype))
+        if self._last[index] != value:
+            self._last = self._last.copy()
+            self._last[index] = value
+            self.rows[i] = self._encode(i, self._last, self._previous)
+            self._cache = (None, None)
+
+    def discard_before(self, t: int):
+        #Keyframes follow the row index, so the kept timesteps are encoded again from their first one
+        k = min(max(t - self.initial_time_step, 0), self.num_steps)
+        if not k:
+            return
+        kept = self.get_rows(self.initial_time_step + k, None)
+        self.rows, self._last, self._previous, self._cache = [], None, None, (None, None)
+        self.num_steps = 0
+        self.initial_time_step += k
+        for row in kept:
+            self._append(row.copy())
+
+    def add_entities(self, count: int = 1):
+        padding = np.zeros(count, dtype=self.dtype)
+        if self._last is not None:
+            self._last = np.concatenate([self._last, padding])
+        if self._previous is not None:
+            self._previous = np.concatenate([self._previous, padding])
+        self.num_entities += count
+        self._cache = (None, None)
+
+    @property
+    def nbytes(self) -> int:
+        dense = sum(row.nbytes for row in (self._last, self._previous) if row is not None)
+        return dense + sum(indices.nbytes + values.nbytes for indices, values in self.rows)
+
+class EntityStates(MutableMapping):
+    """
+    Dict-like view of the values of one entity, as in the dict store: {"t_0": value, "t_1": value, ...}.
+    Keys that are not time keys (e.g. node attributes of a Graph) are kept in a plain dict.
+    """
+    def __init__(self, entities: "EntitiesView", index: int):
+        self._entities = entities
+        self._index = index
+
+    @property
+    def _history(self) -> StateHistory:
+        return self._entities.history
+
+    @property
+    def _extras(self) -> Dict:
+        return self._entities.extras.setdefault(self._index, {})
+
+    def __getitem__(self, key):
+        t = self._history.parse_key(key)
+        if t is None:
+            return self._entities.extras.get(self._index, {})[key]
+        if not self._history.has_time_step(t):
+            raise KeyError(key)
+        return self._history.get_value(t, self._index).item()
+
+    def __setitem__(self, key, value):
+        t = self._history.parse_key(key)
+        if t is None:
+            self._extras[key] = value
+        else:
+            self._history.set_value(t, self._index, value)
+
+    def __delitem__(self, key):
+        if self._history.parse_key(key) is not None:
+            raise TypeError(f"Can not delete time key {key} from a {type(self._history).__name__} store.")
+        del self._entities.extras.get(self._index, {})[key]
+
+    def __contains__(self, key):
+        t = self._history.parse_key(key)
+        if t is None:
+            return key in self._entities.extras.get(self._index, {})
+        return self._history.has_time_step(t)
+
+    def __iter__(self):
+        for t in self._history.time_steps():
+            yield self._history.key(t)
+        yield from list(self._entities.extras.get(self._index, {}))
+
+    def __len__(self):
+        return self._history.num_steps + len(self._entities.extras.get(self._index, {}))
+
+    def copy(self) -> Dict:
+        return dict(self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+class EntitiesView(MutableMapping):
+    """
+    Dict-like view of a history store, keeping the {entity: {"t_0": value, ...}} API of Structure.entities.
+    """
+    def __init__(self, history: StateHistory, entity_list: List, entity_index: Dict):
+        self.history = history
+        self.entity_list = entity_list
+        self.entity_index = entity_index
+        self.extras = {}
+
+    def __getitem__(self, entity) -> EntityStates:
+        return EntityStates(self, self.entity_index[entity])
+
+    def __setitem__(self, entity, values: Dict):
+        if entity not in self.entity_index:
+            self.entity_index[entity] = len(self.entity_list)
+            self.entity_list.append(entity)
+            self.history.add_entities(1)
+        index = self.entity_index[entity]
+        self.extras.pop(index, None)
+        for t in self.history.time_steps():
+            if self.history.get_value(t, index):
+                self.history.set_value(t, index, 0)
+        states = EntityStates(self, index)
+        for key, value in values.items():
+            states[key] = value
+
+    def __delitem__(self, entity):
+        raise TypeError(f"Can not remove entities from a {type(self.history).__name__} store.")
+
+    def __contains__(self, entity):
+        return entity in self.entity_index
+
+    def __iter__(self):
+        return iter(self.entity_list)
+
+    def __len__(self):
+        return len(self.entity_list)
+
+    def copy(self) -> Dict:
+        return dict(self)
+
+    def to_dict(self) -> Dict:
+        """Materializes the view into the plain {entity: {key: value}} dict of the dict store."""
+        return {entity: dict(EntityStates(self, i)) for i, entity in enumerate(self.entity_list)}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({type(self.history).__name__}, {len(self)} entities, {self.history.num_steps} timesteps)"
+
+class StateSlice(Mapping):
+    """
+    Read-only dict-like view {entity: value} of a 1D state array in entity index order,
+        as returned by the array engines of Model. With only_nonzero, only nonzero entities are keys.
+    """
+    def __init__(self, array: np.ndarray, entity_list: List, entity_index: Dict,
+                 only_nonzero: bool = False):
+        self.array = array
+        self.entity_list = entity_list
+        self.entity_index = entity_index
+        self.only_nonzero = only_nonzero
+
+    def __getitem__(self, entity):
+        value = self.array[self.entity_index[entity]]
+        if self.only_nonzero and not value:
+            raise KeyError(entity)
+        return value.item()
+
+    def __contains__(self, entity):
+        index = self.entity_index.get(entity)
+        if index is None:
+            return False
+        return bool(self.array[index]) or not self.only_nonzero
+
+    def __iter__(self):
+        if self.only_nonzero:
+            entity_list = self.entity_list
+            return (entity_list[i] for i in np.flatnonzero(self.array).tolist())
+        return iter(self.entity_list[:len(self.array)])
+
+    def __len__(self):
+        return int(np.count_nonzero(self.array)) if self.only_nonzero else len(self.array)
+
+    def copy(self) -> Dict:
+        return dict(self.items())
+
+    def __repr__(self):
+        return f"{type(self).__name__}({len(self)} entities)"
+
+HISTORY_STORES = {
+    "array": ArrayHistory,
+    "sparse": SparseHistory,
+}
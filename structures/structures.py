@@ -1,6 +1,10 @@
 import numpy as np
 import networkx as nx
 from typing import List, Tuple, Dict, Generator, Any
+from .history import HISTORY_STORES, EntitiesView, StateSlice
+from .adjacency import AdjacencyIndex
+from .topology import components_to_arrays, unwrap_components, canonical_components, topology_key
+from .components import label_grid, label_graph, labels_to_lists
 
 class Structure:
     """
@@ -10,11 +14,13 @@ class Structure:
 
     Currently, the entities dict (stored in self.entities) stores every entity as key, and the values
         are every timestep t0, t1, t2, ... values
-    There is consideration to rather store the nonzero values at each time step instead.
-    #TODO: t "time slices": should be a dict of times t0, t1, t2, ... storing the nonzero values
+    With store_mode="array", the values are kept in a (timesteps x entities) NumPy array instead,
+        and with store_mode="sparse" every timestep only stores the nonzero or the changed values
+        (see structures.history). self.entities is then a dict-like view of the store with the same API.
     """
     def __init__(self, initial_values=None,
-                 time_step: int = 0, base_name: str = "t_",):
+                 time_step: int = 0, base_name: str = "t_",
+                 store_mode: str = "dict", store_options: Dict = None):
         self.entities = self.initialize_entities()
         self.connections = self.initialize_connections()
 
@@ -25,7 +31,231 @@ class Structure:
         self.last_iterations = {base_name:time_step}
         if initial_values:
             raise NotImplementedError()
+        self._setup_store(store_mode, store_options=store_options)
     
+    def _setup_store(self, store_mode: str = "dict", dtype = None,
+                     entity_list: List = None, initial_states: np.ndarray = None,
+                     store_options: Dict = None):
+        """
+        Sets up where the entity values are stored over time.
+
+        - "dict": self.entities is a dict of entity: {"t_0": value, "t_1": value, ...} (default)
+        - "array": a history store keeps the values, self.entities is a dict-like view of it.
+            If dtype is None, uint8 is used when all initial values are 0 or 1.
+        - "sparse": as "array", but each timestep is stored as coordinate arrays. store_options
+            are passed to SparseHistory, e.g. {"encoding": "live"} or {"keyframe_interval": 32}.
+
+        Either self.entities is already filled (its values are moved into the store),
+            or entity_list and initial_states (values at the initial key, in entity_list order) are given.
+        """
+        self.store_mode = store_mode
+        self.history = None
+        self._entity_list = None
+        if store_mode == "dict":
+            return
+        if store_mode not in HISTORY_STORES:
+            raise ValueError(f"store_mode must be 'dict' or one of {list(HISTORY_STORES)}, not {store_mode}")
+
+        base_name = self.key_name["base_name"]
+        entities = None
+        if entity_list is None:
+            entities = self.entities
+            entity_list = list(entities.keys())
+            initial_states = [values.get(self.initial_key_name, 0) for values in entities.values()]
+        initial_states = np.asarray(initial_states)
+        if dtype is None:
+            binary = initial_states.size == 0 or np.isin(initial_states, (0, 1)).all()
+            dtype = np.uint8 if binary else initial_states.dtype
+
+        history = HISTORY_STORES[store_mode](len(entity_list), initial_time_step=self.initial_time_step,
+                                             base_name=base_name, dtype=dtype, **(store_options or {}))
+        history.set_row(self.initial_time_step, initial_states)
+        entity_index = {entity: i for i, entity in enumerate(entity_list)}
+        view = EntitiesView(history, entity_list, entity_index)
+        if entities is not None:
+            for i, values in enumerate(entities.values()):
+                for key, value in values.items():
+                    if key != self.initial_key_name:
+                        view[entity_list[i]][key] = value
+        self.history = history
+        self.entities = view
+
+    def get_entity_list(self) -> List:
+        """
+        Returns the entities in index order: the i-th entity is stored in column i of the state arrays.
+        """
+        history = getattr(self, "history", None)
+        if history is not None:
+            return self.entities.entity_list
+        entity_list = getattr(self, "_entity_list", None)
+        if entity_list is None or len(entity_list) != len(self.entities):
+            entity_list = list(self.entities.keys())
+            self._entity_list = entity_list
+            self._entity_index = {entity: i for i, entity in enumerate(entity_list)}
+        return entity_list
+
+    def get_entity_index(self) -> Dict:
+        """
+        Returns the entity: index lookup table (the inverse of get_entity_list).
+        """
+        if getattr(self, "history", None) is not None:
+            return self.entities.entity_index
+        self.get_entity_list()
+        return self._entity_index
+
+    def has_time_key(self, key_name: str) -> bool:
+        """
+        Returns whether any entity has a value stored under key_name.
+        """
+        if getattr(self, "history", None) is not None:
+            t = self.history.parse_key(key_name)
+            return t is not None and self.history.has_time_step(t)
+        return any(key_name in values for values in self.entities.values())
+
+    def get_state_array(self, key_name: str = "t_0") -> np.ndarray:
+        """
+        Returns the values of all entities under key_name as a 1D array in entity index order,
+            missing values are 0.
+        """
+        if getattr(self, "history", None) is not None:
+            t = self.history.parse_key(key_name)
+            if t is None or not self.history.has_time_step(t):
+                return np.zeros(len(self.entities), dtype=self.history.dtype)
+            return self.history.get_row(t).copy()
+        return np.array([values.get(key_name, 0) for values in self.entities.values()])
+
+    def states_to_array(self, states: Dict) -> np.ndarray:
+        """
+        Returns a dict of entity: value as a 1D array in entity index order (missing entities are 0).
+        """
+        if isinstance(states, StateSlice) and len(states.array) == len(self.entities):
+            return states.array
+        entity_index = self.get_entity_index()
+        values = np.asarray(list(states.values()))
+        array = np.zeros(len(self.entities), dtype=values.dtype if values.size else np.uint8)
+        array[np.fromiter((entity_index[entity] for entity in states), dtype=np.int64, count=len(states))] = values
+        return array
+
+    def array_to_states(self, array: np.ndarray, only_nonzero: bool = False) -> StateSlice:
+        """
+        Returns a dict-like view {entity: value} of a 1D state array in entity index order.
+        """
+        return StateSlice(array, self.get_entity_list(), self.get_entity_index(), only_nonzero=only_nonzero)
+
+    def set_time_slice(self, states: Dict | np.ndarray, key_name: str):
+        """
+        Stores the states of entities under key_name.
+
+        states is either a dict of entity: value (entities not in the structure yet are added),
+            or a 1D array of the values of all entities, in entity index order.
+        """
+        if isinstance(states, StateSlice):
+            if not states:
+                return
+            if len(states.array) == len(self.entities):
+                if getattr(self, "history", None) is not None:
+                    states = states.array
+                else:
+                    self._set_dict_row(states.array, key_name, only_nonzero=states.only_nonzero)
+                    return
+        if isinstance(states, np.ndarray):
+            if getattr(self, "history", None) is not None:
+                t = self.history.parse_key(key_name)
+                if t is None:
+                    raise ValueError(f"Key name {key_name} is not a time key of base name {self.history.base_name}.")
+                self.history.set_row(t, states)
+                return
+            self._set_dict_row(states, key_name)
+            return
+
+        if getattr(self, "history", None) is not None:
+            t = self.history.parse_key(key_name)
+            if t is None:
+                raise ValueError(f"Key name {key_name} is not a time key of base name {self.history.base_name}.")
+            if not states:
+                #As in the dict store, nothing is written (the timestep is not created)
+                return
+            for entity in states:
+                if entity not in self.entities:
+                    #TODO: fix bug - some entities go "beyond" the grid (e.g. instead of going around)
+                    self.entities[entity] = {}
+            entity_index = self.get_entity_index()
+            row = np.zeros(len(self.entities), dtype=self.history.dtype)
+            indices = np.fromiter((entity_index[entity] for entity in states), dtype=np.int64, count=len(states))
+            values = self.history._fit_dtype(list(states.values()))
+            row = row.astype(self.history.dtype)
+            row[indices] = values
+            self.history.set_row(t, row)
+            return
+
+        for entity, value in states.items():
+            if entity not in self.entities:
+                #TODO: fix bug - some entities go "beyond" the grid (e.g. instead of going around)
+                self.entities[entity] = {}
+            self.entities[entity][key_name] = value
+
+    def _set_dict_row(self, array: np.ndarray, key_name: str, only_nonzero: bool = False):
+        """
+        Writes a 1D state array (in entity index order) under key_name in the dict store, without
+            building the {entity: value} dict. With only_nonzero, only the nonzero entities are written.
+        """
+        if only_nonzero:
+            entity_list = self.get_entity_list()
+            indices = np.flatnonzero(array)
+            for i, value in zip(indices.tolist(), array[indices].tolist()):
+                self.entities[entity_list[i]][key_name] = value
+            return
+        for values, value in zip(self.entities.values(), array.tolist()):
+            values[key_name] = value
+
+    def set_time_slice_changes(self, changes: Dict | Tuple[np.ndarray, np.ndarray],
+                               key_name: str, previous_key_name: str):
+        """
+        Stores under key_name the states of previous_key_name with the given changes, either a dict of
+            entity: value or (entity indices, values) arrays.
+
+        The history stores write the changes only (the sparse store appends them as they are), the dict
+            store copies the values of the entities that have one under previous_key_name.
+        """
+        if getattr(self, "history", None) is not None:
+            t, previous = self.history.parse_key(key_name), self.history.parse_key(previous_key_name)
+            if t is None or previous is None:
+                raise ValueError(f"Key names {previous_key_name}, {key_name} are not time keys of base name {self.history.base_name}.")
+            if isinstance(changes, dict):
+                for entity in changes:
+                    if entity not in self.entities:
+                        self.entities[entity] = {}
+                entity_index = self.get_entity_index()
+                changes = (np.fromiter((entity_index[entity] for entity in changes), dtype=np.int64, count=len(changes)),
+                           list(changes.values()))
+            self.history.set_row_changes(t, changes[0], changes[1], previous)
+            return
+
+        if not isinstance(changes, dict):
+            entity_list = self.get_entity_list()
+            changes = dict(zip((entity_list[i] for i in changes[0].tolist()), changes[1].tolist()))
+        for entity, values in self.entities.items():
+            if previous_key_name in values:
+                values[key_name] = values[previous_key_name]
+        self.set_time_slice(changes, key_name)
+
+    def discard_history(self, time_step: int, base_name: str = "t_"):
+        """
+        Drops the stored states of the timesteps before time_step (e.g. to run without keeping
+            the history, see Model.iter_simulation).
+        """
+        if getattr(self, "history", None) is not None and base_name == self.history.base_name:
+            self.history.discard_before(time_step)
+            return
+        def stale(key) -> bool:
+            suffix = key[len(base_name):] if isinstance(key, str) and key.startswith(base_name) else ""
+            return suffix.lstrip("-").isdigit() and int(suffix) < time_step
+        stale_keys = {} #key: whether it is dropped, decided once per key
+        for values in self.entities.values():
+            for key in [key for key in values if stale_keys.get(key, None) is not False
+                        and stale_keys.setdefault(key, stale(key))]:
+                del values[key]
+
     def initialize_entities(self):
         raise NotImplementedError
 
@@ -63,6 +293,20 @@ class Structure:
         if isinstance(t, int):
             name = name + str(t)
 
+        if getattr(self, "history", None) is not None:
+            t = self.history.parse_key(name)
+            if t is None or not self.history.has_time_step(t):
+                if verbose:
+                    print(f"Entities do not have key {name} property.")
+                nonzero_entities = {}
+            else:
+                row = self.history.get_row(t)
+                entity_list = self.get_entity_list()
+                nonzero_entities = {entity_list[i]: row[i].item() for i in np.flatnonzero(row)}
+            if string_keys:
+                nonzero_entities = {str(entity): value for entity, value in nonzero_entities.items()}
+            return nonzero_entities
+
         nonzero_entities = {}
         for entity, values in self.entities.items():
             if name not in values:
@@ -76,17 +320,25 @@ class Structure:
             nonzero_entities = {str(entity): value for entity, value in nonzero_entities.items()}
         return nonzero_entities
 
+    @property
+    def adjacency(self) -> AdjacencyIndex:
+        """
+        CSR index of the connections over entity ids, built once (and rebuilt if entities were added).
+        """
+        adjacency = getattr(self, "_adjacency", None)
+        if adjacency is None or adjacency.num_entities != len(self.entities):
+            adjacency = AdjacencyIndex.from_structure(self)
+            self._adjacency = adjacency
+        return adjacency
+
     def get_entity_connections(self, entity):
         """
-        Returns the neighbours of the given entity.
+        Returns the connections of the given entity (in the order of self.connections).
         """
-        if entity not in self.entities.keys():
+        if entity not in self.entities:
             raise ValueError(f"Entity {entity} is not in the structure.")
-        connections = []
-        for connection in self.get_connections():
-            if entity in connection:
-                connections.append(connection)
-        return connections
+        adjacency = self.adjacency
+        return [self.connections[e] for e in adjacency.connection_ids(adjacency.entity_index[entity]).tolist()]
     
     def get_entity_neighbours(self, entity):
         """
@@ -107,6 +359,7 @@ class Structure:
         if duplicate_removal:
             connections = self.get_unique_connections(connections, undirected=undirected)
         if external_only:
+            entities = set(entities)
             connections = [(a,b) for (a,b) in connections if (a not in entities) or (b not in entities)]
         return connections
 
@@ -125,30 +378,35 @@ class Structure:
         if duplicate_removal:
             neighbours = list(set(neighbours))
         if external_only:
+            entities = set(entities)
             neighbours = [neighbour for neighbour in neighbours if neighbour not in entities]
         return neighbours
     
     def get_entities_connections_LUT(self, duplicate_removal = True):
         """
-        Returns a lookup table of the connections of each entity.
+        Returns a lookup table of the connections of each entity (served from the adjacency index).
         """
-        connections_LUT = {}
-        for entity_A, entity_B in self.get_connections():
-            if entity_A not in connections_LUT:
-                connections_LUT[entity_A] = []
-            if entity_B not in connections_LUT:
-                connections_LUT[entity_B] = []
-            connections_LUT[entity_A].append(entity_B)
-            connections_LUT[entity_B].append(entity_A)
-        #Remove duplicates (theoretically not needed, but for safety)
+        adjacency = self.adjacency
         if duplicate_removal:
-            for entity, connections in connections_LUT.items():
-                connections_LUT[entity] = list(set(connections))
+            return adjacency.to_lookup_table()
+        connections_LUT = {}
+        for i, entity in enumerate(adjacency.entity_list):
+            connections_LUT[entity] = [b if a == entity else a
+                                       for a, b in (self.connections[e] for e in adjacency.connection_ids(i).tolist())]
         return connections_LUT
     
     def get_time_slice(self, key_name:str="t_0",
                        only_nonzero: bool = True,
                        fill_missing = False)-> Dict:
+        if getattr(self, "history", None) is not None:
+            t = self.history.parse_key(key_name)
+            entity_list = self.get_entity_list()
+            if t is None or not self.history.has_time_step(t):
+                return {entity: 0 for entity in entity_list} if fill_missing and not only_nonzero else {}
+            row = self.history.get_row(t)
+            if only_nonzero:
+                return {entity_list[i]: row[i].item() for i in np.flatnonzero(row)}
+            return dict(zip(entity_list, row.tolist()))
         entities = self.get_entities()
         if fill_missing and not only_nonzero:
             entities = {entity:values[key_name] if key_name in values else 0 for entity, values in entities.items()}
@@ -170,6 +428,8 @@ class Structure:
         Returns all time slices of the structure.
         If only_nonzero is True, then fill_missing is ignored
         """
+        if getattr(self, "history", None) is not None and base_name == self.history.base_name:
+            return self._get_history_states(start_timestamp, end_timestamp, only_nonzero)
         entities = self.get_entities()
         time_slices = {}
         for entity, values in entities.items():
@@ -191,17 +451,83 @@ class Structure:
             time_slices = {entity:values for entity, values in time_slices.items() if values}
         return time_slices
 
+    def _get_history_states(self, start_timestamp:int = 0, end_timestamp:int = None,
+                            only_nonzero: bool = True) -> Dict:
+        """
+        get_entities_states for the history stores: a timestep stored in the history is present
+            for every entity (unwritten values read as 0).
+        """
+        history = self.history
+        start = max(start_timestamp, history.initial_time_step)
+        rows = history.get_rows(start, end_timestamp)
+        keys = [history.key(t) for t in range(start, start + len(rows))]
+        entity_list = self.get_entity_list()
+        if only_nonzero:
+            time_slices = {}
+            indices, timesteps = np.nonzero(rows.T)
+            for i, t in zip(indices.tolist(), timesteps.tolist()):
+                entity = entity_list[i]
+                if entity not in time_slices:
+                    time_slices[entity] = {}
+                time_slices[entity][keys[t]] = rows[t, i].item()
+            return time_slices
+        columns = rows.T.tolist()
+        return {entity: dict(zip(keys, columns[i])) for i, entity in enumerate(entity_list)}
+
     def get_entity_sorted_values(self, entity, base_name:str="t_"):
         """
         Returns dynamic values of an entity, sorted by time
         """
-        if entity not in self.get_entities().keys():
+        if entity not in self.entities:
             raise ValueError(f"Entity {entity} is not in the structure.")
+        if getattr(self, "history", None) is not None and base_name == self.history.base_name:
+            index = self.get_entity_index()[entity]
+            return [{self.history.key(t): self.history.get_value(t, index).item()}
+                    for t in self.history.time_steps()]
         values = ([{key:value} for key, value in self.entities[entity].items() if key.startswith(base_name)])
         return sorted(values, key=lambda x: int(next(iter(x)).split(base_name)[1]))
     
     #TODO: get_entities_sorted_values
 
+    def _component_states(self, entities = None, key_name:str=None) -> np.ndarray | None:
+        """
+        The states to find components in as a 1D array in entity index order, from the entities
+            (a dict of entity: value or an array) or the time slice key_name, or None if they are not
+            states of the entities of the structure (e.g. dicts of all time slices per entity).
+        """
+        if isinstance(entities, np.ndarray):
+            return entities.ravel()
+        if isinstance(entities, StateSlice) and len(entities.array) == len(self.entities):
+            return entities.array
+        if not entities:
+            return self.get_state_array(key_name or "t_0")
+        if key_name:
+            return None
+        try:
+            states = self.states_to_array(entities)
+        except (KeyError, TypeError, ValueError):
+            return None
+        return None if states.dtype == object else states
+
+    def get_components(self, entities = None, key_name:str=None, only_nonzero: bool = True,
+                       connections_LUT: Dict = None) -> List[List[Any]]:
+        """
+        Connected components of the nonzero entities, as lists of entities: by breadth first search over
+            the adjacency index (see components.label_graph), or with connections_LUT (or only_nonzero=False,
+            components of all given entities) by utils.blobs.
+        """
+        states = self._component_states(entities, key_name) if connections_LUT is None and only_nonzero else None
+        if states is not None:
+            labels, count = label_graph(self.adjacency, states)
+            entity_list = self.get_entity_list()
+            return [[entity_list[i] for i in component.tolist()] for component in labels_to_lists(labels, count)]
+        from higherorder.utils.utils import blobs #Lazy import to avoid circular import
+        if not entities and not key_name:
+            key_name = "t_0"
+        return blobs(structure=self, entities = entities,
+                     connections_LUT = connections_LUT or self.get_entities_connections_LUT(),
+                     key_name = key_name, only_nonzero=only_nonzero)
+
     def get_components_topology_representation(self, key_name:str="t_0"):
         """
         Take each component and "reduce" them to a representation of their topology that
@@ -209,6 +535,12 @@ class Structure:
         """
         raise NotImplementedError()
 
+    def get_components_topology_key(self, key_name:str="t_0") -> bytes:
+        """
+        Hashable key of the topology of the components, see get_components_topology_representation
+        """
+        raise NotImplementedError()
+
     def to_dict(self) -> Dict:
         return {"structure": str(type(self)).split("'")[1].split(".")[-1], **self.__dict__}
     
@@ -235,29 +567,62 @@ class Grid(Structure):
     def __init__(self, initial_values: np.ndarray | Dict[Tuple[int, int], Any] = None,
                  width: int = None, height: int = None,
                  periodic_boundary: bool = True, diagonal_neighbours: bool = True,
-                 time_step: int = 0, base_name: str = "t_"):
+                 time_step: int = 0, base_name: str = "t_",
+                 store_mode: str = "dict", dtype = None, store_options: Dict = None):
         """
         Initialize a grid structure.
         TODO: left_top_corner
+
+        store_mode: "dict" (default), "array" or "sparse", see Structure._setup_store.
+            Entities are ordered row-major: (0,0), (0,1), ..., (1,0), ..., so a state array
+            of the grid reshapes to (width, height).
         """
         
         initial_values, width, height = self._setup_initialization(initial_values, width, height)
 
         key_name = {"base_name":base_name, "index":time_step}
         initial_key_name = base_name + str(time_step)
-        entities = self.initialize_entities(initial_values, width, height, initial_key_name)
         connections = self.initialize_connections(width, height, periodic_boundary, diagonal_neighbours)
 
         self.key_name = key_name #TODO rethink, generalize to dict of key names
         self.initial_key_name = initial_key_name
         self.initial_time_step = time_step
         self.last_iterations = {base_name:time_step}
-        self.entities = entities
         self.connections = connections
         self.width = width
         self.height = height
         self.periodic_boundary = periodic_boundary
         self.diagonal_neighbours = diagonal_neighbours
+        if store_mode == "dict":
+            self.entities = self.initialize_entities(initial_values, width, height, initial_key_name)
+            self._setup_store(store_mode)
+        else:
+            self.entities = None
+            self._setup_store(store_mode, dtype=dtype,
+                              entity_list=[(x, y) for x in range(width) for y in range(height)],
+                              initial_states=self._initial_array(initial_values, width, height).ravel(),
+                              store_options=store_options)
+
+    @classmethod
+    def from_coordinates(cls, xs: np.ndarray, ys: np.ndarray, values: np.ndarray = None,
+                         width: int = None, height: int = None, **kwargs) -> "Grid":
+        """
+        A grid from the coordinates of its nonzero cells (e.g. of utils.InitGridArchive), with values
+            (default 1) set by array indexing instead of per-cell dicts. kwargs are passed to Grid.
+        """
+        xs, ys = np.asarray(xs, dtype=np.int64), np.asarray(ys, dtype=np.int64)
+        values = np.ones(len(xs), dtype=np.int64) if values is None else np.asarray(values)
+        if not width:
+            width = int(xs.max()) + 1 if len(xs) else None
+        if not height:
+            height = int(ys.max()) + 1 if len(ys) else None
+        if not isinstance(width, int) or not isinstance(height, int):
+            raise ValueError("Width and height must be provided for a grid without coordinates.")
+        if len(xs) and (xs.min() < 0 or ys.min() < 0 or xs.max() >= width or ys.max() >= height):
+            raise ValueError(f"Coordinates are not in the grid of width {width} and height {height}.")
+        array = np.zeros((width, height), dtype=values.dtype if len(values) else np.int64)
+        array[xs, ys] = values
+        return cls(array, width=width, height=height, **kwargs)
 
     def _setup_initialization(self, initial_values, width, height):
         if isinstance(initial_values, np.ndarray):
@@ -289,6 +654,24 @@ class Grid(Structure):
             raise ValueError(f"Current implementation: initial_values must be numpy array or dict, not {type(initial_values)}")
         return initial_values, width, height
     
+    def _initial_array(self, initial_values, width, height) -> np.ndarray:
+        """
+        The initial values as a (width, height) array, without building per-cell dicts.
+        """
+        if isinstance(initial_values, np.ndarray):
+            if initial_values.shape[0] > width or initial_values.shape[1] > height:
+                raise ValueError(f"Initial values of shape {initial_values.shape} do not fit in the grid.")
+            array = np.zeros((width, height), dtype=initial_values.dtype)
+            array[:initial_values.shape[0], :initial_values.shape[1]] = initial_values
+            return array
+        values = np.asarray(list(initial_values.values()))
+        array = np.zeros((width, height), dtype=values.dtype if values.size else np.uint8)
+        for (x,y), value in initial_values.items():
+            if not (0 <= x < width and 0 <= y < height):
+                raise ValueError(f"Initial value for ({x},{y}) is not in the grid.")
+            array[x, y] = value
+        return array
+
     def initialize_entities(self, initial_values, width, height, initial_key_name="t_0"):
         entities = {(x,y):{initial_key_name:0} for x in range(width) for y in range(height)}
         if isinstance(initial_values, np.ndarray):
@@ -313,55 +696,139 @@ class Grid(Structure):
             If False, the grid ends are not connected, the grid is treated as a rectangle.
         """
         #TODO remove duplicate connections in case of short side (e.g. 2xN grid)
+        #x runs along the width and y along the height, as in the entities
         connections = []
-        horizontal = [((x, y), (x + 1, y)) for x in range(height - 1) for y in range(width)]
-        vertical = [((x, y), (x, y + 1)) for x in range(height) for y in range(width - 1)]
+        horizontal = [((x, y), (x + 1, y)) for x in range(width - 1) for y in range(height)]
+        vertical = [((x, y), (x, y + 1)) for x in range(width) for y in range(height - 1)]
         
         if periodic_boundary:
-            horizontal += [((height - 1, y), (0, y)) for y in range(width)]
-            vertical += [((x, width - 1), (x, 0)) for x in range(height)]
+            horizontal += [((width - 1, y), (0, y)) for y in range(height)]
+            vertical += [((x, height - 1), (x, 0)) for x in range(width)]
 
         connections += horizontal + vertical
 
         if diagonal_neighbours:
-            diagonal = [((x, y), (x + 1, y + 1)) for x in range(height - 1) for y in range(width - 1)]
-            diagonal += [((x, y), (x + 1, y - 1)) for x in range(height - 1) for y in range(1, width)]
+            diagonal = [((x, y), (x + 1, y + 1)) for x in range(width - 1) for y in range(height - 1)]
+            diagonal += [((x, y), (x + 1, y - 1)) for x in range(width - 1) for y in range(1, height)]
             if periodic_boundary:
-                diagonal += [((x, width - 1), (x + 1, 0)) for x in range(height - 1)]
-                diagonal += [((x, width - 1), (x - 1, 0)) for x in range(1, height)]
-                diagonal += [((height - 1, y), (0, y + 1)) for y in range(width - 1)]
-                diagonal += [((height - 1, y), (0, y - 1)) for y in range(1, width)]
-                diagonal += [((height - 1, width - 1), (0, 0))]
-                diagonal += [((height - 1, 0), (0, width - 1))]
+                diagonal += [((x, height - 1), (x + 1, 0)) for x in range(width - 1)]
+                diagonal += [((x, height - 1), (x - 1, 0)) for x in range(1, width)]
+                diagonal += [((width - 1, y), (0, y + 1)) for y in range(height - 1)]
+                diagonal += [((width - 1, y), (0, y - 1)) for y in range(1, height)]
+                diagonal += [((width - 1, height - 1), (0, 0))]
+                diagonal += [((width - 1, 0), (0, height - 1))]
             connections += diagonal
 
         return connections
 
+    def _component_arrays(self, entities = None, key_name:str=None, only_nonzero: bool = True,
+                          connections_LUT: Dict = None):
+        """
+        The cells of the components as x, y and component label arrays (grouped by label), labeled on the
+            (width, height) array of the states (see components.label_grid).
+        """
+        if connections_LUT is None and only_nonzero and len(self.entities) == self.width * self.height:
+            states = self._component_states(entities, key_name)
+            if states is not None:
+                labels, _ = label_grid(states.reshape(self.width, self.height),
+                                       self.periodic_boundary, self.diagonal_neighbours)
+                xs, ys = np.nonzero(labels)
+                labels = labels[xs, ys] - 1
+                order = np.argsort(labels, kind="stable")
+                return xs[order], ys[order], labels[order]
+        components = super().get_components(entities, key_name, only_nonzero, connections_LUT)
+        if not components:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return components_to_arrays(components)
+
+    def get_components(self, entities = None, key_name:str=None, only_nonzero: bool = True,
+                       connections_LUT: Dict = None) -> List[List[Tuple[int, int]]]:
+        """
+        Connected components of the nonzero cells, as lists of (x, y) cells. They are labeled on the
+            (width, height) array of the states, across the periodic boundary (see components.label_grid),
+            unless connections_LUT is given or entities were added beyond the grid (see Structure.get_components).
+
+        entities: dict of (x, y): value, or an array of the states (in entity index order or (width, height))
+        """
+        xs, ys, labels = self._component_arrays(entities, key_name, only_nonzero, connections_LUT)
+        if not len(labels):
+            return []
+        cells = list(zip(xs.tolist(), ys.tolist()))
+        bounds = [0] + np.cumsum(np.bincount(labels)).tolist()
+        return [cells[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def get_components_labels(self, base_name:str=None, start_timestamp:int = 0, end_timestamp:int = None):
+        """
+        Component labels of the stored timesteps from start_timestamp to end_timestamp in one call, as a
+            (timesteps, width, height) array with the number of components per timestep (see components.label_grid).
+        """
+        if len(self.entities) != self.width * self.height:
+            raise ValueError("The grid entities do not match the array layout of the grid.")
+        base_name = base_name or self.key_name["base_name"]
+        if end_timestamp is None:
+            end_timestamp = self.last_iterations.get(base_name, start_timestamp)
+        if getattr(self, "history", None) is not None and base_name == self.history.base_name:
+            rows = self.history.get_rows(start_timestamp, end_timestamp)
+        else:
+            rows = np.array([self.get_state_array(base_name + str(t))
+                             for t in range(start_timestamp, end_timestamp + 1)]).reshape(-1, len(self.entities))
+        return label_grid(rows.reshape(-1, self.width, self.height), self.periodic_boundary, self.diagonal_neighbours)
+
     def get_components_topology_representation(self, entities = None, key_name:str=None, orientation = False,
-                                               only_nonzero: bool = True):
+                                               only_nonzero: bool = True, connections_LUT: Dict = None):
         """
         Move each component by their center of mass (for simpler comparison of topology),
-            and optionally unify orientation.
+            and optionally unify orientation (the canonical one of the 8 rotations and reflections).
+        Components crossing the periodic boundary are moved back together first
+            (see topology.unwrap_components).
+
+        The components are found on the grid array (see get_components), connections_LUT only
+            for grids with entities beyond the grid.
         """
-        from higherorder.utils.utils import blobs #Lazy import to avoid circular import
+        xs, ys, labels = self._component_arrays(entities, key_name, only_nonzero, connections_LUT)
+        if not len(labels):
+            return []
+        sizes = np.bincount(labels)
+        components = [None] * len(sizes)
         if orientation:
-            raise NotImplementedError("Orientation not implemented yet.")
-        if not entities and not key_name:
-            key_name = "t_0"
-        #if key_name:
-        #    entities = self.get_entities()
-        #    entities = {k: v[key_name] for k, v in entities.items()}
-        components = blobs(structure=self, entities = entities,
-                           connections_LUT = self.get_entities_connections_LUT(),
-                           key_name = key_name, only_nonzero=only_nonzero)
-        for i, component in enumerate(components.copy()):
-            mean_x = np.mean([x for x, y in component])
-            mean_y = np.mean([y for x, y in component])
-            for j, (x, y) in enumerate(component):
-                component[j] = (round(x - mean_x, 7) , round(y - mean_y, 7))
+            cells = [cells for _, cells in canonical_components(xs, ys, labels, self.width, self.height,
+                                                                self.periodic_boundary, orientation=True)]
+        else:
+            xs, ys, _, _ = unwrap_components(xs, ys, labels, self.width, self.height, self.periodic_boundary)
+            bounds = np.cumsum(sizes)[:-1]
+            cells = np.split(np.stack([xs, ys], axis=1), bounds)
+        for i, component in enumerate(cells):
+            mean_x, mean_y = component.mean(axis=0)
+            component = [(round(x - mean_x, 7), round(y - mean_y, 7)) for x, y in component.tolist()]
             components[i] = sorted(component, key=lambda coord: (coord[0], coord[1]))
         return sorted(components, key=lambda comp: (comp[0][0], comp[0][1])) #if x else (float('inf'), float('inf'))
 
+    def get_components_topology_key(self, entities = None, key_name:str=None, orientation = False,
+                                    only_nonzero: bool = True, connections_LUT: Dict = None) -> bytes:
+        """
+        Hashable key of the topology of the states: equal for two states with the same components up
+            to translation (across the periodic boundary), and with orientation, up to rotations and
+            reflections. Independent of the order of the components (see topology.canonical_components).
+        """
+        xs, ys, labels = self._component_arrays(entities, key_name, only_nonzero, connections_LUT)
+        if not len(labels):
+            return b""
+        return topology_key(canonical_components(xs, ys, labels, self.width, self.height,
+                                                 self.periodic_boundary, orientation))
+
+    def get_components_topology_keys(self, states: np.ndarray, orientation = False) -> List[bytes]:
+        """
+        get_components_topology_key of every grid of a (n, width, height) array of states, labeled
+            and put in canonical form together (e.g. the members of an ensemble at one timestep).
+        """
+        states = np.asarray(states).reshape(-1, self.width, self.height)
+        labels, counts = label_grid(states, self.periodic_boundary, self.diagonal_neighbours)
+        frames, xs, ys = np.nonzero(labels)
+        first = np.cumsum(counts) - counts
+        components = canonical_components(xs, ys, first[frames] + labels[frames, xs, ys] - 1, self.width, self.height,
+                                          self.periodic_boundary, orientation) if len(frames) else []
+        return [topology_key(components[start:start + count]) for start, count in zip(first.tolist(), counts.tolist())]
+
     def to_dict(self) -> Dict:
         """
         Convert the grid structure to a dictionary.
@@ -377,8 +844,9 @@ class Grid(Structure):
                 "initial_key_name": self.initial_key_name,
                 "initial_time_step": self.initial_time_step,
                 "last_iterations": self.last_iterations.copy(),
+                "store_mode": self.store_mode,
                 "connections": self.get_connections(),
-                "entities": self.get_entities(),
+                "entities": self.entities.to_dict() if self.history is not None else self.get_entities(),
             },
         }
 
@@ -386,9 +854,13 @@ class Graph(Structure):
     def __init__(self, G: nx.Graph,
                  initial_values : Dict = None,
                  time_step: int = 0, base_name: str = "t_",
+                 store_mode: str = "dict", dtype = None, store_options: Dict = None,
                  ):
         """
         Initialize a graph structure.
+
+        store_mode: "dict" (default), "array" or "sparse", see Structure._setup_store.
+            Entities are ordered as the nodes of G.
         """
         key_name = {"base_name":base_name, "index":time_step}
         initial_key_name = base_name + str(time_step)
@@ -401,6 +873,7 @@ class Graph(Structure):
         self.last_iterations = {base_name:time_step}
         self.entities = entities
         self.connections = list(G.edges())
+        self._setup_store(store_mode, dtype=dtype, store_options=store_options)
 
     def initialize_entities(self, G, initial_values, initial_key_name="t_0"):
         if initial_values:
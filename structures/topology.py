@@ -0,0 +1,170 @@
+import numpy as np
+from typing import List, Tuple
+##topology: integer canonical forms of grid components, for comparing patterns up to translation (and orientation)
+
+#The 8 symmetries of the square (D4) as (swap axes, negate x, negate y), identity first
+D4_TRANSFORMS = [(swap, negate_x, negate_y) for swap in (False, True)
+                 for negate_x in (False, True) for negate_y in (False, True)]
+
+def components_to_arrays(components: List[List[Tuple[int, int]]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Flattens a list of components (lists of (x, y) cells, e.g. from utils.blobs) into
+        x, y and component label arrays.
+    """
+    sizes = [len(component) for component in components]
+    cells = np.array([cell for component in components for cell in component], dtype=np.int64).reshape(-1, 2)
+    labels = np.repeat(np.arange(len(components), dtype=np.int64), sizes)
+    return cells[:, 0], cells[:, 1], labels
+
+def _unwrap_axis(coords: np.ndarray, labels: np.ndarray, num_labels: int, size: int, periodic: bool):
+    """
+    Coordinates along one axis relative to the start of each component, and whether the component
+        covers the whole (periodic) axis, in which case the coordinates stay modulo size.
+
+    The cells of a connected component occupy a contiguous arc of a periodic axis, so unless the arc
+        is the whole axis, the component starts right after its single gap.
+    """
+    if not periodic:
+        start = np.full(num_labels, np.iinfo(np.int64).max)
+        np.minimum.at(start, labels, coords)
+        return coords - start[labels], np.zeros(num_labels, dtype=bool)
+    occupied = np.zeros((num_labels, size), dtype=bool)
+    occupied[labels, coords] = True
+    full = occupied.all(axis=1)
+    start = np.argmax(occupied & ~np.roll(occupied, 1, axis=1), axis=1)
+    start[full] = 0
+    return (coords - start[labels]) % size, full
+
+def unwrap_components(xs: np.ndarray, ys: np.ndarray, labels: np.ndarray,
+                      width: int, height: int, periodic_boundary: bool = True):
+    """
+    Translates every component so that it starts at (0, 0) without crossing the periodic boundary.
+
+    Returns the unwrapped x and y, and per component whether it covers the whole width or height
+        (a component wrapping around the grid), where coordinates are kept modulo width or height.
+    """
+    num_labels = int(labels.max()) + 1 if len(labels) else 0
+    xs, full_x = _unwrap_axis(np.asarray(xs), labels, num_labels, width, periodic_boundary)
+    ys, full_y = _unwrap_axis(np.asarray(ys), labels, num_labels, height, periodic_boundary)
+    return xs, ys, full_x, full_y
+
+def _transform(xs, ys, transform, sizes=(None, None)):
+    """Applies a D4 transform; negation is taken modulo the size of an axis if given (wrapping components)."""
+    swap, negate_x, negate_y = transform
+    if swap:
+        xs, ys = ys, xs
+        sizes = sizes[::-1]
+    if negate_x:
+        xs = -xs if sizes[0] is None else (-xs) % sizes[0]
+    if negate_y:
+        ys = -ys if sizes[1] is None else (-ys) % sizes[1]
+    return xs, ys, sizes
+
+def _encode(xs: np.ndarray, ys: np.ndarray, sizes=(None, None)) -> bytes:
+    """Key of cells that start at (0, 0): extents (or sizes of wrapped axes), then the sorted cell codes."""
+    extent_x = int(xs.max()) + 1
+    extent_y = int(ys.max()) + 1 if sizes[1] is None else sizes[1]
+    header = [extent_x if sizes[0] is None else -sizes[0], extent_y if sizes[1] is None else -sizes[1]]
+    codes = np.sort(xs * extent_y + ys)
+    return np.concatenate([header, codes]).astype(np.int32).tobytes()
+
+def _wrapped_component_key(xs, ys, full, sizes, orientation) -> Tuple[bytes, np.ndarray]:
+    """
+    Canonical key of a component that covers a whole periodic axis: the minimum over the allowed
+        transforms and the translations along the covered axes. Only translations to the rows/columns
+        with the fewest cells are tried, which are the same for any translation of the component.
+    """
+    best = None
+    for transform in (D4_TRANSFORMS if orientation else D4_TRANSFORMS[:1]):
+        axis_sizes = tuple(size if is_full else None for size, is_full in zip(sizes, full))
+        tx, ty, axis_sizes = _transform(xs, ys, transform, axis_sizes)
+        shifts = []
+        for coords, size in ((tx, axis_sizes[0]), (ty, axis_sizes[1])):
+            if size is None:
+                shifts.append([int(coords.min())])
+            else:
+                counts = np.bincount(coords, minlength=size)
+                shifts.append(np.flatnonzero(counts == counts.min()).tolist())
+        for shift_x in shifts[0]:
+            for shift_y in shifts[1]:
+                sx = tx - shift_x if axis_sizes[0] is None else (tx - shift_x) % axis_sizes[0]
+                sy = ty - shift_y if axis_sizes[1] is None else (ty - shift_y) % axis_sizes[1]
+                key = _encode(sx, sy, axis_sizes)
+                if best is None or key < best[0]:
+                    best = (key, np.stack([sx, sy], axis=1))
+    return best
+
+def canonical_components(xs: np.ndarray, ys: np.ndarray, labels: np.ndarray,
+                         width: int, height: int, periodic_boundary: bool = True,
+                         orientation: bool = False) -> List[Tuple[bytes, np.ndarray]]:
+    """
+    Canonical form of every component (cells with the same label): translated to start at (0, 0),
+        across the periodic boundary, and if orientation, the smallest of its 8 rotations and reflections.
+
+    Returns a (key, cells) pair per label, where key is a bytes key that is equal for two components
+        exactly when they have the same canonical form, and cells is the (n, 2) array of canonical cells.
+    """
+    xs, ys, full_x, full_y = unwrap_components(xs, ys, labels, width, height, periodic_boundary)
+    num_labels = len(full_x)
+    order = np.argsort(labels, kind="stable")
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=num_labels))])
+    xs, ys, labels = xs[order], ys[order], labels[order]
+
+    #Bulk: every transform of all (non wrapping) components at once, shifted to start at (0, 0)
+    transformed = []
+    for transform in (D4_TRANSFORMS if orientation else D4_TRANSFORMS[:1]):
+        tx, ty, _ = _transform(xs, ys, transform)
+        min_x = np.full(num_labels, np.iinfo(np.int64).max)
+        min_y = np.full(num_labels, np.iinfo(np.int64).max)
+        np.minimum.at(min_x, labels, tx)
+        np.minimum.at(min_y, labels, ty)
+        transformed.append((tx - min_x[labels], ty - min_y[labels]))
+
+    if not orientation:
+        #Translations only: the keys of all (non wrapping) components packed at once, as _encode of each
+        tx, ty = transformed[0]
+        extent_x = np.zeros(num_labels, dtype=np.int64)
+        extent_y = np.zeros(num_labels, dtype=np.int64)
+        np.maximum.at(extent_x, labels, tx + 1)
+        np.maximum.at(extent_y, labels, ty + 1)
+        codes = tx * extent_y[labels] + ty
+        starts = bounds[:-1] + 2 * np.arange(num_labels)
+        ends = bounds[1:] + 2 * np.arange(1, num_labels + 1)
+        packed = np.empty(len(xs) + 2 * num_labels, dtype=np.int32)
+        packed[starts] = extent_x
+        packed[starts + 1] = extent_y
+        packed[np.arange(len(xs)) + 2 * (labels + 1)] = codes[np.lexsort((codes, labels))]
+        packed = packed.tobytes()
+        cells = np.stack([tx, ty], axis=1)
+        components = []
+        for label in range(num_labels):
+            start, end = bounds[label], bounds[label + 1]
+            if full_x[label] or full_y[label]:
+                components.append(_wrapped_component_key(xs[start:end], ys[start:end],
+                                                         (full_x[label], full_y[label]), (width, height), orientation))
+            else:
+                components.append((packed[4 * starts[label]:4 * ends[label]], cells[start:end]))
+        return components
+
+    components = []
+    for label in range(num_labels):
+        start, end = bounds[label], bounds[label + 1]
+        if full_x[label] or full_y[label]:
+            components.append(_wrapped_component_key(xs[start:end], ys[start:end],
+                                                     (full_x[label], full_y[label]), (width, height), orientation))
+            continue
+        best = None
+        for tx, ty in transformed:
+            key = _encode(tx[start:end], ty[start:end])
+            if best is None or key < best[0]:
+                best = (key, (tx[start:end], ty[start:end]))
+        components.append((best[0], np.stack(best[1], axis=1)))
+    return components
+
+def topology_key(components: List[Tuple[bytes, np.ndarray]]) -> bytes:
+    """
+    Hashable key of a state from the canonical forms of its components (canonical_components),
+        independent of the order of the components.
+    """
+    keys = sorted(key for key, _ in components)
+    return b"".join(np.int32(len(key)).tobytes() + key for key in keys)
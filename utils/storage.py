@@ -0,0 +1,507 @@
+import json
+import zlib
+import struct
+import numpy as np
+import networkx as nx
+from collections.abc import Sequence
+from typing import Dict, List, Callable, Any
+from higherorder.structures.structures import Structure, Grid, Graph
+##run files: simulation runs (states and impacts) in a chunked binary file, read memory-mapped
+
+RUN_FILE_MAGIC = b"HORUNS01"
+RUN_FILE_COMPRESSIONS = (None, "zlib")
+_TRAILER = struct.Struct("<QQ8s") #index offset, index length, magic
+
+def _to_json(value):
+    """Entities (tuples, NumPy scalars) as JSON values."""
+    if isinstance(value, (tuple, list)):
+        return [_to_json(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def _from_json(value):
+    if isinstance(value, list):
+        return tuple(_from_json(v) for v in value)
+    return value
+
+def _little_endian(array: np.ndarray) -> np.ndarray:
+    return np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<"))
+
+def structure_header(structure: Structure) -> Dict:
+    """
+    The topology parameters of a structure for the header of a run: the grid dimensions and boundary,
+        and for other structures (or grids with entities beyond the grid) the entities and the connections
+        as pairs of entity indices.
+    """
+    header = {"structure_type": type(structure).__name__}
+    if isinstance(structure, Grid):
+        header.update(width=structure.width, height=structure.height,
+                      periodic_boundary=structure.periodic_boundary,
+                      diagonal_neighbours=structure.diagonal_neighbours)
+        if len(structure.entities) == structure.width * structure.height:
+            return header
+    entity_list = structure.get_entity_list()
+    entity_index = structure.get_entity_index()
+    header["entities"] = [_to_json(entity) for entity in entity_list]
+    header["connections"] = [[entity_index[a], entity_index[b]] for a, b in structure.connections]
+    return header
+
+def rule_name(rule_function: Callable) -> str | None:
+    """The name of a rule function (e.g. "game_of_life", or the rule string of a LifeLikeRule)."""
+    if rule_function is None or isinstance(rule_function, str):
+        return rule_function
+    return getattr(rule_function, "__name__", repr(rule_function))
+
+class RunWriter:
+    """
+    Writes simulation runs to a run file, read back with RunReader.
+
+    A run is a header (topology parameters of the structure, the rule, the seed and metadata), the states
+        of its timesteps as (timesteps x entities) chunks of chunk_steps rows, and its impacts as chunks of
+        (times, per timestep offsets, source ids, target ids, type codes) arrays. Chunks are raw little-endian
+        arrays (read memory-mapped without copies) or zlib compressed (compression="zlib").
+
+    File layout: magic, the chunks of all runs, the index (JSON: the headers and the chunk offsets of the runs),
+        and a trailer with the offset and length of the index. Many runs go in one file: add_run writes a
+        whole run, begin_run / append_states / append_impacts / end_run write one incrementally.
+    """
+    def __init__(self, path: str, compression: str = None, chunk_steps: int = 256,
+                 compression_level: int = 6):
+        if compression not in RUN_FILE_COMPRESSIONS:
+            raise ValueError(f"compression must be one of {RUN_FILE_COMPRESSIONS}, not {compression}")
+        if chunk_steps < 1:
+            raise ValueError(f"chunk_steps must be positive, not {chunk_steps}")
+        self.path = path
+        self.compression = compression
+        self.compression_level = compression_level
+        self.chunk_steps = chunk_steps
+        self.runs = []
+        self._pending = {} #run: ([state rows], [(time, sources, targets, codes)])
+        self._file = open(path, "wb")
+        self._file.write(RUN_FILE_MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _write_chunk(self, arrays: List[np.ndarray]) -> List[int]:
+        """Writes arrays as one chunk, returns its [offset, length in bytes]."""
+        data = b"".join(_little_endian(array).tobytes() for array in arrays)
+        if self.compression == "zlib":
+            data = zlib.compress(data, self.compression_level)
+        offset = self._file.tell()
+        self._file.write(data)
+        #Raw chunks start at multiples of 8 bytes, so the arrays read from them are aligned
+        self._file.write(b"\0" * (-self._file.tell() % 8))
+        return [offset, len(data)]
+
+    def begin_run(self, structure: Structure = None, entity_list: List = None,
+                  rule: Callable | str = None, seed: int = None,
+                  initial_time_step: int = 0, base_name: str = "t_", dtype = None,
+                  impact_types: List[str] = None, metadata: Dict = None) -> int:
+        """
+        Starts a run and returns its index. The entities are those of the structure (in entity index order),
+            or entity_list if there is no structure. dtype is set by the first states if None.
+        """
+        if structure is not None:
+            topology = structure_header(structure)
+            num_entities = len(structure.get_entity_list())
+        elif entity_list is not None:
+            topology = {"structure_type": None, "entities": [_to_json(entity) for entity in entity_list]}
+            num_entities = len(entity_list)
+        else:
+            raise ValueError("A run needs a structure or an entity list.")
+        if impact_types is None:
+            from higherorder.dynamics.impacts import IMPACT_TYPES #Lazy import, dynamics imports utils
+            impact_types = IMPACT_TYPES
+        header = {
+            "structure": topology,
+            "num_entities": num_entities,
+            "rule": rule_name(rule),
+            "seed": _to_json(seed),
+            "initial_time_step": initial_time_step,
+            "base_name": base_name,
+            "metadata": _to_json(metadata or {}),
+            "compression": self.compression,
+            "states": {"dtype": None if dtype is None else np.dtype(dtype).newbyteorder("<").str,
+                       "chunks": []}, #[first timestep, timesteps, offset, length]
+            "impacts": {"id_dtype": "<u4" if num_entities < 2 ** 32 else "<i8",
+                        "types": list(impact_types),
+                        "chunks": []}, #[first time, last time, timesteps, impacts, offset, length]
+        }
+        self.runs.append(header)
+        self._pending[len(self.runs) - 1] = ([], [])
+        return len(self.runs) - 1
+
+    def _flush_states(self, run: int):
+        header, rows = self.runs[run]["states"], self._pending[run][0]
+        if not rows:
+            return
+        chunk = np.stack(rows).astype(header["dtype"])
+        chunks = header["chunks"]
+        first = chunks[-1][0] + chunks[-1][1] if chunks else self.runs[run]["initial_time_step"]
+        chunks.append([first, len(chunk)] + self._write_chunk([chunk]))
+        rows.clear()
+
+    def _flush_impacts(self, run: int):
+        header, steps = self.runs[run]["impacts"], self._pending[run][1]
+        if not steps:
+            return
+        id_dtype = np.dtype(header["id_dtype"])
+        times = np.array([time for time, _, _, _ in steps], dtype=np.int64)
+        indptr = np.concatenate([[0], np.cumsum([len(codes) for _, _, _, codes in steps])]).astype(np.int64)
+        sources = np.concatenate([sources for _, sources, _, _ in steps]).astype(id_dtype)
+        targets = np.concatenate([targets for _, _, targets, _ in steps]).astype(id_dtype)
+        codes = np.concatenate([codes for _, _, _, codes in steps]).astype(np.uint8)
+        header["chunks"].append([int(times[0]), int(times[-1]), len(steps), int(indptr[-1])]
+                                + self._write_chunk([times, indptr, sources, targets, codes]))
+        steps.clear()
+
+    def append_states(self, run: int, states: np.ndarray):
+        """Appends the states of the next timestep (1D, entity index order) or of several ((timesteps x entities))."""
+        states = np.asarray(states)
+        rows = states.reshape(-1, self.runs[run]["num_entities"])
+        header = self.runs[run]["states"]
+        if header["dtype"] is None:
+            header["dtype"] = rows.dtype.newbyteorder("<").str
+        pending = self._pending[run][0]
+        for row in rows:
+            pending.append(row)
+            if len(pending) == self.chunk_steps:
+                self._flush_states(run)
+
+    def append_impacts(self, run: int, time: int, sources: np.ndarray, targets: np.ndarray, codes: np.ndarray):
+        """
+        Appends the impacts of a timestep (as ImpactLog.step_arrays: entity ids and codes of the impact
+            types of the run), in increasing order of time.
+        """
+        sources, targets = np.asarray(sources, dtype=np.int64), np.asarray(targets, dtype=np.int64)
+        if self.runs[run]["impacts"]["id_dtype"] == "<u4" and len(sources) and max(sources.max(), targets.max()) >= 2 ** 32:
+            raise ValueError("Entity ids of the impacts do not fit the ids of the run.")
+        pending = self._pending[run][1]
+        pending.append((int(time), sources, targets, np.asarray(codes, dtype=np.uint8)))
+        if len(pending) == self.chunk_steps:
+            self._flush_impacts(run)
+
+    def append_impact_log(self, run: int, impact):
+        """Appends the impacts of all timesteps of an ImpactLog (or of the dict format of Model.impact)."""
+        from higherorder.dynamics.impacts import ImpactLog #Lazy import, dynamics imports utils
+        log = ImpactLog.from_dict(impact)
+        header = self.runs[run]
+        header["impacts"]["types"] = list(log.impact_types)
+        if len(log.entity_list) > header["num_entities"]:
+            header["impact_entities"] = [_to_json(entity) for entity in log.entity_list[header["num_entities"]:]]
+        for key_name in sorted(log, key=log.time):
+            self.append_impacts(run, log.time(key_name), *log.step_arrays(key_name))
+
+    def end_run(self, run: int, metadata: Dict = None):
+        """Writes the remaining states and impacts of a run, and adds to its metadata."""
+        self._flush_states(run)
+        self._flush_impacts(run)
+        if metadata:
+            self.runs[run]["metadata"].update(_to_json(metadata))
+        del self._pending[run]
+
+    def add_run(self, states: np.ndarray, structure: Structure = None, impact = None,
+                entity_list: List = None, rule: Callable | str = None, seed: int = None,
+                initial_time_step: int = 0, base_name: str = "t_", metadata: Dict = None) -> int:
+        """Writes a whole run: the (timesteps x entities) states from initial_time_step, and the impacts (if any)."""
+        states = np.asarray(states)
+        run = self.begin_run(structure, entity_list, rule, seed, initial_time_step, base_name,
+                             dtype=states.dtype, metadata=metadata)
+        self.append_states(run, states)
+        if impact is not None:
+            self.append_impact_log(run, impact)
+        self.end_run(run)
+        return run
+
+    def add_model(self, model, seed: int = None, metadata: Dict = None) -> int:
+        """Writes the stored states and impacts of a Model, with its outcome (has_ended, period, ...) as metadata."""
+        from higherorder.dynamics.runner import structure_states_array #Lazy import, dynamics imports utils
+        outcome = {name: getattr(model, name, None)
+                   for name in ("has_ended", "last_simulation_step", "period", "transient")}
+        return self.add_run(structure_states_array(model.structure, model.base_name, model.initial_time_step),
+                            structure=model.structure, impact=model.impact if len(model.impact) else None,
+                            rule=model.dynamics_func, seed=seed, initial_time_step=model.initial_time_step,
+                            base_name=model.base_name, metadata={**outcome, **(metadata or {})})
+
+    def add_result(self, result, structure: Structure = None, rule: Callable | str = None,
+                   seed: int = None, metadata: Dict = None) -> int:
+        """Writes a RunResult (of dynamics.runner), with the structure it was run on if given."""
+        outcome = {"has_ended": result.has_ended, "last_simulation_step": result.last_simulation_step}
+        return self.add_run(result.states, structure=structure, impact=result.impact,
+                            entity_list=result.entity_list, rule=rule, seed=seed,
+                            initial_time_step=result.initial_time_step, base_name=result.base_name,
+                            metadata={**outcome, **(metadata or {})})
+
+    def close(self):
+        """Writes the pending chunks of unfinished runs and the index."""
+        if self._file.closed:
+            return
+        for run in list(self._pending):
+            self.end_run(run)
+        index = json.dumps({"version": 1, "runs": self.runs}).encode("utf-8")
+        offset = self._file.tell()
+        self._file.write(index)
+        self._file.write(_TRAILER.pack(offset, len(index), RUN_FILE_MAGIC))
+        self._file.close()
+
+class RunReader(Sequence):
+    """
+    The runs of a run file (see RunWriter), opened memory-mapped: only the index is read on opening,
+        and every RunView reads the chunks of the timesteps and entities asked for.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        if len(self._buffer) < len(RUN_FILE_MAGIC) + _TRAILER.size or bytes(self._buffer[:len(RUN_FILE_MAGIC)]) != RUN_FILE_MAGIC:
+            raise ValueError(f"{path} is not a run file.")
+        offset, length, magic = _TRAILER.unpack(bytes(self._buffer[-_TRAILER.size:]))
+        if magic != RUN_FILE_MAGIC:
+            raise ValueError(f"{path} is not a complete run file (the writer was not closed).")
+        index = json.loads(bytes(self._buffer[offset:offset + length]).decode("utf-8"))
+        self.runs = [RunView(self, i, header) for i, header in enumerate(index["runs"])]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __getitem__(self, i):
+        return self.runs[i]
+
+    def __len__(self):
+        return len(self.runs)
+
+    def _read(self, offset: int, length: int, compression: str = None) -> np.ndarray:
+        """The bytes of a chunk (a view of the file if not compressed)."""
+        data = self._buffer[offset:offset + length]
+        if compression == "zlib":
+            return np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+        return data
+
+    def close(self):
+        mmap = getattr(self._buffer, "_mmap", None)
+        self._buffer = None
+        if mmap is not None:
+            try:
+                mmap.close()
+            except BufferError: #Arrays read from the file still use it, it is closed when they are freed
+                pass
+
+class RunView:
+    """
+    One run of a run file: its header (structure, rule, seed, metadata) and readers of its states and impacts
+        over a range of timesteps (start to end, both included) or of single entities.
+    """
+    def __init__(self, reader: RunReader, index: int, header: Dict):
+        self.reader = reader
+        self.index = index
+        self.header = header
+        self.structure = header["structure"]
+        self.rule = header["rule"]
+        self.seed = header["seed"]
+        self.metadata = header["metadata"]
+        self.initial_time_step = header["initial_time_step"]
+        self.base_name = header["base_name"]
+        self.num_entities = header["num_entities"]
+        self.dtype = np.dtype(header["states"]["dtype"] or np.uint8)
+        self._state_chunks = np.array(header["states"]["chunks"], dtype=np.int64).reshape(-1, 4)
+        self._impact_chunks = np.array(header["impacts"]["chunks"], dtype=np.int64).reshape(-1, 6)
+        self._entity_list = None
+        self._entity_index = None
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.index}, rule={self.rule}, seed={self.seed}, {self.num_steps} timesteps)"
+
+    @property
+    def num_steps(self) -> int:
+        return int(self._state_chunks[:, 1].sum())
+
+    @property
+    def last_time_step(self) -> int:
+        return self.initial_time_step + self.num_steps - 1
+
+    def get_entity_list(self) -> List:
+        """The entities in index order (columns of the states)."""
+        if self._entity_list is None:
+            structure = self.structure
+            if "entities" in structure:
+                entity_list = [_from_json(entity) for entity in structure["entities"]]
+            else:
+                entity_list = [(x, y) for x in range(structure["width"]) for y in range(structure["height"])]
+            self._entity_list = entity_list
+            self._entity_index = {entity: i for i, entity in enumerate(entity_list)}
+        return self._entity_list
+
+    def get_entity_index(self) -> Dict:
+        self.get_entity_list()
+        return self._entity_index
+
+    @staticmethod
+    def _chunk_range(firsts: np.ndarray, lasts: np.ndarray, start: int, end: int) -> range:
+        """The chunks holding timesteps from start to end, from the first and last timestep of every chunk."""
+        return range(int(np.searchsorted(lasts, start)), int(np.searchsorted(firsts, end, side="right")))
+
+    def _state_chunk(self, i: int) -> np.ndarray:
+        first, steps, offset, length = self._state_chunks[i].tolist()
+        data = self.reader._read(offset, length, self.header["compression"])
+        return data[:steps * self.num_entities * self.dtype.itemsize].view(self.dtype).reshape(steps, self.num_entities)
+
+    def _time_range(self, start: int = None, end: int = None):
+        start = self.initial_time_step if start is None else max(start, self.initial_time_step)
+        end = self.last_time_step if end is None else min(end, self.last_time_step)
+        return start, end
+
+    def states(self, start: int = None, end: int = None, entities: List | np.ndarray = None) -> np.ndarray:
+        """
+        The (timesteps x entities) states from start to end (default: all stored timesteps), of all entities
+            or of the given entities (or entity indices). Only the chunks of the range are read.
+        """
+        start, end = self._time_range(start, end)
+        columns = None
+        if entities is not None:
+            entity_index = self.get_entity_index()
+            #Entities, or entity indices for values that are not entities
+            columns = np.array([entity_index.get(entity, entity) for entity in entities], dtype=np.int64)
+        parts = []
+        firsts = self._state_chunks[:, 0]
+        for i in self._chunk_range(firsts, firsts + self._state_chunks[:, 1] - 1, start, end):
+            first = int(self._state_chunks[i, 0])
+            chunk = self._state_chunk(i)[max(start - first, 0):end - first + 1]
+            parts.append(chunk if columns is None else chunk[:, columns])
+        if not parts:
+            return np.zeros((0, self.num_entities if columns is None else len(columns)), dtype=self.dtype)
+        return np.concatenate(parts)
+
+    def entity_states(self, entity, start: int = None, end: int = None) -> np.ndarray:
+        """The states of one entity (or entity index) from start to end."""
+        return self.states(start, end, [entity])[:, 0]
+
+    def state_array(self, t: int) -> np.ndarray:
+        """The states of timestep t in entity index order (as Structure.get_state_array)."""
+        if not self.initial_time_step <= t <= self.last_time_step:
+            return np.zeros(self.num_entities, dtype=self.dtype)
+        return self.states(t, t)[0]
+
+    def _impact_chunk(self, i: int) -> List[np.ndarray]:
+        """The (times, offsets of every timestep, source ids, target ids, codes) arrays of an impact chunk."""
+        _, _, steps, count, offset, length = self._impact_chunks[i].tolist()
+        id_dtype = np.dtype(self.header["impacts"]["id_dtype"])
+        data = self.reader._read(offset, length, self.header["compression"])
+        dtypes = [np.dtype("<i8"), np.dtype("<i8"), id_dtype, id_dtype, np.dtype(np.uint8)]
+        bounds = np.cumsum([0] + [dtype.itemsize * size for dtype, size in zip(dtypes, [steps, steps + 1, count, count, count])])
+        return [data[a:b].view(dtype) for a, b, dtype in zip(bounds[:-1].tolist(), bounds[1:].tolist(), dtypes)]
+
+    def _impact_steps(self, start: int = None, end: int = None):
+        """Per impact chunk in the time range: the arrays of its timesteps from start to end (see _impact_chunk)."""
+        chunks = self._impact_chunks
+        if not len(chunks):
+            return
+        start = int(chunks[0, 0]) if start is None else start
+        end = int(chunks[-1, 1]) if end is None else end
+        for i in self._chunk_range(chunks[:, 0], chunks[:, 1], start, end):
+            times, indptr, sources, targets, codes = self._impact_chunk(i)
+            a, b = np.searchsorted(times, start), np.searchsorted(times, end, side="right")
+            rows = slice(indptr[a], indptr[b])
+            yield times[a:b], indptr[a:b + 1] - indptr[a], sources[rows], targets[rows], codes[rows]
+
+    def impact_columns(self, start: int = None, end: int = None) -> Dict[str, np.ndarray]:
+        """
+        The impacts from time start to end as "time", "source", "target" and "code" arrays
+            (as ImpactLog.columns; codes index header["impacts"]["types"]).
+        """
+        columns = {"time": [np.zeros(0, dtype=np.int64)], "source": [np.zeros(0, dtype=np.int64)],
+                   "target": [np.zeros(0, dtype=np.int64)], "code": [np.zeros(0, dtype=np.uint8)]}
+        for times, indptr, sources, targets, codes in self._impact_steps(start, end):
+            columns["time"].append(np.repeat(times, np.diff(indptr)))
+            columns["source"].append(sources.astype(np.int64))
+            columns["target"].append(targets.astype(np.int64))
+            columns["code"].append(np.array(codes))
+        return {name: np.concatenate(parts) for name, parts in columns.items()}
+
+    def impact_log(self, start: int = None, end: int = None):
+        """The impacts from time start to end as an ImpactLog (timesteps stored without impacts are kept)."""
+        from higherorder.dynamics.impacts import ImpactLog #Lazy import, dynamics imports utils
+        entity_list = self.get_entity_list() + [_from_json(entity) for entity in self.header.get("impact_entities", [])]
+        log = ImpactLog(entity_list, self.base_name)
+        log.impact_types = list(self.header["impacts"]["types"])
+        log.impact_codes = {name: code for code, name in enumerate(log.impact_types)}
+        for times, indptr, sources, targets, codes in self._impact_steps(start, end):
+            sources, targets = sources.astype(np.int64), targets.astype(np.int64)
+            for j, t in enumerate(times.tolist()):
+                rows = slice(indptr[j], indptr[j + 1])
+                log.append(self.base_name + str(t), sources[rows], targets[rows], np.array(codes[rows]))
+        return log
+
+    def rule_function(self) -> Callable | None:
+        """The rule function of the run from its name: game_of_life or a Life-like rule string, otherwise None."""
+        from higherorder.dynamics import rules #Lazy import, dynamics imports utils
+        if self.rule is None:
+            return None
+        function = getattr(rules, self.rule, None)
+        if callable(function):
+            return function
+        try:
+            return rules.LifeLikeRule(self.rule)
+        except ValueError:
+            return None
+
+    def to_structure(self, store_mode: str = "array", start: int = None, end: int = None) -> Structure:
+        """
+        Rebuilds the structure of the run with its states from start to end (the first one as initial values).
+        """
+        structure = self.structure
+        states = self.states(start, end)
+        start = self._time_range(start, end)[0]
+        entity_list = self.get_entity_list()
+        initial = states[0] if len(states) else np.zeros(self.num_entities, dtype=self.dtype)
+        if structure["structure_type"] == "Grid" and "entities" not in structure:
+            result = Grid(initial.reshape(structure["width"], structure["height"]),
+                          width=structure["width"], height=structure["height"],
+                          periodic_boundary=structure["periodic_boundary"],
+                          diagonal_neighbours=structure["diagonal_neighbours"],
+                          time_step=start, base_name=self.base_name, store_mode=store_mode, dtype=self.dtype)
+        elif "connections" in structure:
+            G = nx.Graph()
+            G.add_nodes_from(entity_list)
+            G.add_edges_from((entity_list[a], entity_list[b]) for a, b in structure["connections"])
+            result = Graph(G, initial_values={entity: value for entity, value in zip(entity_list, initial.tolist()) if value},
+                           time_step=start, base_name=self.base_name, store_mode=store_mode, dtype=self.dtype)
+        else:
+            raise NotImplementedError(f"The run has no topology to rebuild a structure from ({structure['structure_type']}).")
+        for t, row in enumerate(states[1:], start + 1):
+            result.set_time_slice(np.array(row), self.base_name + str(t))
+        result.last_iterations[self.base_name] = start + max(len(states) - 1, 0)
+        return result
+
+    def to_result(self):
+        """The run as a RunResult of dynamics.runner (states loaded, impacts as an ImpactLog if any)."""
+        from higherorder.dynamics.runner import RunResult #Lazy import, dynamics imports utils
+        return RunResult(self.index, self.metadata.get("has_ended"), self.metadata.get("last_simulation_step"),
+                         entity_list=self.get_entity_list(), states=np.array(self.states()),
+                         initial_time_step=self.initial_time_step, base_name=self.base_name,
+                         impact=self.impact_log() if len(self._impact_chunks) else None)
+
+def save_runs(path: str, runs: List, seeds: List[int] = None, structures: List[Structure] = None,
+              rule: Callable | str = None, compression: str = None, chunk_steps: int = 256) -> str:
+    """
+    Writes Models or RunResults (of dynamics.runner, with their structures if given) to a run file.
+    """
+    with RunWriter(path, compression=compression, chunk_steps=chunk_steps) as writer:
+        for i, run in enumerate(runs):
+            seed = seeds[i] if seeds is not None else None
+            if hasattr(run, "structure") and hasattr(run, "dynamics_func"):
+                writer.add_model(run, seed=seed)
+            else:
+                writer.add_result(run, structure=structures[i] if structures is not None else None,
+                                  rule=rule, seed=seed)
+    return path
+
+def load_runs(path: str) -> RunReader:
+    """Opens a run file, see RunReader."""
+    return RunReader(path)
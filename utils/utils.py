@@ -3,6 +3,7 @@ import numpy as np
 import json
 import datetime
 from higherorder.structures.structures import Structure, Grid, Graph
+from higherorder.structures.history import EntitiesView
 #if TYPE_CHECKING:
 #    from higherorder.structures.structures import Structure, Grid, Graph
 
@@ -50,24 +51,196 @@ def save_init_grids(grids: List[Grid],
     with open(filename, 'w') as f:
         json.dump(grids_dict, f, indent=4)
 
+def _parse_number(text: str):
+    text = text.strip()
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        return text.strip("'\"")
+
+def parse_entity_key(key: str):
+    """
+    The entity of a key written as str(entity) (e.g. by save_init_grids): a tuple of numbers for "(5, 14)",
+        a number for "3", otherwise the string itself. Parsed directly, without eval.
+    """
+    text = key.strip()
+    if text.startswith("(") and text.endswith(")"):
+        parts = text[1:-1].split(",")
+        if len(parts) > 1 and not parts[-1].strip(): #one-element tuple, "(5,)"
+            parts = parts[:-1]
+        return tuple(_parse_number(part) for part in parts) if text[1:-1].strip() else ()
+    return _parse_number(text)
+
+def _entity_keys_hook(pairs: List[Tuple[str, Any]]) -> Dict:
+    return {parse_entity_key(key): value for key, value in pairs}
+
+def iter_init_grid_dicts(filename, chunk_size: int = 1 << 16):
+    """
+    Streams the grids of a save_init_grids file one at a time, as (name, {(x, y): value}) pairs,
+        reading the file in chunks instead of loading it whole.
+    """
+    decoder = json.JSONDecoder(object_pairs_hook=_entity_keys_hook)
+    key_decoder = json.JSONDecoder()
+    with open(filename, 'r') as f:
+        buffer, position, at_end = "", 0, False
+
+        def skip(position):
+            nonlocal buffer, at_end
+            while True:
+                while position < len(buffer) and buffer[position] in " \t\n\r":
+                    position += 1
+                if position < len(buffer) or at_end:
+                    return position
+                buffer, position = buffer[position:] + f.read(chunk_size), 0
+                at_end = at_end or len(buffer) == 0
+
+        def decode(decoder, position):
+            """A JSON value from position, reading more of the file until it is complete."""
+            nonlocal buffer, at_end
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, position)
+                    if end < len(buffer) or at_end: #a number could go on in the next chunk
+                        return value, end
+                except json.JSONDecodeError:
+                    if at_end:
+                        raise
+                data = f.read(chunk_size)
+                at_end = not data
+                buffer, position = buffer[position:] + data, 0
+
+        position = skip(0)
+        if buffer[position:position + 1] != "{":
+            raise ValueError(f"{filename} is not a JSON object of grids.")
+        position += 1
+        while True:
+            position = skip(position)
+            if position >= len(buffer):
+                raise ValueError(f"{filename} ends before the JSON object of grids is closed.")
+            if buffer[position] == "}":
+                return
+            if buffer[position] == ",":
+                position = skip(position + 1)
+            name, position = decode(key_decoder, position)
+            position = skip(position)
+            if buffer[position:position + 1] != ":":
+                raise ValueError(f"Expected ':' after grid {name} in {filename}.")
+            grid, position = decode(decoder, skip(position + 1))
+            yield name, grid
+
 def load_init_grid_dicts(filename,
                          listify = True):
+    """
+    The grids of a save_init_grids file, as a list of {(x, y): value} dicts (or a dict by grid name).
+    """
     #TODO grid_format, etc.
-    with open(filename, 'r') as f:
-        grids_dict = json.load(f)
-
-    for i, grid in grids_dict.items():
-        grids_dict[i] = {eval(k): v for k, v in grid.items()}
+    grids_dict = dict(iter_init_grid_dicts(filename))
     if listify:
         return [grid for grid in grids_dict.values()]
     return grids_dict
 
-def dict_to_array(entities: Dict, width = None, height = None) -> np.ndarray:
+class InitGridArchive:
+    """
+    Initial grids as coordinate arrays plus offsets (see save_init_grid_archive): the cells of grid i are
+        xs[offsets[i]:offsets[i+1]] (and ys, values), so grids are read without per-cell dicts or parsing.
+    """
+    def __init__(self, xs: np.ndarray, ys: np.ndarray, values: np.ndarray, offsets: np.ndarray,
+                 names: List[str] = None, width: int = None, height: int = None):
+        self.xs = xs
+        self.ys = ys
+        self.values = values
+        self.offsets = offsets
+        self.names = list(names) if names is not None else [str(i) for i in range(len(offsets) - 1)]
+        self.width = width or (int(xs.max()) + 1 if len(xs) else 0)
+        self.height = height or (int(ys.max()) + 1 if len(ys) else 0)
+
+    @classmethod
+    def load(cls, filename) -> "InitGridArchive":
+        with np.load(filename) as archive:
+            shape = archive["shape"].tolist()
+            return cls(archive["xs"], archive["ys"], archive["values"], archive["offsets"],
+                       archive["names"].tolist(), *shape)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def coordinates(self, i: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """The (xs, ys, values) arrays of grid i."""
+        cells = slice(self.offsets[i], self.offsets[i + 1])
+        return self.xs[cells], self.ys[cells], self.values[cells]
+
+    def __getitem__(self, i: int) -> Dict:
+        """Grid i as a dict of (x, y): value, the format of load_init_grid_dicts."""
+        xs, ys, values = self.coordinates(i)
+        return dict(zip(zip(xs.tolist(), ys.tolist()), values.tolist()))
+
+    def grid(self, i: int, width: int = None, height: int = None, **kwargs) -> Grid:
+        """Grid i as a Grid (see Grid.from_coordinates), of the archive dimensions by default."""
+        return Grid.from_coordinates(*self.coordinates(i), width=width or self.width,
+                                     height=height or self.height, **kwargs)
+
+    def grids(self, width: int = None, height: int = None, **kwargs):
+        """Iterates the Grids of the archive (see grid)."""
+        for i in range(len(self)):
+            yield self.grid(i, width, height, **kwargs)
+
+    def to_array(self, width: int = None, height: int = None, dtype = np.uint8) -> np.ndarray:
+        """All grids as a (grids x width x height) array, e.g. for dynamics.ensemble.simulate_ensemble."""
+        array = np.zeros((len(self), width or self.width, height or self.height), dtype=dtype)
+        members = np.repeat(np.arange(len(self)), np.diff(self.offsets))
+        array[members, self.xs, self.ys] = self.values
+        return array
+
+def save_init_grid_archive(grids: str | List[Dict] | Dict, filename,
+                           width: int = None, height: int = None, compressed: bool = True) -> InitGridArchive:
+    """
+    Converts initial grids once into a compact .npz archive of coordinate arrays plus offsets (see InitGridArchive).
+
+    grids: a save_init_grids JSON file (streamed, see iter_init_grid_dicts), or the grids as a list or
+        a dict by name of {(x, y): value} dicts.
+    """
+    if isinstance(grids, str):
+        items = iter_init_grid_dicts(grids)
+    elif isinstance(grids, dict):
+        items = grids.items()
+    else:
+        items = ((str(i), grid) for i, grid in enumerate(grids))
+    names, sizes, xs, ys, values = [], [], [], [], []
+    for name, grid in items:
+        for entity in grid:
+            if not (isinstance(entity, tuple) and len(entity) == 2):
+                raise ValueError(f"Grid {name} has key {entity}, not (x, y) coordinates.")
+        names.append(str(name))
+        sizes.append(len(grid))
+        xs.extend(x for x, _ in grid)
+        ys.extend(y for _, y in grid)
+        values.extend(grid.values())
+    archive = InitGridArchive(np.array(xs, dtype=np.int32), np.array(ys, dtype=np.int32),
+                              np.array(values) if values else np.zeros(0, dtype=np.uint8),
+                              np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64), names, width, height)
+    save = np.savez_compressed if compressed else np.savez
+    save(filename, xs=archive.xs, ys=archive.ys, values=archive.values, offsets=archive.offsets,
+         names=np.array(archive.names), shape=np.array([archive.width, archive.height]))
+    return archive
+
+def load_init_grid_archive(filename) -> InitGridArchive:
+    """Opens an archive of save_init_grid_archive."""
+    return InitGridArchive.load(filename)
+
+def dict_to_array(entities: Dict, width = None, height = None, dtype = float) -> np.ndarray:
+    """
+    (width, height) array of a dict of (x, y): value, missing cells are 0.
+        dtype can be set e.g. to np.uint8 for binary states (see dynamics.bitpacked.pack_grid).
+    """
     if not width:
         width = max(x for x, _ in entities.keys()) + 1
     if not height:
         height = max(y for _, y in entities.keys()) + 1
-    array = np.zeros((width, height))
+    array = np.zeros((width, height), dtype=dtype)
     for (x, y), value in entities.items():
         array[x, y] = value
     return array
@@ -81,10 +254,12 @@ def unique_connections(connections: List,
     Get unique connections from a list of connections.
     """
     unique_connections = []
+    seen = set()
     for (a,b) in connections:
-        if (a,b) not in unique_connections:
-            if (not undirected) or ((b,a) not in unique_connections):
+        if (a,b) not in seen:
+            if (not undirected) or ((b,a) not in seen):
                 unique_connections.append((a,b))
+                seen.add((a,b))
     return unique_connections
 
 def blobs(structure: Structure = None,
@@ -111,6 +286,9 @@ def blobs(structure: Structure = None,
         where each component is a list of entities.
 
     [1] https://www.geeksforgeeks.org/tarjan-algorithm-find-strongly-connected-components/
+
+    Structure.get_components finds the same components on label arrays (see structures.components),
+        which is much faster, blobs remains for custom connections_LUT.
     """
 
     if entities is None:
@@ -208,6 +386,19 @@ def entities_time_array(entities: Dict[Tuple, Dict[str, Any]],
     if (not width_height):
         width_height = (1 + max(x for x, _ in entities.keys()),
                         1 + max(y for _, y in entities.keys()))
+
+    if isinstance(entities, EntitiesView) and not ignore_empty and entities.history.base_name == base_name:
+        #Array store: scatter the whole (timesteps x entities) array at once
+        history = entities.history
+        coordinates = np.array(entities.entity_list).reshape(-1, 2)
+        arr = np.zeros((history.last_time_step + 1, width_height[0], width_height[1]))
+        rows = history.get_rows(max(history.initial_time_step, 0))
+        arr[history.last_time_step + 1 - len(rows):, coordinates[:, 0], coordinates[:, 1]] = rows
+        if not extra_dimension:
+            arr = arr.reshape(arr.shape[0], -1)
+        if return_column_names:
+            return arr, flattened_entities_order(width_height=width_height)
+        return arr
         
     num_entities = len(entities) if ignore_empty and not extra_dimension else width_height[0] * width_height[1]
     #Order: (0,0), (0,1), (0,2), ... (1,0), (1,1), (1,2), ... (2,0), ...